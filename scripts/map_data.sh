@@ -1,5 +1,3 @@
 cd $(dirname $0)/../src
 
-python prep.py
-python map_insilico.py
-python map_tariff.py
+python pipeline.py prep mapped
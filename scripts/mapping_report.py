@@ -43,6 +43,7 @@ def main():
     sys.path.insert(0, str(REPO / 'src'))
     from map_insilico import ADULT_SYMPTOM_MAP, CHILD_SYMPTOM_MAP, \
         NEONATE_SYMPTOM_MAP
+    from rules import Rule
 
     symptom_map = {
         'adult': ADULT_SYMPTOM_MAP,
@@ -72,6 +73,8 @@ def main():
                     if phmrc in coding:
                         value = coding[phmrc].get(value, value)
                 map_description = '{} {}'.format(func_name, value)
+            elif isinstance(func, Rule):
+                map_description = repr(func)
             else:
                 map_description = 'custom'
 
@@ -1,4 +1,3 @@
-REPO_DIR = $(dirname $0)/..
+cd $(dirname $0)/../src
 
-python $REPO_DIR/src/download.py
-$REPO_DIR/scripts/map_data.sh
+python pipeline.py download prep mapped
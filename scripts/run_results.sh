@@ -1,7 +1,3 @@
 cd $(dirname $0)/../src
 
-python cause_specific_results.py
-python annex_tables.py
-python figures.py
-python results.py
-python paper.py
+python pipeline.py paper
@@ -1,11 +1,14 @@
-SUBMIT_SCRIPT=$(dirname $0)/submit_analysis.sh
+SCHEDULER="python $(dirname $0)/../src/scheduler.py"
 SPLITS=500
+BACKEND=${1:-local}
 
 
-$SUBMIT_SCRIPT validate $SPLITS tariff phmrc
-$SUBMIT_SCRIPT validate $SPLITS insilico insilico
-$SUBMIT_SCRIPT default $SPLITS insilico insilico
+$SCHEDULER add validate -n $SPLITS -s tariff -c phmrc
+$SCHEDULER add validate -n $SPLITS -s insilico -c insilico
+$SCHEDULER add default -n $SPLITS -s insilico -c insilico
 
-$SUBMIT_SCRIPT validate $SPLITS tariff phmrc 1
-$SUBMIT_SCRIPT validate $SPLITS insilico insilico 1
-$SUBMIT_SCRIPT default $SPLITS insilico insilico 1
+$SCHEDULER add validate -n $SPLITS -s tariff -c phmrc --extended
+$SCHEDULER add validate -n $SPLITS -s insilico -c insilico --extended
+$SCHEDULER add default -n $SPLITS -s insilico -c insilico --extended
+
+$SCHEDULER run --backend $BACKEND
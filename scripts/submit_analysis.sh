@@ -17,19 +17,15 @@ LOG_DIR=$REPO_DIR/data/logs
 # Working directory in singularity container
 WORK_DIR=/home
 
+# Results are written to the partitioned results dataset
 if [[ "$EXTENDED" == "1" ]]; then
     CLF_PARAM="-p n_sim 12000"
     EXT="_ext"
-
-    if [[  "$ANALYSIS" == "default" ]]; then
-        OUT_DIR=$WORK_DIR/data/extended_default_insilico
-    else
-        OUT_DIR=$WORK_DIR/data/extended_"$CAUSES"_"$SYMPTOMS"
-    fi
+    OUT_DIR=$WORK_DIR/data/dataset_ext
 else
     CLF_PARAM=""
     EXT=""
-    OUT_DIR=$WORK_DIR/data/"$ANALYSIS"_"$CAUSES"_"$SYMPTOMS"
+    OUT_DIR=$WORK_DIR/data/dataset
 fi
 
 CLF=insilico
@@ -44,6 +40,15 @@ else
 fi
 
 for MODULE in adult child neonate; do
+
+# Draw the splits once so every job for the module uses the same splits
+PLAN_JNAME="$ANALYSIS"_"$CLF"_"$MODULE"_"$CAUSES"_"$SYMPTOMS$EXT"_plan
+qsub -N $PLAN_JNAME -P proj_va -o $LOG_DIR/$PLAN_JNAME \
+     -e $LOG_DIR/$PLAN_JNAME -l mem_free=2g \
+     $REPO_DIR/scripts/python_w_singularity.sh $REPO_DIR \
+     $WORK_DIR/src/analysis.py -a $ANALYSIS_ -m $MODULE --clf $CLF \
+     -c $CAUSES -s $SYMPTOMS --n-splits $SPLITS --plan-only
+
 for HCE in "" "--no-hce"; do
 for START in $(seq 0 $STEP $(echo $SPLITS -1 | bc)); do
 
@@ -54,6 +59,7 @@ for START in $(seq 0 $STEP $(echo $SPLITS -1 | bc)); do
     LOG=$LOG_DIR/$JNAME
     
     qsub -N $JNAME -P proj_va -o $LOG -e $LOG -pe multi_slot 5 -l mem_free=10g \
+         -hold_jid $PLAN_JNAME \
          $REPO_DIR/scripts/python_w_singularity.sh $REPO_DIR \
          $WORK_DIR/src/analysis.py -a $ANALYSIS_ -m $MODULE --clf $CLF \
          -c $CAUSES -s $SYMPTOMS $HCE --n-splits $SPLITS --subset $START $STOP \
@@ -2,8 +2,6 @@ from __future__ import print_function
 import argparse
 import os
 
-import pandas as pd
-
 from insilico import InsilicoClassifier
 from map_insilico import INSILICO_CAUSE_MAP
 from validation import (
@@ -14,7 +12,17 @@ from validation import (
     no_training_splits,
 )
 from prep import REPO_DIR, SITES, load_cleaned_file
-from mapping import mapped_filepath
+from mapping import load_mapped
+from store import SplitStore
+from plan import PLAN_DIR, load_plan, plan_filepath
+from dataset import DATASET_DIR, analysis_label, write_results
+
+
+# Arguments which change the results of a split. Completed splits are only
+# reused by runs which match on all of these.
+STORE_PARAMS = ['analysis', 'clf', 'params', 'module', 'symptoms', 'hce',
+                'cause_list', 'resample_test', 'resample_size', 'split_seed',
+                'test_size', 'holdout_n']
 
 
 def get_sites_and_causes(module, cause_list):
@@ -28,7 +36,8 @@ def get_sites_and_causes(module, cause_list):
         sites (series): encoded sites for each observation
         causes (series): gold standard cause for each observation
     """
-    df = load_cleaned_file(module)
+    df = load_cleaned_file(module, columns=['site', 'gs_text34', 'gs_text46'])
+    df = df.astype(object)
 
     # Sklearn model selectors expect numerically encoded group sequences
     # Sites are uses as the groups for the holdout model selector
@@ -55,9 +64,8 @@ def main(**kwargs):
     kwargs = {k: v for k, v in kwargs.items() if v is not None}
     clf = config_classifier(kwargs['clf'], dict(kwargs.get('params', [])))
 
-    filename = mapped_filepath(kwargs['symptoms'], kwargs['module'],
-                               hce=kwargs.get('hce', True))
-    symptoms = pd.read_csv(filename, index_col=0)
+    symptoms = load_mapped(kwargs['symptoms'], kwargs['module'],
+                           hce=kwargs.get('hce', True))
 
     sites, gs = get_sites_and_causes(kwargs['module'], kwargs['cause_list'])
 
@@ -81,17 +89,65 @@ def main(**kwargs):
     else:
         raise ValueError('Unknown analysis: "{}"'.format(analysis))
 
+    # The splits only depend on the causes, so every run for the same module
+    # and cause list shares one plan, drawn by whichever run needs it first.
+    # Runs with an output directory keep their plans in it.
+    plan = None
+    if kwargs.get('plan', True):
+        plan_params = dict(spliter_params, analysis=analysis,
+                           module=kwargs['module'],
+                           cause_list=kwargs['cause_list'],
+                           resample_test=validate_params['resample_test'],
+                           resample_size=validate_params['resample_size'],
+                           random_state=validate_params['random_state'])
+        plan_dir = kwargs.get('plan_dir')
+        if plan_dir is None:
+            plan_dir = os.path.join(kwargs['outdir'], 'plans') \
+                if kwargs.get('outdir') else PLAN_DIR
+        filepath = plan_filepath(analysis, kwargs['module'],
+                                 kwargs['cause_list'], plan_params, plan_dir)
+        plan = load_plan(filepath, gs, spliter, plan_params,
+                         validate_params['resample_test'],
+                         validate_params['resample_size'],
+                         validate_params['random_state'])
+        if kwargs.get('plan_only'):
+            print('Saved {} splits to {}'.format(len(plan), filepath))
+            return plan
+        spliter = plan.splits()
+        validate_params['resample_test'] = False
+
     try:
         os.makedirs(outdir, exist_ok=True)
     except OSError:
         pass
 
-    output = validate(symptoms, gs, clf, spliter, **validate_params)
-
-    filenames = ['predictions', 'csmf', 'ccc', 'accuracy']
-    for i, f in enumerate(filenames):
-        filename = '{}_{}.csv'.format('_'.join(name_tags), f)
-        output[i].to_csv(os.path.join(outdir, filename), index=False)
+    # Every split is checkpointed as soon as it finishes. The store is named
+    # without the subset so that runs over other ranges share the results.
+    store_dir = os.path.join(outdir, 'splits', '_'.join(name_tags[:-1]))
+    store_params = {k: kwargs.get(k) for k in STORE_PARAMS}
+    store_params['params'] = dict(kwargs.get('params', []))
+    # A redrawn plan has other splits under the same split ids, so each
+    # split is reused only if its positions are unchanged
+    digests = plan.split_digests() if plan is not None else None
+    if not kwargs.get('resume', True):
+        SplitStore(store_dir).clear()
+    store = SplitStore(store_dir, store_params, digests)
+
+    output = validate(symptoms, gs, clf, spliter, store=store,
+                      **validate_params)
+
+    if kwargs.get('format', 'parquet') == 'parquet':
+        label = analysis_label(analysis, kwargs['clf'], kwargs['cause_list'],
+                               kwargs['symptoms'])
+        hce_tag = 'w_hce' if kwargs.get('hce', True) else 'no_hce'
+        write_results(output, label, kwargs['module'], hce_tag,
+                      '_'.join(name_tags),
+                      root=kwargs.get('outdir', DATASET_DIR))
+    else:
+        filenames = ['predictions', 'csmf', 'ccc', 'accuracy']
+        for i, f in enumerate(filenames):
+            filename = '{}_{}.csv'.format('_'.join(name_tags), f)
+            output[i].to_csv(os.path.join(outdir, filename), index=False)
 
     return output
 
@@ -126,6 +182,8 @@ def get_params(**kwargs):
         'resample_test': kwargs.get('resample_test', True),
         'resample_size': kwargs.get('resample_size'),
         'subset': subset,
+        'random_state': kwargs.get('split_seed'),
+        'n_jobs': kwargs.get('n_jobs', 1),
     }
     spliter_params = {
         'n_splits': kwargs.get('n_splits'),
@@ -200,6 +258,10 @@ if __name__ == '__main__':
         help='Which set of causes should the classifier predict')
     parser.add_argument('-o', '--outdir', default=None,
                         help='Output directory for saved files')
+    parser.add_argument(
+        '-f', '--format', default='parquet', choices=['parquet', 'csv'],
+        help=('Save results to the partitioned Parquet dataset or to one CSV '
+              'per table'))
 
     # Classifier parameters
     parser.add_argument(
@@ -240,6 +302,24 @@ if __name__ == '__main__':
         '--holdout-n', type=int, default=1,
         help='Number of sites tp hold from the training split and use in test '
              'split. Max=5 (There are only six sites in the data.)')
+    parser.add_argument(
+        '--no-resume', action='store_false', dest='resume',
+        help='Discard checkpointed splits from previous runs and start over')
+    parser.add_argument(
+        '-j', '--n-jobs', type=int, default=1,
+        help='Number of splits to run in parallel. Each worker process holds '
+             'its own copy of the data and classifier.')
+    parser.add_argument(
+        '--no-plan', action='store_false', dest='plan',
+        help='Draw the splits for this run instead of using the shared '
+             'split plan')
+    parser.add_argument(
+        '--plan-only', action='store_true',
+        help='Draw and save the split plan without running any splits')
+    parser.add_argument(
+        '--plan-dir', default=None,
+        help='Directory of the split plans. Defaults to "plans" in the '
+             'output directory if one is given and to data/plans otherwise')
     args = parser.parse_args()
     print(args)
     main(**vars(args))
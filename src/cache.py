@@ -0,0 +1,156 @@
+"""Content-addressed on-disk cache.
+
+Values are pickled to files named by a hash of the inputs which produced
+them. When the total size of the cache exceeds the limit, the least recently
+used entries are removed. Reading an entry updates its modification time,
+which is used as the access time so that eviction does not depend on the
+filesystem recording access times.
+"""
+import hashlib
+import os
+import pickle
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CACHE_DIR = os.path.join(REPO_DIR, 'data', 'cache')
+
+
+def hash_inputs(*args):
+    """Return a hex digest which identifies the contents of the arguments.
+
+    Dataframes and series are hashed by their values and column labels,
+    ignoring the index. Other arguments are hashed by their ``repr``, so they
+    should be simple values such as strings, numbers, ``None`` or tuples.
+
+    Args:
+        *args: values which determine the cached result
+
+    Returns:
+        str
+    """
+    h = hashlib.sha256()
+    for arg in args:
+        if isinstance(arg, (pd.DataFrame, pd.Series)):
+            h.update(pd.util.hash_pandas_object(arg, index=False).values)
+            if isinstance(arg, pd.DataFrame):
+                h.update(repr(arg.columns.tolist()).encode())
+        elif isinstance(arg, np.ndarray):
+            h.update(np.ascontiguousarray(arg).tobytes())
+            h.update(repr((arg.dtype.str, arg.shape)).encode())
+        else:
+            h.update(repr(arg).encode())
+        h.update(b'\0')
+    return h.hexdigest()
+
+
+def atomic_write(filepath, write):
+    """Write a file which appears only once completely written
+
+    ``write`` is called with the path of a temporary file in the same
+    directory, which is then renamed to ``filepath``. Concurrent processes
+    never read a partially written file, processes which have memory-mapped
+    the previous version keep a consistent view of it, and an interrupted
+    write leaves no file behind.
+
+    Args:
+        filepath (str): destination. The directory is created if needed.
+        write (callable): writes the file, given its path
+    """
+    path = os.path.dirname(filepath) or '.'
+    if not os.path.exists(path):
+        os.makedirs(path, exist_ok=True)
+
+    fd, tmp = tempfile.mkstemp(dir=path, suffix='.tmp')
+    os.close(fd)
+    try:
+        write(tmp)
+        os.replace(tmp, filepath)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def atomic_pickle(value, filepath):
+    """Pickle a value with ``atomic_write``
+
+    Args:
+        value: any picklable object
+        filepath (str): destination. The directory is created if needed.
+    """
+    def write(tmp):
+        with open(tmp, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    atomic_write(filepath, write)
+
+
+class DiskCache(object):
+    """Least recently used cache of pickled values in a directory.
+
+    Args:
+        path (str): directory for the cache files. It is created if needed.
+        max_size (int): maximum total size of the cache in bytes
+    """
+    SUFFIX = '.pkl'
+
+    def __init__(self, path=CACHE_DIR, max_size=2 ** 30):
+        self.path = path
+        self.max_size = max_size
+
+    def filepath(self, key):
+        return os.path.join(self.path, key + self.SUFFIX)
+
+    def get(self, key, default=None):
+        """Return the cached value or ``default`` if it is not cached"""
+        filepath = self.filepath(key)
+        try:
+            with open(filepath, 'rb') as f:
+                value = pickle.load(f)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            return default
+        os.utime(filepath, None)
+        return value
+
+    def set(self, key, value):
+        """Store a value and evict old entries if the cache is too big"""
+        atomic_pickle(value, self.filepath(key))
+        self.evict()
+
+    def __contains__(self, key):
+        return os.path.exists(self.filepath(key))
+
+    def entries(self):
+        """Return (access time, size, path) for each entry, oldest first"""
+        entries = []
+        if not os.path.exists(self.path):
+            return entries
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(self.SUFFIX):
+                try:
+                    stat = entry.stat()
+                except OSError:  # removed by another process
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return sorted(entries)
+
+    def evict(self):
+        """Remove the least recently used entries until under the limit"""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, filepath in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(filepath)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        for _, _, filepath in self.entries():
+            os.remove(filepath)
@@ -4,11 +4,11 @@ import pandas as pd
 import numpy as np
 
 from prep import REPO_DIR
+from dataset import read_table
 import metrics
 
 
 REPO_DIR = Path(REPO_DIR)
-INPUT_DIR = REPO_DIR / 'data/results_phmrc_tariff'
 OUTPUT_FILE = REPO_DIR / 'data/table1.csv'
 
 def read_tariff_performance():
@@ -61,38 +61,35 @@ def read_tariff_performance():
 
 
 def calc_stats(df):
-    stats = (metrics.calc_sensitivity, metrics.calc_specificity,
-             metrics.calc_ccc)
+    cm = metrics.ConfusionMatrix(df.actual, df.prediction)
     return pd.concat([
-        pd.Series({cause: metric(cause, df.actual, df.prediction)
-                   for cause in df.actual.unique()},
-                  name=metric.__name__.split('_')[-1])
-        for metric in stats
+        cm.sensitivity().rename('sensitivity'),
+        cm.specificity().rename('specificity'),
+        cm.ccc().rename('ccc'),
     ], axis=1)
 
 
 def calc_median_and_ui_(df):
     pts = ('med', 'lb', 'ub')
-    out = []
     rs = np.random.RandomState(8675309)
-    for col in df.columns:
-        med, (lb, ub) = metrics.calc_median_and_ui(df[col], random_state=rs)
-        out.append(pd.Series([med, lb, ub], pts, name=col))
+    stats = metrics.bootstrap_median_and_ui([df[col] for col in df.columns],
+                                            random_state=rs)
+    out = pd.DataFrame(stats.T, index=pts, columns=df.columns)
 
-    return pd.concat(out, axis=1).stack().swaplevel().sort_index() \
+    return out.stack().swaplevel().sort_index() \
              .rename_axis(['metric', 'pts']).rename('value')
 
 
 def summarize(module, hce):
     hce_ = 'w_hce' if hce else 'no_hce'
-    filename = 'validate_insilico_{}_{}_phmrc_tariff_predictions.csv'.format(
-        module, hce_)
-    df = pd.read_csv(INPUT_DIR / filename)
+    df = read_table('predictions', analysis='phmrc_tariff', module=module,
+                    hce=hce_)
     if 'split' not in df.columns:
         df['split'] = np.repeat(np.arange(500), df.shape[0] / 500)
 
-    stats = df.groupby('split').apply(calc_stats) \
-              .groupby(level=1).apply(calc_median_and_ui_) \
+    cm = metrics.BatchConfusionMatrix(df.split, df.actual, df.prediction)
+    stats = cm.to_frame(['sensitivity', 'specificity', 'ccc']) \
+              .groupby(level='cause').apply(calc_median_and_ui_) \
               .mul(100).round(1)
     stats.loc[:, ('prediction', 'all')] = df.prediction.value_counts() \
                                             .fillna(0).astype(int)
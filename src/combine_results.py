@@ -1,8 +1,17 @@
+"""Convert per-run CSV results into the partitioned results dataset.
+
+Runs saved with ``analysis.py --format csv`` write one CSV per table for each
+range of splits. This collects them into the Parquet dataset read by the
+results scripts.
+"""
 import itertools
+import os
 from pathlib import Path
 
 import pandas as pd
 
+from dataset import DATASET_DIR, EXTENDED_DATASET_DIR, write_table
+
 
 REPO = Path(__file__).resolve().parent.parent
 
@@ -13,32 +22,36 @@ outputs = ('accuracy', 'ccc', 'csmf', 'predictions')
 
 def combine(experiment, symptoms, causes, extended=False):
     results = 'extended' if extended else experiment
-    ext = '_ext' if extended else ''
     input_dir = REPO / 'data/{}_{}_{}'.format(results, causes, symptoms)
+    root = EXTENDED_DATASET_DIR if extended else DATASET_DIR
+    if not input_dir.exists():
+        print('No CSV results in {}'.format(input_dir))
+        return
 
     if experiment == 'validate':
-        output_dir = REPO / 'data/results_{}_{}{}'.format(causes, symptoms, ext)
+        label = '{}_{}'.format(causes, symptoms)
         input_tmp = '{}_insilico_{}_{}_{}_{}_*_{}.csv'
-        output_tmp = '{}_insilico_{}_{}_{}_{}_{}.csv'
     elif experiment == 'default':
-        output_dir = REPO / 'data/results_default_insilico{}'.format(ext)
+        label = 'default_insilico'
         input_tmp = '{}_insilico_{}_{}_*_{}.csv'
-        output_tmp = '{}_insilico_{}_{}_{}.csv'
     else:
         raise ValueError
-    output_dir.mkdir(parents=True, exist_ok=True)
 
     for module, hce, output in itertools.product(modules, hces, outputs):
         tags = [experiment, module, hce]
         if experiment == 'validate':
             tags.extend([causes, symptoms])
         tags.append(output)
-        pd.concat([
+        df = pd.concat([
             pd.read_csv(f) for f in input_dir.glob(input_tmp.format(*tags))
-        ]).to_csv(REPO / output_dir / output_tmp.format(*tags), index=False)
+        ])
+        write_table(df, output, label, module, hce, 'combined', root=root)
 
 
-if __name__ == '__main__':
+def main():
+    # Create the dataset even without CSV results, so the pipeline stage
+    # always has its output
+    os.makedirs(DATASET_DIR, exist_ok=True)
     combine('validate', 'tariff', 'phmrc')
     combine('validate', 'insilico', 'insilico')
     combine('default', 'insilico', 'insilico')
@@ -46,3 +59,7 @@ if __name__ == '__main__':
     combine('validate', 'insilico', 'insilico', extended=True)
     # TODO: fix so that passed params are intelligible (https://xkcd.com/1695/)
     combine('default', 'insilico', 'default', extended=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+"""Partitioned Parquet dataset of validation results.
+
+Each of the four tables returned by ``validation.validate`` is stored as a
+separate hive-partitioned Parquet dataset::
+
+    <root>/<table>/analysis=<analysis>/module=<module>/hce=<hce>/<name>.parquet
+
+The analysis label identifies the classifier and training data, for example
+``phmrc_tariff`` or ``default_insilico``. Cause columns are stored as
+dictionary encoded (categorical) strings. Readers filter on the partition
+columns, so reading the accuracy of one module only opens the files for that
+module and never parses the much larger predictions table.
+
+A partition may hold a file per run, such as the combined CSV results and
+runs of ranges of splits. Readers take each split from the newest file.
+
+Reading and writing requires pyarrow.
+"""
+import os
+
+import pandas as pd
+
+try:
+    import pyarrow  # noqa: F401
+except ImportError:
+    pyarrow = None
+
+from cache import atomic_write
+from prep import REPO_DIR
+
+
+DATASET_DIR = os.path.join(REPO_DIR, 'data', 'dataset')
+EXTENDED_DATASET_DIR = os.path.join(REPO_DIR, 'data', 'dataset_ext')
+TABLES = ('predictions', 'csmf', 'ccc', 'accuracy')
+PARTITIONS = ('analysis', 'module', 'hce')
+CATEGORICAL = {
+    'predictions': ['actual', 'prediction'],
+    'csmf': ['cause'],
+}
+
+
+def check_pyarrow():
+    if pyarrow is None:
+        raise ImportError('pyarrow is required to read and write the results '
+                          'dataset')
+
+
+def analysis_label(analysis, clf, cause_list, symptoms):
+    """Return the label used to partition results by analysis
+
+    Args:
+        analysis (str): 'validate', 'in-sample', or 'no-train'
+        clf (str): name of the classifier
+        cause_list (str): 'insilico', or 'phmrc'
+        symptoms (str): 'insilico', or 'tariff'
+
+    Returns:
+        str
+    """
+    if analysis == 'validate':
+        return '{}_{}'.format(cause_list, symptoms)
+    elif analysis == 'in-sample':
+        return 'in_sample_{}_{}'.format(cause_list, symptoms)
+    elif analysis == 'no-train':
+        return 'default_{}'.format(clf)
+    else:
+        raise ValueError('Unknown analysis: "{}"'.format(analysis))
+
+
+def partition_dir(table, analysis, module, hce, root=DATASET_DIR):
+    parts = ['{}={}'.format(k, v)
+             for k, v in zip(PARTITIONS, (analysis, module, hce))]
+    return os.path.join(root, table, *parts)
+
+
+def write_table(df, table, analysis, module, hce, name, root=DATASET_DIR):
+    """Write one table to a partition of the dataset
+
+    An existing file with the same name is replaced. The new file appears
+    only once it is completely written.
+
+    Args:
+        df (dataframe): one of the tables returned by ``validate``
+        table (str): name of the table
+        analysis (str): analysis label, see ``analysis_label``
+        module (str): 'adult', 'child', or 'neonate'
+        hce (str): 'w_hce' or 'no_hce'
+        name (str): file name within the partition
+        root (str): directory of the dataset
+
+    Returns:
+        str: path of the written file
+    """
+    check_pyarrow()
+    if table not in TABLES:
+        raise ValueError('Unknown table: "{}"'.format(table))
+
+    df = df.reset_index(drop=True)
+    for col in CATEGORICAL.get(table, []):
+        df[col] = df[col].astype(str).astype('category')
+
+    path = partition_dir(table, analysis, module, hce, root)
+    filepath = os.path.join(path, name + '.parquet')
+    atomic_write(filepath,
+                 lambda tmp: df.to_parquet(tmp, engine='pyarrow', index=False))
+    return filepath
+
+
+def write_results(output, analysis, module, hce, name, root=DATASET_DIR):
+    """Write the four tables returned by ``validate``
+
+    Args:
+        output (tuple of dataframes): predictions, csmf, ccc and accuracy
+        analysis (str): analysis label, see ``analysis_label``
+        module (str): 'adult', 'child', or 'neonate'
+        hce (str): 'w_hce' or 'no_hce'
+        name (str): file name within each partition
+        root (str): directory of the dataset
+    """
+    for table, df in zip(TABLES, output):
+        write_table(df, table, analysis, module, hce, name, root)
+
+
+def read_table(table, columns=None, root=DATASET_DIR, **filters):
+    """Read a table from the dataset
+
+    Filters are applied to the partition columns before any file is opened.
+
+    A partition may hold several files, for example the combined CSV results
+    and a later run of some of the splits, or runs of overlapping ranges of
+    splits. Each split is read from the most recently written file which has
+    it, so no split is counted twice. A file without a split column holds
+    every split of its partition.
+
+    Args:
+        table (str): name of the table
+        columns (list): columns to read. Partition columns may be included.
+            Defaults to all columns.
+        root (str): directory of the dataset
+        **filters: partition column -> value or list of values to keep
+
+    Returns:
+        dataframe: partition columns are returned as strings
+    """
+    check_pyarrow()
+    import pyarrow.dataset as ds
+
+    if table not in TABLES:
+        raise ValueError('Unknown table: "{}"'.format(table))
+    unknown = set(filters).difference(PARTITIONS)
+    if unknown:
+        raise ValueError('Can only filter on partitions: {}'.format(unknown))
+
+    expression = None
+    for col, value in filters.items():
+        if not isinstance(value, (list, tuple, set)):
+            value = [value]
+        predicate = ds.field(col).isin([str(v) for v in value])
+        if expression is None:
+            expression = predicate
+        else:
+            expression = expression & predicate
+
+    dataset = ds.dataset(os.path.join(root, table), format='parquet',
+                         partitioning='hive')
+    partitions = {}
+    for fragment in dataset.get_fragments(filter=expression):
+        directory = os.path.dirname(fragment.path)
+        partitions.setdefault(directory, []).append(fragment)
+
+    frames = []
+    for directory in sorted(partitions):
+        fragments = sorted(partitions[directory], reverse=True,
+                           key=lambda f: (os.stat(f.path).st_mtime_ns, f.path))
+        keys = ds.get_partition_keys(fragments[0].partition_expression)
+        keys = {col: keys[col] for col in PARTITIONS if col in keys}
+        seen = set()
+        for fragment in fragments:
+            names = fragment.physical_schema.names
+            if columns is not None:
+                names = [col for col in names
+                         if col in columns or col == 'split']
+            df = fragment.to_table(columns=names).to_pandas()
+            if 'split' not in df:
+                if not seen:
+                    frames.append(df.assign(**keys))
+                    break
+                continue
+            df = df[~df.split.isin(seen)]
+            seen.update(df.split.unique())
+            frames.append(df.assign(**keys))
+
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    df = pd.concat(frames, ignore_index=True)
+    for col in CATEGORICAL.get(table, []):
+        if col in df:
+            df[col] = df[col].astype('category')
+    for col in PARTITIONS:
+        if col in df:
+            df[col] = df[col].astype(str)
+    if columns is not None:
+        df = df[columns]
+    return df
@@ -0,0 +1,215 @@
+from __future__ import division
+import math
+
+import numpy as np
+from scipy.special import kv
+
+
+def spectrum0_ar(x):
+    """Estimate the spectral density at frequency zero of a chain.
+
+    This is a port of ``spectrum0.ar`` from the R package coda. An
+    autoregressive model is fit to the chain using the Yule-Walker equations
+    with the order selected by AIC. The spectral density at zero is derived
+    from the innovation variance and the AR coefficients:
+
+    .. math::
+        S(0) = \\frac{\\sigma^2}{(1 - \\sum_k \\phi_k)^2}
+
+    Args:
+        x (array): one dimensional sequence of draws
+
+    Returns:
+        float
+    """
+    x = np.asarray(x, dtype=float)
+    n = len(x)
+    if n < 2:
+        return float('nan')
+
+    # A chain with a perfectly linear trend (including a constant chain) has
+    # no variability left to model
+    z = np.arange(1, n + 1)
+    residuals = x - np.polyval(np.polyfit(z, x, 1), z)
+    if np.allclose(residuals.std(ddof=1), 0):
+        return 0.
+
+    xc = x - x.mean()
+    order_max = int(min(n - 1, math.floor(10 * math.log10(n))))
+    acov = np.array([xc[:n - k].dot(xc[k:]) / n
+                     for k in range(order_max + 1)])
+
+    # Levinson-Durbin recursion keeping the coefficients of every order
+    # so the order with the minimum AIC can be selected afterwards
+    var = acov[0]
+    phi = np.zeros(0)
+    aic = [n * math.log(var)]
+    fits = [(phi, var)]
+    for k in range(1, order_max + 1):
+        pacf = (acov[k] - phi.dot(acov[1:k][::-1])) / var
+        phi = np.append(phi - pacf * phi[::-1], pacf)
+        var = var * (1 - pacf ** 2)
+        if var <= 0:
+            break
+        aic.append(n * math.log(var) + 2 * k)
+        fits.append((phi, var))
+
+    order = int(np.argmin(aic))
+    phi, var = fits[order]
+    var_pred = var * n / (n - (order + 1))
+    return var_pred / (1 - phi.sum()) ** 2
+
+
+def pcramer(q, eps=1e-5):
+    """Distribution function of the Cramer-von Mises statistic.
+
+    Port of ``pcramer`` from the R package coda.
+
+    Args:
+        q (float): value of the statistic
+        eps (float): accuracy requirement
+
+    Returns:
+        float
+    """
+    if q <= 0:
+        return 0.
+    log_eps = math.log(eps)
+    out = 0.
+    for k in range(4):
+        z = (math.gamma(k + 0.5) * math.sqrt(4 * k + 1) /
+             (math.gamma(k + 1) * math.pi ** 1.5 * math.sqrt(q)))
+        u = (4 * k + 1) ** 2 / (16 * q)
+        if u <= -log_eps:
+            out += z * math.exp(-u) * kv(0.25, u)
+    return out
+
+
+def heidel_diag(chain, eps=0.1, pvalue=0.05):
+    """Heidelberger and Welch's convergence diagnostic for a single chain.
+
+    This is a port of ``heidel.diag`` from the R package coda which is used
+    by ``csmf.diag`` in the InSilicoVA package. The stationarity test
+    iteratively discards the first 10%, 20%, ... 50% of the chain until the
+    Cramer-von Mises test fails to reject stationarity. If a stationary
+    portion is found, the half-width test checks that the mean is estimated
+    with sufficient accuracy.
+
+    Args:
+        chain (array): one dimensional sequence of draws
+        eps (float): target value for the ratio of half-width to mean
+        pvalue (float): significance level of the stationarity test
+
+    Returns:
+        tuple:
+            * stationary (bool): passed the stationarity test
+            * halfwidth (bool): passed the half-width test
+    """
+    chain = np.asarray(chain, dtype=float)
+    n_total = len(chain)
+    starts = np.arange(0, n_total // 2 + 1, max(n_total // 10, 1))
+
+    s0 = spectrum0_ar(chain[(n_total - 1) // 2:])
+    stationary = False
+    for start in starts:
+        y = chain[start:]
+        n = len(y)
+        ybar = y.mean()
+        b = np.cumsum(y) - ybar * np.arange(1, n + 1)
+        stat = (b * b / (n * s0)).sum() / n if s0 else float('nan')
+        stationary = bool(np.isfinite(stat) and pcramer(stat) < 1 - pvalue)
+        if stationary:
+            break
+
+    if not stationary:
+        return False, False
+
+    halfwidth = 1.96 * math.sqrt(spectrum0_ar(y) / n)
+    return True, bool(ybar and abs(halfwidth / ybar) <= eps)
+
+
+def csmf_diag(csmf, conv_csmf=0.02):
+    """Test convergence of CSMF draws from a single chain.
+
+    This reproduces ``csmf.diag(..., test='heidel', verbose=FALSE)`` from the
+    InSilicoVA package. Only causes with a mean CSMF above ``conv_csmf`` are
+    tested because the diagnostic is unstable for small proportions.
+
+    Args:
+        csmf (array): iterations by causes matrix of CSMF draws
+        conv_csmf (float): minimum mean CSMF of causes which are tested
+
+    Returns:
+        bool: all tested causes passed both parts of the diagnostic
+    """
+    csmf = np.asarray(csmf, dtype=float)
+    tested = csmf[:, csmf.mean(axis=0) > conv_csmf]
+    return all(all(heidel_diag(tested[:, j])) for j in range(tested.shape[1]))
+
+
+def gelman_rubin(chains):
+    """Gelman and Rubin's potential scale reduction factor.
+
+    Compares the variance between chains to the variance within chains. This
+    is the point estimate from ``gelman.diag`` in the R package coda, including
+    the correction for sampling variability of the variance estimates. Values
+    close to one indicate the chains have mixed.
+
+    Args:
+        chains (array): chains by iterations array, optionally with a third
+            dimension for multiple parameters
+
+    Returns:
+        float or array: statistic for each parameter
+    """
+    chains = np.asarray(chains, dtype=float)
+    m, n = chains.shape[:2]
+    means = chains.mean(axis=1)
+    variances = chains.var(axis=1, ddof=1)
+
+    w = variances.mean(axis=0)
+    b = n * means.var(axis=0, ddof=1)
+    v = (n - 1) / n * w + (1 + 1 / m) * b / n
+
+    # Satterthwaite approximation of the degrees of freedom of v
+    var_w = variances.var(axis=0, ddof=1) / m
+    var_b = 2 * b ** 2 / (m - 1)
+    cov_wb = n / m * (_cov(variances, means ** 2) -
+                      2 * means.mean(axis=0) * _cov(variances, means))
+    var_v = ((n - 1) ** 2 * var_w + (1 + 1 / m) ** 2 * var_b +
+             2 * (n - 1) * (1 + 1 / m) * cov_wb) / n ** 2
+    with np.errstate(invalid='ignore', divide='ignore'):
+        df = 2 * v ** 2 / var_v
+        return np.sqrt((df + 3) / (df + 1) * v / w)
+
+
+def _cov(a, b):
+    """Sample covariance of matching columns"""
+    return ((a - a.mean(axis=0)) * (b - b.mean(axis=0))).sum(axis=0) / \
+        (len(a) - 1)
+
+
+def effective_sample_size(chains):
+    """Effective sample size summed over chains.
+
+    Port of ``effectiveSize`` from the R package coda. The effective size of
+    each chain is the number of iterations scaled by the ratio of the
+    variance to the spectral density at zero.
+
+    Args:
+        chains (array): chains by iterations array, optionally with a third
+            dimension for multiple parameters
+
+    Returns:
+        float or array: effective sample size for each parameter
+    """
+    chains = np.asarray(chains, dtype=float)
+    n = chains.shape[1]
+    flat = chains.reshape(chains.shape[0], n, -1)
+    ess = np.zeros(flat.shape[2])
+    for chain in flat:
+        for j in range(flat.shape[2]):
+            spec = spectrum0_ar(chain[:, j])
+            if spec:
+                ess[j] += n * chain[:, j].var(ddof=1) / spec
+    return ess.reshape(chains.shape[2:]) if chains.ndim > 2 else ess[0]
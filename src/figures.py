@@ -12,7 +12,8 @@ import seaborn as sns
 
 from results import load_results
 from paper import PAPER_DIR
-from cause_specific_results import INPUT_DIR, REPO_DIR
+from cause_specific_results import REPO_DIR
+from dataset import read_table
 from annex_tables import prep_icds
 
 sns.set()
@@ -151,9 +152,9 @@ def plot_all_heatmaps():
 def plot_heatmap(module, hce):
     # import pdb; pdb.set_trace()
     icds = prep_icds().loc[module.title()].sort_values()
-    filename = 'validate_insilico_{}_{}_phmrc_tariff_predictions.csv'
     hce_ = 'w_hce' if hce else 'no_hce'
-    df = pd.read_csv(INPUT_DIR / filename.format(module, hce_))
+    df = read_table('predictions', columns=['actual', 'prediction'],
+                    analysis='phmrc_tariff', module=module, hce=hce_)
 
     data = pd.crosstab(
         df.actual.rename('True Cause'),
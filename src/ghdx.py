@@ -0,0 +1,294 @@
+"""Load the PHMRC tables from the GHDx database with a local snapshot cache.
+
+The PHMRC tables are read from the project's PostgreSQL database through an
+SSH tunnel. Opening a tunnel and an engine takes several seconds, so a
+``GHDxLoader`` opens them once and keeps them for the life of the process.
+The engine's connection pool is reused by every query.
+
+Every table read from the database is saved as a Parquet snapshot in
+``data/ghdx/snapshots``. The snapshot file is named after the table and the
+checksum of its contents, and a manifest records the current snapshot of
+each table. Later loads, in this or any other process, read the snapshot
+without connecting to the database. Use ``refresh=True`` to read the table
+from the database again.
+
+The loader may be pointed at a local stand-in for the database, such as a
+SQLite or DuckDB file with tables of the same names, by passing a
+SQLAlchemy URL or setting the ``GHDX_DB_URL`` environment variable::
+
+    $ GHDX_DB_URL=sqlite:///data/ghdx/phmrc.sqlite python src/prep.py
+
+Snapshots of a stand-in are kept in a subdirectory named by a digest of its
+URL, so they are never read in place of the tables of the project database.
+
+Reading snapshots requires pyarrow.
+"""
+import atexit
+import hashlib
+import json
+import os
+
+import pandas as pd
+import sqlalchemy as sa
+
+from cache import atomic_write
+from download import GHDX_DATA_DIR
+
+
+SNAPSHOT_DIR = os.path.join(GHDX_DATA_DIR, 'snapshots')
+MANIFEST = 'manifest.json'
+SCHEMA = 'source_phmrc'
+TABLES = {
+    'codebook': 'ihme_phmrc_va_data_codebook_y2013m09d11_0',
+    'adult': 'ihme_phmrc_va_data_adult_y2013m09d11_1',
+    'child': 'ihme_phmrc_va_data_child_y2013m09d11_2',
+    'neonate': 'ihme_phmrc_va_data_neonate_y2013m09d11_1',
+}
+
+
+def table_name(module):
+    """Return the database table of a module
+
+    Args:
+        module (str): 'adult', 'child', 'neonate' or 'codebook'
+
+    Returns:
+        str
+    """
+    try:
+        return TABLES[module.lower()]
+    except KeyError:
+        raise ValueError('Unknown module: "{}"'.format(module))
+
+
+def source_key(url):
+    """Return a short digest which identifies a database URL
+
+    The password is not part of the digest, so it can change without
+    discarding the snapshots.
+    """
+    url = sa.engine.make_url(url).render_as_string(hide_password=True)
+    return hashlib.sha256(url.encode()).hexdigest()[:12]
+
+
+class GHDxLoader(object):
+    """Read PHMRC tables with one pooled engine and a snapshot cache.
+
+    Args:
+        url (str): SQLAlchemy URL of a database with the PHMRC tables. If
+            None, the ``GHDX_DB_URL`` environment variable is used, and if
+            that is not set the project database is reached through an SSH
+            tunnel.
+        schema (str): schema of the tables. Defaults to the schema of the
+            project database when using the tunnel and none otherwise.
+        snapshot_dir (str): directory of the snapshots of the project
+            database. Snapshots of other databases are saved in a
+            subdirectory, see ``source_key``.
+    """
+
+    def __init__(self, url=None, schema=None, snapshot_dir=SNAPSHOT_DIR):
+        self.url = url or os.environ.get('GHDX_DB_URL')
+        if schema is None and self.url is None:
+            schema = SCHEMA
+        self.schema = schema
+        self.snapshot_dir = snapshot_dir
+        if self.url is not None:
+            self.snapshot_dir = os.path.join(snapshot_dir,
+                                             source_key(self.url))
+        self.tunnel = None
+        self._engine = None
+        self._pid = None
+
+    @property
+    def engine(self):
+        """SQLAlchemy engine, created on first use in each process
+
+        Pooled connections can not be shared with forked processes, so a
+        child process opens its own engine.
+        """
+        if self._engine is None or self._pid != os.getpid():
+            self._engine = sa.create_engine(self.connection_url(),
+                                            pool_pre_ping=True)
+            self._pid = os.getpid()
+            atexit.register(self.close)
+        return self._engine
+
+    def connection_url(self):
+        if self.url is not None:
+            return self.url
+
+        # Only needed for the project database
+        from sshtunnel import SSHTunnelForwarder
+        from download import SSH_CONFIG, DB_CONFIG
+
+        if self.tunnel is None or not self.tunnel.is_active:
+            self.tunnel = SSHTunnelForwarder(
+                (SSH_CONFIG['hostname'], 22),
+                ssh_username=SSH_CONFIG['username'],
+                ssh_password=SSH_CONFIG['password'],
+                remote_bind_address=(DB_CONFIG['host'], 5432))
+            self.tunnel.start()
+        return sa.engine.URL.create(
+            'postgresql+psycopg2', username=DB_CONFIG['user'],
+            password=DB_CONFIG['password'], host='127.0.0.1',
+            port=self.tunnel.local_bind_port, database=DB_CONFIG['database'])
+
+    def close(self):
+        """Close pooled connections and the tunnel"""
+        if self._engine is not None and self._pid == os.getpid():
+            self._engine.dispose()
+        self._engine = None
+        if self.tunnel is not None:
+            self.tunnel.stop()
+            self.tunnel = None
+
+    def read_sql(self, module, columns=None, chunksize=None):
+        """Read a table from the database
+
+        Only the requested columns are selected by the query.
+
+        Args:
+            module (str): 'adult', 'child', 'neonate' or 'codebook'
+            columns (list): columns to read. Defaults to all columns.
+            chunksize (int): if given, return an iterator of dataframes
+                with at most this many rows
+
+        Returns:
+            (dataframe or iterator of dataframes)
+        """
+        table = sa.table(table_name(module), schema=self.schema)
+        if columns is None:
+            query = sa.select(sa.text('*')).select_from(table)
+        else:
+            query = sa.select(*map(sa.column, columns)).select_from(table)
+        if chunksize is not None:
+            return self.iter_sql(query, chunksize)
+        with self.engine.connect() as conn:
+            return pd.read_sql(query, conn)
+
+    def iter_sql(self, query, chunksize):
+        # The connection stays checked out until the last chunk is read
+        with self.engine.connect() as conn:
+            for chunk in pd.read_sql(query, conn, chunksize=chunksize):
+                yield chunk
+
+    def manifest(self):
+        """Return the checksum of the current snapshot of each table"""
+        filepath = os.path.join(self.snapshot_dir, MANIFEST)
+        if not os.path.exists(filepath):
+            return {}
+        with open(filepath) as f:
+            return json.load(f)
+
+    def snapshot_filepath(self, module, checksum):
+        name = '{}_{}.parquet'.format(table_name(module), checksum[:16])
+        return os.path.join(self.snapshot_dir, name)
+
+    def snapshot(self, module):
+        """Return the path of the current snapshot of a table or None"""
+        checksum = self.manifest().get(table_name(module))
+        if checksum is None:
+            return None
+        filepath = self.snapshot_filepath(module, checksum)
+        if not os.path.exists(filepath):
+            return None
+        return filepath
+
+    def save_snapshot(self, module, df):
+        """Save a table as the current snapshot
+
+        The snapshot is named after its checksum, so readers of an earlier
+        snapshot are not affected.
+
+        Returns:
+            str: path of the snapshot
+        """
+        data = df.to_parquet(None, engine='pyarrow', index=False)
+        checksum = hashlib.sha256(data).hexdigest()
+        filepath = self.snapshot_filepath(module, checksum)
+
+        def write_snapshot(tmp):
+            with open(tmp, 'wb') as f:
+                f.write(data)
+
+        def write_manifest(tmp):
+            with open(tmp, 'w') as f:
+                json.dump(manifest, f, indent=2, sort_keys=True)
+
+        atomic_write(filepath, write_snapshot)
+        manifest = self.manifest()
+        manifest[table_name(module)] = checksum
+        atomic_write(os.path.join(self.snapshot_dir, MANIFEST),
+                     write_manifest)
+        return filepath
+
+    def load(self, module, columns=None, chunksize=None, refresh=False):
+        """Load a PHMRC table
+
+        Only the requested columns are read, from the snapshot if there is
+        one and otherwise by the database query. A snapshot is only saved
+        when the whole table is read from the database.
+
+        Args:
+            module (str): 'adult', 'child', 'neonate' or 'codebook'
+            columns (list): columns to read. Defaults to all columns.
+            chunksize (int): if given, return an iterator of dataframes
+                with at most this many rows
+            refresh (bool): read the table from the database even if there
+                is a snapshot
+
+        Returns:
+            (dataframe or iterator of dataframes)
+        """
+        filepath = None if refresh else self.snapshot(module)
+        if filepath is not None:
+            if chunksize is not None:
+                return iter_parquet(filepath, columns, chunksize)
+            return pd.read_parquet(filepath, engine='pyarrow',
+                                   columns=columns)
+        if columns is not None or chunksize is not None:
+            return self.read_sql(module, columns, chunksize)
+        df = self.read_sql(module)
+        self.save_snapshot(module, df)
+        return df
+
+
+def iter_parquet(filepath, columns, chunksize):
+    """Yield dataframes of at most ``chunksize`` rows from a snapshot"""
+    import pyarrow.parquet as pq
+    with pq.ParquetFile(filepath) as f:
+        for batch in f.iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+
+
+# Loader shared by every call to ``load_ghdx_data`` in a process
+LOADER = GHDxLoader()
+
+
+def load_ghdx_data(module, columns=None, chunksize=None, refresh=False):
+    """Load a PHMRC table with the shared loader
+
+    Args:
+        module (str): 'adult', 'child', 'neonate' or 'codebook'
+        columns (list): columns to read. Defaults to all columns.
+        chunksize (int): if given, return an iterator of dataframes with at
+            most this many rows
+        refresh (bool): read the table from the database even if there is a
+            snapshot
+
+    Returns:
+        (dataframe or iterator of dataframes)
+    """
+    return LOADER.load(module, columns, chunksize, refresh)
+
+
+def save_snapshots(refresh=False):
+    """Save a snapshot of every PHMRC table
+
+    Args:
+        refresh (bool): read tables from the database even if there are
+            snapshots
+    """
+    for module in TABLES:
+        LOADER.load(module, refresh=refresh)
+    print('Snapshots are saved in {}'.format(LOADER.snapshot_dir))
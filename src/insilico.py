@@ -3,11 +3,46 @@ import re
 from warnings import warn
 
 import numpy as np
-from rpy2 import robjects
-from rpy2.rinterface_lib.sexp import NULLType as RNULLType
-from rpy2.robjects.packages import importr
-from rpy2.robjects import pandas2ri
-ri2py = pandas2ri
+import pandas as pd
+try:
+    from rpy2 import robjects
+    from rpy2.rinterface_lib.sexp import NULLType as RNULLType
+    from rpy2.robjects.packages import importr
+    from rpy2.robjects import pandas2ri
+    from rpy2.robjects.conversion import localconverter
+    ri2py = pandas2ri
+except ImportError:  # the numpy engine does not require R
+    robjects = pandas2ri = ri2py = importr = RNULLType = None
+    localconverter = None
+
+from cache import DiskCache, hash_inputs
+import sampler
+from symptoms import as_frame, symptom_encoding
+
+# Converted R packages keyed by name. Loading a package through rpy2 is slow
+# (InSilicoVA also starts a JVM) so each process only does this once.
+R_PACKAGES = {}
+
+# Compiled R functions keyed by source
+R_FUNCTIONS = {}
+
+# Build a data frame from symptoms sent as a single buffer of bytes with
+# values shifted by one (0 missing, 1 no, 2 yes) in column-major order. The
+# first column holds the IDs, as expected by the InSilicoVA functions.
+R_SYMPTOM_FRAME = """
+function(codes, nrow, rows, cols, numeric, id_col) {
+    m <- matrix(as.integer(codes) - 1L, nrow = nrow,
+                dimnames = list(rows, cols))
+    if (!numeric) {
+        m <- matrix(c(".", "", "Y")[m + 2L], nrow = nrow,
+                    dimnames = list(rows, cols))
+    }
+    df <- data.frame(rows, m, row.names = rows, check.names = FALSE,
+                     stringsAsFactors = FALSE)
+    names(df)[1] <- id_col
+    df
+}
+"""
 
 
 class InsilicoClassifier(object):
@@ -54,6 +89,25 @@ class InsilicoClassifier(object):
             function
         learning_type (str): see ``type`` on the ``extract.prob`` R function
         n_level (int):  see ``nlevel.dev`` on the ``insilico.fit`` R function
+        engine (str): 'r' to call the InSilicoVA R package using rpy2 or
+            'numpy' to use the native implementation in ``sampler``. The
+            numpy engine requires training data and always treats the inputs
+            as a customized (non-InterVA) format.
+        n_chains (int): number of independent chains to run in parallel and
+            pool. Convergence is then assessed with the Gelman-Rubin
+            statistic. Only supported by the numpy engine.
+        n_jobs (int): number of processes used to run the chains. Defaults
+            to one per chain, up to the number of CPUs.
+        r_pool (rpool.RWorkerPool): pool of R processes. If provided, calls
+            to R from ``fit`` and ``predict`` are run by a worker in the pool
+            instead of the embedded R in this process.
+        prob_cache (cache.DiskCache or str): cache of the conditional
+            probabilities extracted during ``fit``, or the path to a cache
+            directory. Refitting with the same training data and learning
+            parameters reads the results from disk instead of recomputing.
+        top_k (int): also store the ``top_k`` most probable causes and their
+            probabilities for each observation as ``top_causes_`` when
+            predicting
 
     Attributes:
         R_PKG_NAME (str): name of the R package
@@ -89,6 +143,13 @@ class InsilicoClassifier(object):
         table_alpha_ (array): result from ``extract_prob``
         table_num_ (array): result from ``extract_prob``
         prob_base_dev_
+        rhat_ (series): Gelman-Rubin statistic for each cause from the last
+            prediction. Only available for the numpy engine with multiple
+            chains.
+        ess_ (series): effective sample size of the CSMF for each cause from
+            the last prediction. Only available for the numpy engine.
+        top_causes_ (dataframe): most probable causes and their probabilities
+            for each observation from the last prediction if ``top_k`` is set
     """
     R_PKG_NAME = 'InSilicoVA'
 
@@ -112,7 +173,13 @@ class InsilicoClassifier(object):
                  learning_type=None,
                  n_level=None,
                  symptoms=None,
-                 causes=None):
+                 causes=None,
+                 engine='r',
+                 n_chains=None,
+                 n_jobs=None,
+                 r_pool=None,
+                 prob_cache=None,
+                 top_k=None):
         self.update_cond_prob = update_cond_prob
         self.keep_prob_base_level = keep_prob_base_level
         self.external_sep = external_sep
@@ -134,7 +201,40 @@ class InsilicoClassifier(object):
         self.symptoms = symptoms
         self.causes = causes
 
-        self.r_insilico = self.get_r_insilico_package()
+        if engine not in ['r', 'numpy']:
+            raise ValueError('Unknown engine: "{}"'.format(engine))
+        self.engine = engine
+
+        if n_chains and n_chains > 1 and engine != 'numpy':
+            raise ValueError('Multiple chains are only supported by the '
+                             'numpy engine.')
+        self.n_chains = n_chains
+        self.n_jobs = n_jobs
+        self.r_pool = r_pool
+        if isinstance(prob_cache, str):
+            prob_cache = DiskCache(prob_cache)
+        self.prob_cache = prob_cache
+        self.top_k = top_k
+
+        # R is loaded in the worker processes when using a pool
+        if engine == 'r' and r_pool is None:
+            if robjects is None:
+                raise ImportError('rpy2 is required to use the R engine. '
+                                  'Use engine="numpy" instead.')
+            self.get_r_insilico_package()
+
+    @property
+    def r_insilico(self):
+        """The converted R package, loaded at most once per process"""
+        if self.engine != 'r':
+            return None
+        return self.get_r_insilico_package()
+
+    def __getstate__(self):
+        # The pool cannot be sent to its own workers
+        state = self.__dict__.copy()
+        state['r_pool'] = None
+        return state
 
     def fit(self, X, y=None):
         """Fit the estimator using training data.
@@ -144,7 +244,8 @@ class InsilicoClassifier(object):
         it is fit with the default causes, symptoms and probbase provided by
         the Insilico software. For InSilicoVA, training involves calculating
         the probability of symptoms conditional on the true cause: P(S|C).
-        This is performed in R using the method ``extract.prob``.
+        This is performed in R using the method ``extract.prob`` unless the
+        numpy engine is used.
 
         Args:
             X (dataframe): training symptom data. Symptoms should be
@@ -160,10 +261,21 @@ class InsilicoClassifier(object):
             extract_prob
         """
         # Remove previous predictions if refitting
-        for attr in ['y_pred', 'csmf', 'converged']:
+        for attr in ['y_pred', 'csmf', 'converged', 'rhat_', 'ess_',
+                     'top_causes_']:
             setattr(self, attr, None)
 
+        X = as_frame(X)
+
+        if self.engine == 'r' and self.r_pool is not None:
+            fitted = self.r_pool.fit(self, X, y)
+            fitted.r_pool = self.r_pool
+            self.__dict__.update(fitted.__dict__)
+            return self
+
         if X is None:
+            if self.engine == 'numpy':
+                raise ValueError('The numpy engine requires training data.')
             warn('No training data provided. Using Insilico defaults.')
             self.causes_ = self.get_insilico_causes()
             self.symptoms_ = self.get_insilico_symptoms()
@@ -194,8 +306,7 @@ class InsilicoClassifier(object):
         if not (X.index == y.index).all():
             raise ValueError('X and y must have matching indicies.')
 
-        if not (X.isin(['Y', '', '.']).all().all() or
-                X.isin([1, 0, -1]).all().all()):
+        if symptom_encoding(X) is None:
             raise ValueError('Symptoms are not properly encoded.')
 
         if self.symptoms:
@@ -212,11 +323,7 @@ class InsilicoClassifier(object):
         self.causes_ = list(np.sort(y.unique()))
 
         # Always train on numerically encoded data. This seems to work better.
-        try:
-            X = X.replace({'Y': 1, '': 0, '.': -1})
-        except TypeError:  # if all columns are already numeric
-            pass
-        X = X.astype(int)
+        X = encode_symptoms(X)
 
         params = {}
 
@@ -226,7 +333,24 @@ class InsilicoClassifier(object):
         if self.missingness_threshold and 0 <= self.missingness_threshold <= 1:
             params['missingness_threshold'] = self.missingness_threshold
 
-        probs = self.extract_prob(X, y, **params)
+        # The jitter applied by the numpy engine depends on the seed
+        key = hash_inputs(X, y, self.engine, sorted(params.items()),
+                          self.seed if self.engine == 'numpy' else None)
+        cached = self.prob_cache.get(key) if self.prob_cache else None
+        if cached is not None:
+            probs = sampler.InsilicoTrained(**cached)
+        else:
+            if self.engine == 'numpy':
+                probs = sampler.extract_prob(X, y, random_state=self.seed,
+                                             **params)
+            else:
+                probs = self.extract_prob(X, y, **params)
+
+            # Only the selected columns of the training data are needed
+            probs = sampler.InsilicoTrained(**probs._asdict())
+            probs = probs._replace(symps_train=probs.symps_train.iloc[:0])
+            if self.prob_cache:
+                self.prob_cache.set(key, probs._asdict())
 
         self.cond_prob_ = probs.cond_prob
         self.cond_prob_alpha_ = probs.cond_prob_alpha
@@ -235,12 +359,17 @@ class InsilicoClassifier(object):
         self.symptoms_touse_ = probs.symps_train.columns.tolist()
         self.gs_table_ = probs.cond_prob.columns.tolist()
 
-        insilico_causes = self.get_insilico_causes()
-        insilico_symptoms = self.get_insilico_symptoms()
+        # The native sampler only implements the customized format
+        if self.engine == 'numpy':
+            interva_format = False
+        else:
+            insilico_causes = self.get_insilico_causes()
+            insilico_symptoms = self.get_insilico_symptoms()
+            interva_format = (X.columns.isin(insilico_symptoms).all() and
+                              y.isin(insilico_causes).all())
 
         # Add training parameters which will be used by ``insilico.fit``
-        if (X.columns.isin(insilico_symptoms).all() and
-                y.isin(insilico_causes).all()):
+        if interva_format:
             warn('InterVA format detected')
             # The probbase file must be in the correct order with no
             # missingness
@@ -324,20 +453,34 @@ class InsilicoClassifier(object):
         See Also:
             insilico_fit
         """
-        if not (X.isin(['Y', '', '.']).all().all() or
-                X.isin([1, 0, -1]).all().all()):
+        X = as_frame(X)
+        if symptom_encoding(X) is None:
             raise ValueError('Symptoms are not properly encoded')
 
+        if self.engine == 'r' and self.r_pool is not None:
+            y_pred, csmf, self.converged_, self.top_causes_ = \
+                self.r_pool.predict(self, X)
+            return y_pred, csmf
+
         df = X.loc[:, X.columns.intersection(self.symptoms_touse_)]
         if not df.columns.any():
             raise ValueError('None of the columns from the training data '
                              'appear in the input data.')
 
+        if self.engine == 'numpy':
+            fitted = self.sampler_fit(df)
+            self.rhat_ = fitted.rhat
+            self.ess_ = fitted.ess
+            return self.summarize_fit(fitted.indiv_prob, fitted.csmf,
+                                      fitted.converged)
+
         # The R code does not adequately handle the numeric encoding for all
         # steps of the data cleaning for all combinations of input parameters,
-        # especially customized non-InterVA formats. Ensure that the data
-        # passed to R always uses the string encoding
-        df = df.replace({1: 'Y', 0: '', -1: '.'})
+        # especially customized non-InterVA formats. The data are sent to R as
+        # numeric codes and decoded into the string encoding on the R side
+        # (``isNumeric=False``) which is much faster than converting every
+        # cell in python.
+        df = encode_symptoms(df)
 
         # The R code does not adequately handle cases where there are no
         # injury symptoms endorsed and the default value `external.sep=TRUE`
@@ -352,9 +495,9 @@ class InsilicoClassifier(object):
                    'assault', 'venom', 'force', 'poison', 'inflict', 'suicide']
             if not df.columns.intersection(inj).any():
                 self.external_sep_ = False
-            elif not (df[df.columns.intersection(inj)] == 'Y').any().any():
+            elif not (df[df.columns.intersection(inj)] == 1).any().any():
                 self.external_sep_ = False
-            elif (df[df.columns.intersection(inj)] == 'Y').any(1).all():
+            elif (df[df.columns.intersection(inj)] == 1).any(axis=1).all():
                 raise ValueError('Insilico cannot handle datasets where all '
                                  'observations report injuries.')
 
@@ -366,11 +509,11 @@ class InsilicoClassifier(object):
         if not self.customized_:
             age_cols = ['elder', 'midage', 'adult', 'child', 'under5',
                         'infant', 'neonate']
-            has_age = (df[df.columns.intersection(age_cols)] == 'Y').any(1)
-            has_sex = (df[['male', 'female']] == 'Y').any(1)
+            has_age = (df[df.columns.intersection(age_cols)] == 1).any(axis=1)
+            has_sex = (df[['male', 'female']] == 1).any(axis=1)
             # Line 254 of insilico_core.r checks columns 23 to 223 for at
             # least one endorsement
-            has_symps = (df.iloc[:, 22:222] == 'Y').any(1)
+            has_symps = (df.iloc[:, 22:222] == 1).any(axis=1)
             valid = df.loc[has_age & has_sex & has_symps]
             if not len(valid):
                 raise ValueError('No observations have a complete set of '
@@ -450,11 +593,33 @@ class InsilicoClassifier(object):
         indiv.index = indiv.index.to_series().map(index_map)
 
         cause_renames = self.get_labels_map(self.causes_)
-        indiv.columns = indiv.columns.to_series().map(cause_renames)
-        csmf.columns = csmf.columns.to_series().map(cause_renames)
 
+        def cause_renames_(x):
+            return cause_renames.get(x, x)
+
+        indiv.columns = indiv.columns.map(cause_renames_)
+        csmf.columns = csmf.columns.map(cause_renames_)
+
+        return self.summarize_fit(indiv, csmf, fitted.converged)
+
+    def summarize_fit(self, indiv, csmf, converged):
+        """Summarize the posterior from either engine into predictions.
+
+        Args:
+            indiv (dataframe): observations by causes probabilities
+            csmf (dataframe): iterations by causes CSMF draws
+            converged (bool): result of the convergence diagnostic
+
+        Returns:
+            predictions:
+
+                * indiviual (series)
+                * csmf (series)
+        """
         # Take the most probable prediction as the individual level prediction
-        y_pred = indiv.apply(self.indiv_most_probable, axis=1)
+        y_pred = self.most_probable(indiv)
+        if self.top_k:
+            self.top_causes_ = self.top_causes(indiv, self.top_k)
 
         # Insilico might say there is a small probably of a cause occuring
         # even if the conditional probability for all symptoms is zero. This
@@ -465,13 +630,13 @@ class InsilicoClassifier(object):
         csmf = csmf.mean().loc[self.causes_]
         csmf = csmf / csmf.sum()
 
-        self.converged_ = fitted.converged
+        self.converged_ = converged
         return y_pred, csmf
 
     @classmethod
     def get_r_insilico_package(cls):
         """Return the ``rpy2`` object for the Insilico package."""
-        return importr(cls.R_PKG_NAME)
+        return get_r_package(cls.R_PKG_NAME)
 
     def get_sample_data(self):
         """Return the RandomVA1 sample data from the Insilico pacakge as a
@@ -488,7 +653,7 @@ class InsilicoClassifier(object):
     def get_cond_prob_num(self):
         """Return the condprobnum file from the Insilico package as a pandas
            dataframe."""
-        rbase = importr('base')
+        rbase = get_r_package('base')
         robjects.r('library("{}")'.format(self.R_PKG_NAME))
         robjects.r('data(condprobnum)')
         # robjects.r('df <- data.frame(condprobnum)')
@@ -518,7 +683,7 @@ class InsilicoClassifier(object):
     def get_insilico_short_causes(self):
         """Return a dict to map from short to long cause names derived from
            the InsilicoVA caustext file."""
-        rbase = importr('base')
+        rbase = get_r_package('base')
 
         # Add the causetext file to the R global environment.
         # This is a data.matrix which ships with the package.
@@ -579,15 +744,13 @@ class InsilicoClassifier(object):
         if not (X.index == y.index).all():
             raise ValueError('X and y must have matching indicies')
 
-        if X.isin([1, 0, -1]).all().all():
-            is_numeric = True
-        elif X.isin(['Y', '', '.']).all().all():
-            is_numeric = False
-        else:
+        encoding = symptom_encoding(X)
+        if encoding is None:
             raise ValueError('Symptoms are not properly encoded')
-        X = X.copy()
+        is_numeric = encoding == 'numeric'
+        X = encode_symptoms(X)
 
-        rbase = importr('base')
+        rbase = get_r_package('base')
         robjects.r('library("{}")'.format(self.R_PKG_NAME))
         pandas2ri.activate()
 
@@ -611,11 +774,11 @@ class InsilicoClassifier(object):
 
         # Insilico is assuming the y_actual values are attatched to the
         # dataframe. Ensure the names of the added column does not conflict
-        # with an existing column. Do this before changing the index.
+        # with an existing column.
         gs = 'xxGS'
-        while gs in X.columns:
+        while gs in new_symptoms:
             gs = 'x{}'.format(gs)
-        X[gs] = y.map(encode_causes)
+        gs_values = y.map(encode_causes)
 
         # The original index of X may not be unique. For the validation study
         # the rows are resampled with replacement, which create duplicates. R
@@ -629,22 +792,19 @@ class InsilicoClassifier(object):
             return index_map[x]
 
         # Insilico is expecting that the first column in the dataframe is a
-        # string containing the ID. However, this is dropped, and the dimnames
-        # attribute of the matrix is set to the index of the passed pandas
-        # dataframe. Both the index and first column should be set to the new
-        # encoded index value. Ensure the names of the added columns do not
-        # conflict with an existing column
+        # string containing the ID. Ensure the names of the added columns do
+        # not conflict with an existing column
         X.index = new_index
-        X = X.reset_index()
-        X = X.set_index(X.columns[0], drop=False)
+        X.columns = new_symptoms
 
         id_col = 'xxID'
-        while id_col in X.columns:
+        while id_col in new_symptoms:
             id_col = 'x{}'.format(id_col)
-        X.columns = [id_col] + new_symptoms + [gs]
+        X = symptoms_to_r(X, numeric=is_numeric, id_col=id_col,
+                          extra={gs: gs_values.tolist()})
 
         # Grab a list of the encoded causes to pass to insilico.
-        gs_list = X[gs].sort_values().unique()
+        gs_list = gs_values.sort_values().unique()
 
         # Only pass parameters which are explictly set
         params = {
@@ -655,10 +815,10 @@ class InsilicoClassifier(object):
         params = {k: v for k, v in params.items() if v is not None}
         fit = self.r_insilico.extract_prob(X, gs, gs_list, **params)
 
-        rows, cols = tuple(rbase.dimnames(fit.rx2('cond.prob')))
-        cond_prob = ri2py(rbase.data_frame(fit.rx2('cond.prob')))
-        cond_prob.index = map(symptoms_map_, rows)
-        cond_prob.columns = map(decode_causes_, cols)
+        with localconverter(robjects.default_converter):
+            cond_prob = r_matrix_to_frame(fit.rx2('cond.prob'))
+        cond_prob.index = cond_prob.index.map(symptoms_map_)
+        cond_prob.columns = cond_prob.columns.map(decode_causes_)
 
         if learning_type == 'empirical':
             # These are not calculated when empirical learning is used
@@ -724,17 +884,22 @@ class InsilicoClassifier(object):
             raise ValueError('Dataframes in R must have unique indicies.')
 
         is_numeric = kwargs.get('isNumeric', False)
-        encoding = [1, 0, -1] if is_numeric else ['Y', 'y', '', '.']
-        if not df.isin(encoding).all().all():
+        encoding = symptom_encoding(df, strings=('Y', 'y', '', '.'))
+        if encoding is None or (is_numeric and encoding != 'numeric'):
             raise ValueError('Values are not properly encoded for isNumeric={}'
                              .format(is_numeric))
 
-        # The dataframe must have the index as both the index and as the first
-        # column of the dataframe. The first column will be dropped in the R
-        # methods and the index will be returned as by rpy2.
-        df = df.reset_index().set_index(df.columns[0], drop=False)
+        # The dataframe must have the index as the first column of the
+        # dataframe. The first column will be dropped in the R methods.
+        # Symptoms are sent as numeric codes and converted to the encoding
+        # specified by ``isNumeric`` in R.
+        id_col = 'xxID'
+        while id_col in df.columns:
+            id_col = 'x{}'.format(id_col)
+        df = symptoms_to_r(encode_symptoms(df), numeric=is_numeric,
+                           id_col=id_col)
 
-        rbase = importr('base')
+        rbase = get_r_package('base')
 
         # Automatically convert Pandas and R dataframes for just the fit.
         # Leaving pandas2ri activated changes global settings and results in
@@ -763,8 +928,9 @@ class InsilicoClassifier(object):
         # converted by rp2 which eliminates the need to extract them separately
         sid = ri2py(fit.rx2('id'))  # avoid python reserved word
         data = ri2py(rbase.data_frame(fit.rx2('data')))
-        indiv_prob = ri2py(rbase.data_frame(fit.rx2('indiv.prob')))
-        csmf = ri2py(rbase.data_frame(fit.rx2('csmf')))
+        with localconverter(robjects.default_converter):
+            indiv_prob = r_matrix_to_frame(fit.rx2('indiv.prob'))
+            csmf = r_matrix_to_frame(fit.rx2('csmf'))
         if isinstance(fit.rx2('conditional.probs'), RNULLType):
             cond_probs = None
         else:
@@ -864,6 +1030,43 @@ class InsilicoClassifier(object):
             converged,
         )
 
+    def sampler_fit(self, df):
+        """Predict using the native InSilicoVA sampler.
+
+        Parameters which are not set on the classifier use the defaults of
+        the ``insilico`` R function.
+
+        Args:
+            df (dataframe): symptom data
+
+        Returns:
+            (namedTuple): see ``sampler.insilico_fit``
+        """
+        df = encode_symptoms(df)
+
+        params = {
+            'update_cond_prob': self.update_cond_prob,
+            'keep_prob_base_level': self.keep_prob_base_level,
+            'n_sim': self.n_sim,
+            'thin': self.thin,
+            'burn_in': self.burn_in,
+            'auto_length': self.auto_length,
+            'conv_csmf': self.conv_csmf,
+            'jump_scale': self.jump_scale,
+            'levels_prior': self.levels_prior,
+            'levels_strength': self.levels_strength,
+            'trunc_min': self.trunc_min,
+            'trunc_max': self.trunc_max,
+            'seed': self.seed,
+            'n_chains': self.n_chains,
+            'n_jobs': self.n_jobs,
+        }
+        params = {k: v for k, v in params.items() if v is not None}
+
+        return sampler.insilico_fit(df, self.cond_prob_, self.cond_prob_alpha_,
+                                    self.table_alpha_, self.table_num_,
+                                    **params)
+
     @staticmethod
     def get_labels_map(labels):
         """Returns a mapping dictionary to convert modified strings back
@@ -883,6 +1086,64 @@ class InsilicoClassifier(object):
         re_not_letter = re.compile('[^A-Za-z]')
         return {re_not_letter.sub('.', str(label)): label for label in labels}
 
+    @staticmethod
+    def most_probable(indiv):
+        """Return the most probable cause for every row.
+
+        This is a vectorized version of ``indiv_most_probable``. Missing
+        values are ignored. Rows where every value is equal, or every value
+        is missing, are 'Undetermined'. Ties between the largest values are
+        broken by taking the first column.
+
+        Args:
+            indiv (dataframe): observations by causes probabilities
+
+        Returns:
+            (series)
+        """
+        values = indiv.values.astype(float)
+        missing = np.isnan(values)
+        filled = np.where(missing, -np.inf, values)
+        best = filled.argmax(axis=1)
+
+        all_missing = missing.all(axis=1)
+        with np.errstate(invalid='ignore'):
+            all_equal = (filled.max(axis=1) == np.where(missing, np.inf,
+                                                        values).min(axis=1))
+        undetermined = all_missing | (all_equal & ~missing.any(axis=1))
+
+        causes = np.asarray(indiv.columns, dtype=object)[best]
+        causes[undetermined] = 'Undetermined'
+        return pd.Series(causes, index=indiv.index)
+
+    @staticmethod
+    def top_causes(indiv, k):
+        """Return the ``k`` most probable causes for every row.
+
+        Args:
+            indiv (dataframe): observations by causes probabilities
+            k (int): number of causes
+
+        Returns:
+            (dataframe): columns are ``cause1``, ``prob1``, ``cause2``, etc.
+                from most to least probable. Missing probabilities are
+                ranked last.
+        """
+        k = min(k, indiv.shape[1])
+        values = indiv.values.astype(float)
+        filled = np.where(np.isnan(values), -np.inf, values)
+        top = np.argpartition(-filled, k - 1, axis=1)[:, :k]
+        rows = np.arange(len(values))[:, None]
+        top = top[rows, np.argsort(-filled[rows, top], axis=1, kind='stable')]
+
+        causes = np.asarray(indiv.columns, dtype=object)[top]
+        probs = values[rows, top]
+        out = {}
+        for i in range(k):
+            out['cause{}'.format(i + 1)] = causes[:, i]
+            out['prob{}'.format(i + 1)] = probs[:, i]
+        return pd.DataFrame(out, index=indiv.index)
+
     @staticmethod
     def indiv_most_probable(series):
         """Return the index of the largest value in a series"""
@@ -890,3 +1151,104 @@ class InsilicoClassifier(object):
             return 'Undetermined'
         else:
             return series.sort_values(ascending=False).first_valid_index()
+
+
+def get_r_package(name):
+    """Import an R package using ``rpy2`` once per process.
+
+    Args:
+        name (str): name of the R package
+
+    Returns:
+        (rpy2.InstalledSTPackage)
+    """
+    if name not in R_PACKAGES:
+        R_PACKAGES[name] = importr(name)
+    return R_PACKAGES[name]
+
+
+def get_r_function(source):
+    """Compile R source code into a function once per process.
+
+    Args:
+        source (str): R code which evaluates to a function
+
+    Returns:
+        (rpy2.SignatureTranslatedFunction)
+    """
+    if source not in R_FUNCTIONS:
+        R_FUNCTIONS[source] = robjects.r(source)
+    return R_FUNCTIONS[source]
+
+
+def encode_symptoms(X):
+    """Return a copy of the symptoms as int8 codes: 1, 0 and -1.
+
+    Args:
+        X (dataframe): symptoms encoded as 'Y' (or 'y'), '', '.' or
+            1, 0, -1
+
+    Returns:
+        (dataframe)
+    """
+    if symptom_encoding(X) != 'numeric':
+        X = X.replace({'Y': 1, 'y': 1, '': 0, '.': -1})
+    return X.astype(np.int8)
+
+
+def symptoms_to_r(X, numeric=True, id_col='ID', extra=None):
+    """Transfer numerically encoded symptoms to an R data frame.
+
+    Converting a dataframe with ``pandas2ri`` copies each column separately
+    and string encoded data are converted cell by cell. Instead the data are
+    sent as one contiguous int8 buffer with the dimnames as separate string
+    vectors and the data frame is assembled in R.
+
+    Args:
+        X (dataframe): symptoms encoded as 1, 0, -1. The index is used for
+            the IDs and the row names.
+        numeric (bool): keep the numeric encoding in R. Otherwise symptoms
+            are converted to 'Y', '' and '.' in R.
+        id_col (str): name of the ID column
+        extra (dict): additional columns to append, mapping names to lists
+            of strings
+
+    Returns:
+        (rpy2.DataFrame)
+    """
+    codes = np.asarray(X.values, dtype=np.int8) + 1
+    with localconverter(robjects.default_converter):
+        df = get_r_function(R_SYMPTOM_FRAME)(
+            robjects.vectors.ByteVector(codes.tobytes(order='F')),
+            len(X),
+            robjects.StrVector([str(i) for i in X.index]),
+            robjects.StrVector([str(c) for c in X.columns]),
+            numeric,
+            id_col,
+        )
+        for name, values in (extra or {}).items():
+            df = robjects.r['[[<-'](df, name, robjects.StrVector(values))
+    return df
+
+
+def r_matrix_to_frame(matrix):
+    """Wrap a numeric R matrix in a dataframe without copying the values.
+
+    The array shares memory with the R vector, which is kept alive by the
+    returned object. This should be called with the default rpy2 converter so
+    the matrix has not already been copied into a numpy array.
+
+    Args:
+        matrix (rpy2.FloatMatrix)
+
+    Returns:
+        (dataframe)
+    """
+    nrow, ncol = robjects.r['dim'](matrix)
+    values = np.frombuffer(matrix.memoryview(), dtype=np.float64)
+    values = values.reshape((ncol, nrow)).T   # R matrices are column-major
+
+    rows, cols = robjects.r['rownames'](matrix), robjects.r['colnames'](matrix)
+    rows = None if isinstance(rows, RNULLType) else list(rows)
+    cols = None if isinstance(cols, RNULLType) else list(cols)
+    return pd.DataFrame(values, index=rows, columns=cols, copy=False)
@@ -34,10 +34,9 @@ child = functools.partial(between, lower=5, upper=14)
 under5 = functools.partial(between, lower=1, upper=4)
 
 
-def infant(row, mapping=None):
-    row = row[['g5_04b', 'g5_04c']].fillna(0)
-    agedays = row.g5_04b * 30 + row.g5_04c
-    return int(agedays > 28 and agedays < 365)
+# Age of children is recorded in months and days
+age_days = Duration(g5_04b=30, g5_04c=1)
+infant = All(GreaterThan(age_days, 28), LessThan(age_days, 365))
 
 
 neonate = functools.partial(less_than, val=28)
@@ -47,37 +46,25 @@ died_d36 = functools.partial(between, lower=3, upper=6)
 died_w1 = functools.partial(between, lower=7, upper=28)
 
 
-def magegp1(row, mapping=None):
-    return int(row.g5_02 == 2 and row.g5_04a <= 19)
+magegp1 = All(Equals('g5_02', 2), AtMost('g5_04a', 19))
+magegp2 = All(Equals('g5_02', 2), Between('g5_04a', 20, 34))
+magegp3 = All(Equals('g5_02', 2), Between('g5_04a', 35, 49))
 
 
-def magegp2(row, mapping=None):
-    return int(row.g5_02 == 2 and row.g5_04a >= 20 and row.g5_04a <= 34)
+# Rules to dichotomize categoricals
+coma = All(Equals('a2_74', 1), GreaterThan('a2_76', 1))
 
+# Difficulty with liquids or both solids and liquids
+diff_sw = All(Equals('a2_57', 1), Any(Equals('a2_59', 2), Equals('a2_59', 3)))
 
-def magegp3(row, mapping=None):
-    return int(row.g5_02 == 2 and row.g5_04a >= 35 and row.g5_04a <= 49)
-
-
-# Functions to dichotomize categoricals
-def coma(row, mapping=None):
-    return int(row.a2_74 == 1 and row.a2_76 > 1)
-
-
-def diff_sw(row, mapping=None):
-    # Difficulty with liquids or both solids and liquids
-    diff_w_liquids = row.a2_59 == 2 or row.a2_59 == 3
-    return int(row.a2_57 == 1 and diff_w_liquids)
-
-
-def pend_6w(row, mapping=None):
-    return int((row.a3_17 == 1 or row.a3_18 == 1) and row.a3_11 < 6 * 30)
+pend_6w = All(Any(Equals('a3_17', 1), Equals('a3_18', 1)),
+              LessThan('a3_11', 6 * 30))
 
 
 # Symptom maps
 # item 1 is the name of the Insilico symptom
 # item 2 is a str or list of PHMRC columns, value
-# item 3 is the function to use
+# item 3 is the function or rule to use
 # Symptoms are ordered correctly
 ADULT_SYMPTOM_MAP = [
     # Ages
@@ -1349,4 +1336,4 @@ INSILICO_HCE_COLUMNS = {
 
 
 if __name__ == '__main__':
-    map_all_modules('insilico', INSILICO_SYMPTOM_MAP, INSILICO_HCE_COLUMNS)
+    map_all_modules('insilico', INSILICO_SYMPTOM_MAP)
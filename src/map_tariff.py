@@ -414,4 +414,4 @@ TARIFF_SYMPTOM_MAP = {
 
 
 if __name__ == '__main__':
-    map_all_modules('tariff', TARIFF_SYMPTOM_MAP, TARIFF_HCE_COLUMNS)
+    map_all_modules('tariff', TARIFF_SYMPTOM_MAP)
@@ -1,33 +1,117 @@
 import functools
-import math
+import itertools
+import json
 import os
-import sys
 
+import numpy as np
 import pandas as pd
 
+from cache import hash_inputs
 from prep import REPO_DIR, load_cleaned_file
+from symptoms import SymptomMatrix
+from rules import (
+    Rule,
+    NoData,
+    Equals,
+    LessThan,
+    GreaterThan,
+    AtLeast,
+    AtMost,
+    Between,
+    Any,
+    All,
+    Duration,
+)
 
 
 MAPPED_DIR = os.path.join(REPO_DIR, 'data', 'mapped')
 
+# Value used for missing symptoms by each set of symptoms
+MISSING = {
+    'insilico': -1,
+    'tariff': 0,
+}
 
-def mapped_filepath(symptoms, module, hce=True):
-    """Load the mapped symptom files.
+# Mapped data loaded by this process by (symptoms, module)
+LOADED = {}
+
+# Before pandas 3, concat copies the data unless asked not to. From pandas 3
+# it never copies eagerly and the keyword is deprecated.
+NO_COPY = {'copy': False} if int(pd.__version__.split('.')[0]) < 3 else {}
+
+
+def mapped_filepath(symptoms, module):
+    """Return the path of a mapped symptom file.
+
+    The file is saved by ``symptoms.SymptomMatrix``.
 
     Args:
         symptoms (str): 'insilico', 'tariff'
         module (str): 'adult', 'child', 'neonate' or 'codebook'
-        hce (bool): should health care experience columns be included. If
-            False they will be present and set to missing.
 
     Returns:
         (str)
     """
-    hce = 'hce' if hce else 'no_hce'
-    filename = 'mapped_{}_{}_{}.csv'.format(symptoms, module, hce)
+    filename = 'mapped_{}_{}.npy'.format(symptoms, module)
     return os.path.join(MAPPED_DIR, filename)
 
 
+def hce_columns(symptoms, module):
+    """Return the health care experience columns of a set of symptoms"""
+    # The maps import this module, so they are imported when needed
+    if symptoms == 'insilico':
+        from map_insilico import INSILICO_HCE_COLUMNS as columns
+    elif symptoms == 'tariff':
+        from map_tariff import TARIFF_HCE_COLUMNS as columns
+    else:
+        raise ValueError('Unknown symptoms: "{}"'.format(symptoms))
+    return columns[module]
+
+
+def load_mapped(symptoms, module, hce=True):
+    """Load mapped symptoms with or without health care experience.
+
+    Only the fully mapped data is saved. It is memory-mapped once per
+    process and returned as an int8 dataframe. The data without health care
+    experience is derived when it is requested by setting the HCE columns to
+    missing. Only those columns are new. The other columns are sliced as
+    views and concatenated without copying, so both variants share their
+    memory.
+
+    Args:
+        symptoms (str): 'insilico', 'tariff'
+        module (str): 'adult', 'child', 'neonate'
+        hce (bool): should health care experience columns be included. If
+            False they will be present and set to missing.
+
+    Returns:
+        (dataframe)
+    """
+    key = (symptoms, module)
+    if key not in LOADED:
+        LOADED[key] = SymptomMatrix.load(mapped_filepath(symptoms,
+                                                         module)).to_frame()
+    df = LOADED[key]
+
+    if hce:
+        return df.copy(deep=False)
+    is_hce = df.columns.isin(hce_columns(symptoms, module))
+    pieces = []
+    start = 0
+    for replace, run in itertools.groupby(is_hce):
+        stop = start + len(list(run))
+        piece = df.iloc[:, start:stop]
+        if replace:
+            values = np.full(piece.shape, MISSING[symptoms], dtype=np.int8)
+            piece = pd.DataFrame(values, index=df.index,
+                                 columns=piece.columns)
+        pieces.append(piece)
+        start = stop
+    if not pieces:
+        return df.copy(deep=False)
+    return pd.concat(pieces, axis=1, **NO_COPY)
+
+
 def has_any(row, mapping=None):
     """Determine if a row of data has any column matching the given value
 
@@ -96,86 +180,318 @@ three = functools.partial(value, val=3)
 four = functools.partial(value, val=4)
 
 
-def map_symptoms(data, mapping):
+# Rules equivalent to the mapping functions. Each takes the source column
+# and the keyword arguments of the partial.
+COLUMN_RULES = {
+    value: lambda col, val=None: Equals(col, val),
+    less_than: lambda col, val=0: LessThan(col, val),
+    at_least: lambda col, val=0: AtLeast(col, val),
+    no_more_than: lambda col, val=0: AtMost(col, val, True),
+    between: lambda col, lower=0, upper=1: Between(col, lower, upper),
+}
+
+ROW_RULES = {
+    has_any: Any,
+    has_all: All,
+}
+
+
+def compile_symptom(source, fn):
+    """Compile one entry of a symptom map to a rule.
+
+    Entries may use a rule directly as the mapping function. Entries using
+    the mapping functions in this module are translated to the equivalent
+    rule.
+
+    Args:
+        source: column name, list of columns or (column, value) pairs, or
+            None as in the symptom maps
+        fn: mapping function or rule from the symptom map
+
+    Returns:
+        rules.Rule: rule for the target column, or None if ``fn`` is a
+            custom function which can only be applied cell by cell or row by
+            row
+    """
+    if source is None:
+        return NoData()
+
+    if isinstance(fn, Rule):
+        return fn
+
+    if isinstance(fn, functools.partial) and not fn.args:
+        func, kwargs = fn.func, fn.keywords
+    else:
+        func, kwargs = fn, {}
+
+    if isinstance(source, str) and func in COLUMN_RULES:
+        return COLUMN_RULES[func](source, **kwargs)
+
+    if isinstance(source, list) and func in ROW_RULES and not kwargs:
+        return ROW_RULES[func](*[Equals(col, val) for col, val in source])
+
+    return None
+
+
+def required_columns(mapping):
+    """Return the PHMRC columns read by a symptom map
+
+    Args:
+        mapping (list of tuples)
+
+    Returns:
+        (list): sorted column names
+    """
+    columns = set()
+    for _, source, fn in mapping:
+        rule = compile_symptom(source, fn)
+        if rule is not None:
+            columns.update(rule.columns)
+        elif isinstance(source, str):
+            columns.add(source)
+        else:
+            columns.update(s[0] if isinstance(s, tuple) else s
+                           for s in source)
+    return sorted(columns)
+
+
+def map_symptoms(data, mapping, compiled=True, cache=None):
     """Map cleaned PHMRC data to binary symptoms indicators.
 
     The map consists of a list of tuples with one entry for each target column
     in the fully mapped data. The first value is the target column name. The
     second value describes the column and possibly values in the original data
     which are used. The third value is a function used in the input data to
-    convert it to the value for the target column.
+    convert it to the value for the target column, or a rule from
+    ``rules``.
+
+    Entries using the functions in this module are compiled to rules and
+    evaluated as vectorized operations over whole columns. Other functions
+    are applied to each cell or row of the source columns.
 
     Args:
         data (dataframe): cleaned GHDx data
         mapping (list of tuples)
+        compiled (bool): compile the mapping functions to rules. If False
+            every function is applied cell by cell or row by row. Entries
+            which are already rules are always evaluated as rules.
+        cache (dict): evaluated rules shared between calls on the same data.
+            Pass the same dict when mapping the data to several feature sets
+            so that shared rules are evaluated once.
 
     Returns:
         (dataframe)
     """
-    # Setup the output dataframe with the same index as the input
-    df = pd.DataFrame(index=data.index)
-    df.index.name = 'ID'
-
-    print('{} features detected:'.format(len(mapping)), end='')
-    digits = math.ceil(math.log10(len(mapping)))
-
-    for i, (target, source, fn) in enumerate(mapping):
-
-        if not i % 50:
-            print('\n {:0{}d} '.format(i, digits), end='')
-        sys.stdout.flush()
-        print('.', end='')
-        sys.stdout.flush()
+    if cache is None:
+        cache = {}
+
+    columns = {}
+    n_compiled = 0
+    for target, source, fn in mapping:
+        if compiled or isinstance(fn, Rule):
+            rule = compile_symptom(source, fn)
+        else:
+            rule = None
+
+        if rule is not None:
+            values = rule(data, cache)
+            if values.dtype == bool:
+                values = values.astype(int)
+            columns[target] = values
+            n_compiled += 1
 
         # Column has no mapping but should be in the output dataframe
-        if source is None:
-            df[target] = float('nan')
+        elif source is None:
+            columns[target] = pd.Series(float('nan'), index=data.index)
 
         # Column maps from one PHMRC column
-        try:
-            str_type = basestring
-        except NameError:
-            str_type = str
+        elif isinstance(source, str):
+            columns[target] = data[source].map(fn)
 
-        if isinstance(source, str_type):
-            df[target] = data[source].map(fn)
+        # Column maps from multiple PHMRC columns
+        elif isinstance(source, list):
+            columns[target] = data.apply(fn, axis=1, args=(source,))
 
-        # Insilico column maps from multiple PHMRC columns
-        if isinstance(source, list):
-            df[target] = data.apply(fn, axis=1, args=(source,))
+    print('{} features detected, {} vectorized'.format(len(mapping),
+                                                       n_compiled))
 
-    print('')
+    df = pd.DataFrame({k: v.values for k, v in columns.items()},
+                      index=data.index, columns=list(columns))
+    df.index.name = 'ID'
     return df
 
 
-def map_all_modules(dataset, mapping, hce_columns):
+def map_all_modules(dataset, mapping):
     """Map and save data for all modules to binary symptom files.
 
-    Two files are saved for each module. The first contains the fully mapped
-    data. The second includes the same columns, but all ``hce_columns`` have
-    been set to missing. The value for missing depends on the set of symptoms.
-    For InSilicoVA symptoms ``-1`` is used for missing. For Tariff 2.0 symptoms
-    ``0`` is used for missing.
+    One file is saved for each module with the fully mapped data. Missing
+    values are filled with the missing value of the set of symptoms. For
+    InSilicoVA symptoms ``-1`` is used for missing. For Tariff 2.0 symptoms
+    ``0`` is used for missing. Use ``load_mapped`` to load the data with or
+    without health care experience columns.
 
     Args:
         dataset (str): 'tariff' or 'insilico'
         mapping (dict of list of tuples)
-        hce_columns (dict of list of str): health care experience column
-            labels by module
+    """
+    map_feature_sets({dataset: mapping})
+
+
+def map_dataset(dataset, incremental=True):
+    """Map and save data for all modules to one set of symptoms
+
+    Args:
+        dataset (str): 'tariff' or 'insilico'
+        incremental (bool): reuse unchanged columns from the saved files
+    """
+    # The maps import this module, so they are imported when needed
+    if dataset == 'insilico':
+        from map_insilico import INSILICO_SYMPTOM_MAP as symptom_map
+    elif dataset == 'tariff':
+        from map_tariff import TARIFF_SYMPTOM_MAP as symptom_map
+    else:
+        raise ValueError('Unknown symptoms: "{}"'.format(dataset))
+    map_feature_sets({dataset: symptom_map}, incremental=incremental)
+
+
+def manifest_filepath(dataset):
+    return os.path.join(MAPPED_DIR, 'manifest_{}.json'.format(dataset))
+
+
+def load_manifest(dataset):
+    """Return the fingerprints of the columns in the saved mapped files
+
+    Each set of symptoms has its own manifest, so sets can be mapped by
+    separate processes at the same time.
+    """
+    try:
+        with open(manifest_filepath(dataset)) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def fingerprint_columns(mapping, data):
+    """Fingerprint the rule and source data of each target column
+
+    Args:
+        mapping (list of tuples): symptom map
+        data (dataframe): cleaned PHMRC data
+
+    Returns:
+        (dict): target -> fingerprint. The fingerprint is None for custom
+            functions, which can not be fingerprinted and are always mapped.
+    """
+    column_hashes = {}
+    fingerprints = {}
+    for target, source, fn in mapping:
+        rule = compile_symptom(source, fn)
+        if rule is None:
+            fingerprints[target] = None
+            continue
+        for col in rule.columns.difference(column_hashes):
+            column_hashes[col] = hash_inputs(data[col])
+        fingerprints[target] = hash_inputs(
+            repr(rule), [(col, column_hashes[col])
+                         for col in sorted(rule.columns)])
+    return fingerprints
+
+
+def map_feature_sets(feature_sets, incremental=True):
+    """Map and save data for all modules to several sets of symptoms.
+
+    Each module is loaded once with only the columns read by any of the
+    maps. Rules which are shared by the maps are evaluated once per module.
+    The saved files are the same as ``map_all_modules``.
+
+    The fingerprint of the rule and source data of every column is saved in
+    a manifest next to the mapped files. When a map changes, only columns
+    whose fingerprint changed are mapped again and the saved files are
+    patched. Files are not rewritten if nothing changed.
+
+    Args:
+        feature_sets (dict): dataset -> mapping as passed to
+            ``map_all_modules``
+        incremental (bool): reuse unchanged columns from the saved files
     """
     try:
         os.mkdir(MAPPED_DIR)
     except OSError:
         pass   # folder already exists
 
-    missing = -1 if dataset == 'insilico' else 0
+    manifests = {dataset: load_manifest(dataset) if incremental else {}
+                 for dataset in feature_sets}
     for module in ['adult', 'child', 'neonate']:
-        print('Mapping {} data to the {} feature set'.format(module, dataset))
-        df = map_symptoms(load_cleaned_file(module), mapping[module])
-        df = df.fillna(missing)
-        df.to_csv(mapped_filepath(dataset, module, hce=True))
-
-        df.loc[:, hce_columns[module]] = missing
-        df.to_csv(mapped_filepath(dataset, module, hce=False))
+        columns = set()
+        for mapping in feature_sets.values():
+            columns.update(required_columns(mapping[module]))
+        data = load_cleaned_file(module, columns=sorted(columns))
+
+        cache = {}
+        for dataset, mapping in feature_sets.items():
+            missing = MISSING[dataset]
+            filepath = mapped_filepath(dataset, module)
+            fingerprints = fingerprint_columns(mapping[module], data)
+            manifest = manifests[dataset]
+            saved = manifest.get(module, {})
+
+            previous = None
+            if saved and os.path.exists(filepath):
+                previous = SymptomMatrix.load(filepath).to_frame()
+                if not previous.index.equals(data.index):
+                    previous = None
+
+            if previous is None:
+                stale = set(fingerprints)
+            else:
+                stale = {target for target, fp in fingerprints.items()
+                         if fp is None or target not in previous or
+                         saved['columns'].get(target) != fp}
+
+            if (previous is not None and not stale and
+                    list(previous.columns) == list(fingerprints)):
+                print('{} {} symptoms are up to date'.format(module, dataset))
+                continue
+
+            print('Mapping {} of {} {} symptoms to the {} feature set'.format(
+                len(stale), len(fingerprints), module, dataset))
+            entries = [(target, source, fn)
+                       for target, source, fn in mapping[module]
+                       if target in stale]
+            mapped = map_symptoms(data, entries, cache=cache).fillna(missing)
+
+            if previous is None:
+                df = mapped
+            else:
+                df = previous.reindex(columns=list(fingerprints))
+                for target in mapped:
+                    df[target] = mapped[target]
+            SymptomMatrix.from_frame(df).save(filepath)
+            LOADED.pop((dataset, module), None)
+
+            manifest[module] = {'columns': fingerprints}
+            with open(manifest_filepath(dataset), 'w') as f:
+                json.dump(manifest, f, indent=2, sort_keys=True)
 
     print('Files are saved in {}'.format(MAPPED_DIR))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Map cleaned data to the InSilicoVA and Tariff symptoms')
+    parser.add_argument(
+        '--full', action='store_false', dest='incremental',
+        help='Map every column instead of only columns whose rule changed')
+    args = parser.parse_args()
+
+    # Import the maps from the ``mapping`` module rather than this script so
+    # the mapping functions they use are the ones the compiler recognizes
+    from mapping import map_feature_sets
+    from map_insilico import INSILICO_SYMPTOM_MAP
+    from map_tariff import TARIFF_SYMPTOM_MAP
+
+    map_feature_sets({
+        'insilico': INSILICO_SYMPTOM_MAP,
+        'tariff': TARIFF_SYMPTOM_MAP,
+    }, incremental=args.incremental)
@@ -5,6 +5,307 @@ import pandas as pd
 import numpy as np
 
 
+class ConfusionMatrix(object):
+    """Counts of true by predicted labels for one set of predictions.
+
+    The matrix is built once with a single ``bincount`` over integer-encoded
+    labels. Every cause-specific and aggregate metric in this module can be
+    derived from it as array operations instead of rescanning the
+    predictions for each cause.
+
+    Labels are ordered as they first appear in ``actual`` followed by labels
+    which only appear in ``predicted``. Missing values are treated as a
+    label. The two sequences are compared by position so they must be
+    aligned.
+
+    Args:
+        actual (sequence): true individual level classification
+        predicted (sequence): individual level predictions
+
+    Attributes:
+        labels (pd.Index): labels of the rows and columns of the matrix
+        matrix (np.array): labels by labels array of counts with the true
+            labels on the rows and the predictions on the columns
+        causes (pd.Index): labels which appear in ``actual``
+    """
+
+    def __init__(self, actual, predicted):
+        actual = np.asarray(actual, dtype=object)
+        predicted = np.asarray(predicted, dtype=object)
+        if len(actual) != len(predicted):
+            raise ValueError('Actual and predicted must be the same length.')
+
+        codes, labels = _factorize(np.concatenate([actual, predicted]))
+        n_labels = len(labels)
+        true_codes, pred_codes = codes[:len(actual)], codes[len(actual):]
+        counts = np.bincount(true_codes * n_labels + pred_codes,
+                             minlength=n_labels ** 2)
+
+        self.labels = pd.Index(labels)
+        self.matrix = counts.reshape(n_labels, n_labels)
+        self.n_causes = len(np.unique(true_codes))
+        self.causes = self.labels[:self.n_causes]
+        self.n = len(actual)
+
+    def counts(self, cause=None):
+        """Return true/false positive/negative counts.
+
+        Args:
+            cause: a label. If None, counts for every label are returned.
+
+        Returns:
+            tuple: true positive, false negative, false positive and true
+                negative counts as ints or arrays aligned with ``labels``
+        """
+        if cause is None:
+            tp = np.diag(self.matrix)
+            n_actual = self.matrix.sum(axis=1)
+            n_called = self.matrix.sum(axis=0)
+        elif cause in self.labels:
+            i = self.labels.get_loc(cause)
+            tp = self.matrix[i, i]
+            n_actual = self.matrix[i].sum()
+            n_called = self.matrix[:, i].sum()
+        else:
+            tp = n_actual = n_called = 0
+        fn = n_actual - tp
+        fp = n_called - tp
+        return tp, fn, fp, self.n - tp - fn - fp
+
+    def _by_cause(self, values, cause):
+        """Return a scalar for one cause or a series for all true causes"""
+        if cause is None:
+            return pd.Series(values[:self.n_causes], index=self.causes)
+        return values
+
+    def sensitivity(self, cause=None):
+        tp, fn, fp, tn = self.counts(cause)
+        return self._by_cause(_divide(tp, tp + fn), cause)
+
+    def specificity(self, cause=None):
+        tp, fn, fp, tn = self.counts(cause)
+        return self._by_cause(_divide(tn, tn + fp), cause)
+
+    def positive_predictive_value(self, cause=None):
+        tp, fn, fp, tn = self.counts(cause)
+        return self._by_cause(_divide(tp, tp + fp), cause)
+
+    def negative_predictive_value(self, cause=None):
+        tp, fn, fp, tn = self.counts(cause)
+        return self._by_cause(_divide(tn, tn + fn), cause)
+
+    def specific_accuracy(self, cause=None):
+        tp, fn, fp, tn = self.counts(cause)
+        return self._by_cause(_divide(tp + tn, self.n), cause)
+
+    def ccc(self, cause=None):
+        chance = 1 / self.n_causes if self.n_causes else np.nan
+        return (self.sensitivity(cause) - chance) / (1 - chance)
+
+    def overall_correctness(self):
+        return _divide(np.trace(self.matrix), self.n)
+
+    def mean_ccc(self):
+        return self.ccc().mean()
+
+    def median_ccc(self):
+        return self.ccc().median()
+
+    def csmf(self):
+        """Return the true and predicted CSMFs of the true causes"""
+        actual = self.matrix.sum(axis=1)[:self.n_causes] / self.n
+        predicted = self.matrix.sum(axis=0)[:self.n_causes] / self.n
+        return (pd.Series(actual, index=self.causes),
+                pd.Series(predicted, index=self.causes))
+
+    def csmf_accuracy(self):
+        """CSMF accuracy of the predictions. Predictions of causes which do
+        not appear in the true labels are dropped."""
+        actual, predicted = self.csmf()
+        return 1 - (predicted - actual).abs().sum() / (2 * (1 - actual.min()))
+
+    def cccsmf_accuracy(self):
+        return correct_csmf_accuracy(self.csmf_accuracy())
+
+
+class BatchConfusionMatrix(object):
+    """Confusion matrices for many sets of predictions stacked in a tensor.
+
+    This is the batched counterpart of ``ConfusionMatrix`` for the stacked
+    predictions from a validation study. All splits are counted with a
+    single ``bincount`` into a splits by labels by labels tensor. Each
+    cause-specific metric is then computed for every split and cause at once.
+
+    Labels are shared across splits. A cause which does not appear in the
+    true labels of a split has missing values for that split, as do metrics
+    with a zero denominator.
+
+    Args:
+        splits (sequence): split identifier of each prediction
+        actual (sequence): true individual level classification
+        predicted (sequence): individual level predictions
+
+    Attributes:
+        splits (pd.Index): sorted unique split identifiers
+        labels (pd.Index): labels of the last two axes of ``matrix``
+        causes (pd.Index): labels which appear in ``actual`` in any split
+        matrix (np.array): splits by labels by labels array of counts with
+            the true labels on the second axis
+        present (np.array): splits by causes boolean array of which causes
+            appear in the true labels of each split
+    """
+    METRICS = ('sensitivity', 'specificity', 'positive_predictive_value',
+               'negative_predictive_value', 'specific_accuracy', 'ccc')
+
+    def __init__(self, splits, actual, predicted):
+        actual = np.asarray(actual, dtype=object)
+        predicted = np.asarray(predicted, dtype=object)
+        split_codes, split_labels = pd.factorize(np.asarray(splits),
+                                                 sort=True)
+        codes, labels = _factorize(np.concatenate([actual, predicted]))
+        true_codes, pred_codes = codes[:len(actual)], codes[len(actual):]
+
+        n_splits, n_labels = len(split_labels), len(labels)
+        flat = (split_codes * n_labels + true_codes) * n_labels + pred_codes
+        counts = np.bincount(flat, minlength=n_splits * n_labels ** 2)
+
+        self.splits = pd.Index(split_labels)
+        self.labels = pd.Index(labels)
+        self.matrix = counts.reshape(n_splits, n_labels, n_labels)
+        self.n_causes = len(np.unique(true_codes))
+        self.causes = self.labels[:self.n_causes]
+
+        n_actual = self.matrix.sum(axis=2)[:, :self.n_causes]
+        self.present = n_actual > 0
+        self.n = self.matrix.sum(axis=(1, 2))
+
+    def counts(self):
+        """Return true/false positive/negative counts.
+
+        Returns:
+            tuple: true positive, false negative, false positive and true
+                negative counts as splits by causes arrays
+        """
+        c = self.n_causes
+        tp = np.diagonal(self.matrix, axis1=1, axis2=2)[:, :c]
+        fn = self.matrix.sum(axis=2)[:, :c] - tp
+        fp = self.matrix.sum(axis=1)[:, :c] - tp
+        tn = self.n[:, None] - tp - fn - fp
+        return tp, fn, fp, tn
+
+    def _mask(self, values):
+        return np.where(self.present, values, np.nan)
+
+    def sensitivity(self):
+        tp, fn, fp, tn = self.counts()
+        return self._mask(_divide(tp, tp + fn))
+
+    def specificity(self):
+        tp, fn, fp, tn = self.counts()
+        return self._mask(_divide(tn, tn + fp))
+
+    def positive_predictive_value(self):
+        tp, fn, fp, tn = self.counts()
+        return self._mask(_divide(tp, tp + fp))
+
+    def negative_predictive_value(self):
+        tp, fn, fp, tn = self.counts()
+        return self._mask(_divide(tn, tn + fn))
+
+    def specific_accuracy(self):
+        tp, fn, fp, tn = self.counts()
+        return self._mask(_divide(tp + tn, self.n[:, None]))
+
+    def ccc(self):
+        # Chance is based on the number of true causes in each split
+        chance = _divide(1, self.present.sum(axis=1))[:, None]
+        return (self.sensitivity() - chance) / (1 - chance)
+
+    def metrics(self, names=('sensitivity', 'specificity', 'ccc')):
+        """Return a splits by causes by metrics array.
+
+        Args:
+            names (sequence): names of cause-specific metrics in ``METRICS``
+
+        Returns:
+            np.array
+        """
+        unknown = set(names).difference(self.METRICS)
+        if unknown:
+            raise ValueError('Unknown metrics: {}'.format(sorted(unknown)))
+        return np.stack([getattr(self, name)() for name in names], axis=-1)
+
+    def to_frame(self, names=('sensitivity', 'specificity', 'ccc')):
+        """Return the metrics as a dataframe in long format.
+
+        The rows are indexed by split and cause and only include causes which
+        appear in the true labels of the split.
+
+        Args:
+            names (sequence): names of cause-specific metrics in ``METRICS``
+
+        Returns:
+            (dataframe)
+        """
+        values = self.metrics(names)
+        split_idx, cause_idx = np.nonzero(self.present)
+        index = pd.MultiIndex.from_arrays(
+            [self.splits[split_idx], self.causes[cause_idx]],
+            names=['split', 'cause'])
+        return pd.DataFrame(values[split_idx, cause_idx], index=index,
+                            columns=list(names))
+
+
+def batch_cause_specific_metrics(predictions,
+                                 metrics=('sensitivity', 'specificity',
+                                          'ccc')):
+    """Calculate cause-specific metrics for every split in one pass.
+
+    Args:
+        predictions (dataframe): stacked individual predictions with
+            ``split``, ``actual`` and ``prediction`` columns
+        metrics (sequence): names of cause-specific metrics. See
+            ``BatchConfusionMatrix.METRICS``.
+
+    Returns:
+        tuple:
+            * values (np.array): splits by causes by metrics array
+            * splits (pd.Index): labels of the first axis
+            * causes (pd.Index): labels of the second axis
+    """
+    cm = BatchConfusionMatrix(predictions.split, predictions.actual,
+                              predictions.prediction)
+    return cm.metrics(metrics), cm.splits, cm.causes
+
+
+def _factorize(values):
+    """Encode values as integers in order of appearance, keeping missing
+    values as a label
+
+    Same as ``pd.factorize(values, use_na_sentinel=False)``, which requires
+    pandas 1.5.
+    """
+    codes, labels = pd.factorize(values)
+    missing = codes == -1
+    if not missing.any():
+        return codes, labels
+    first = np.argmax(missing)
+    position = codes[:first].max() + 1 if first else 0
+    codes = np.where(codes >= position, codes + 1, codes)
+    codes[missing] = position
+    labels = np.insert(np.asarray(labels, dtype=object), position, np.nan)
+    return codes, labels
+
+
+def _divide(numerator, denominator):
+    """Divide ints or arrays returning nan where the denominator is zero"""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        out = np.true_divide(numerator, denominator)
+    if np.ndim(out):
+        return np.where(np.asarray(denominator) == 0, np.nan, out)
+    return out if denominator else np.nan
+
+
 def calc_sensitivity(cause, actual, predicted):
     """Calculate sensitivity for a single cause
 
@@ -27,9 +328,7 @@ def calc_sensitivity(cause, actual, predicted):
     Returns:
         float
     """
-    true_positive = ((actual == cause) & (predicted == cause)).sum()
-    n_predicted = (actual == cause).sum()
-    return true_positive / n_predicted if n_predicted else np.nan
+    return ConfusionMatrix(actual, predicted).sensitivity(cause)
 
 
 def calc_specificity(cause, actual, predicted):
@@ -54,9 +353,7 @@ def calc_specificity(cause, actual, predicted):
     Returns:
         float
     """
-    true_negative = ((actual != cause) & (predicted != cause)).sum()
-    n_not_cause = (actual != cause).sum()
-    return true_negative / n_not_cause if n_not_cause else np.nan
+    return ConfusionMatrix(actual, predicted).specificity(cause)
 
 
 def calc_positive_predictive_value(cause, actual, predicted):
@@ -80,9 +377,7 @@ def calc_positive_predictive_value(cause, actual, predicted):
     Returns:
         float
     """
-    true_positive = ((actual == cause) & (predicted == cause)).sum()
-    n_called = (predicted == cause).sum()
-    return true_positive / n_called if n_called else np.nan
+    return ConfusionMatrix(actual, predicted).positive_predictive_value(cause)
 
 
 def calc_negative_predictive_value(cause, actual, predicted):
@@ -106,9 +401,7 @@ def calc_negative_predictive_value(cause, actual, predicted):
     Returns:
         float
     """
-    true_negative = ((actual != cause) & (predicted != cause)).sum()
-    n_not_predicted = (predicted != cause).sum()
-    return true_negative / n_not_predicted if n_not_predicted else np.nan
+    return ConfusionMatrix(actual, predicted).negative_predictive_value(cause)
 
 
 def calc_specific_accuracy(cause, actual, predicted):
@@ -130,9 +423,7 @@ def calc_specific_accuracy(cause, actual, predicted):
     Returns:
         float
     """
-    true_positive = ((actual == cause) & (predicted == cause)).sum()
-    true_negative = ((actual != cause) & (predicted != cause)).sum()
-    return (true_positive + true_negative) / len(actual)
+    return ConfusionMatrix(actual, predicted).specific_accuracy(cause)
 
 
 def calc_overall_correctness(actual, predicted):
@@ -145,7 +436,7 @@ def calc_overall_correctness(actual, predicted):
     Return:
         float
     """
-    return (actual == predicted).sum() / len(actual)
+    return ConfusionMatrix(actual, predicted).overall_correctness()
 
 
 def calc_ccc(cause, actual, predicted):
@@ -187,9 +478,7 @@ def calc_ccc(cause, actual, predicted):
     Returns:
         float
     """
-    sensitivity = calc_sensitivity(cause, actual, predicted)
-    chance = 1 / len(actual.unique())
-    return (sensitivity - chance) / (1 - chance)
+    return ConfusionMatrix(actual, predicted).ccc(cause)
 
 
 def agg_cause_specific_metrics(agg, metric, actual, predicted, weights=None):
@@ -222,15 +511,19 @@ def agg_cause_specific_metrics(agg, metric, actual, predicted, weights=None):
     >>> agg_cause_specific_metrics(np.average, calc_ccc, actual, predicted,
                                    weights=True)
     """
-    causes = actual.unique()
+    cm = ConfusionMatrix(actual, predicted)
     if weights is True:
-        csmf_true = (actual.value_counts() / len(actual)).loc[causes].values
-        w = {'weights': csmf_true}
+        w = {'weights': cm.csmf()[0].values}
     elif weights:
         w = weights
     else:
         w = dict()
-    return agg([metric(cause, actual, predicted) for cause in causes], **w)
+
+    if metric in CAUSE_SPECIFIC_METHODS:
+        values = getattr(cm, CAUSE_SPECIFIC_METHODS[metric])().values
+    else:
+        values = [metric(cause, actual, predicted) for cause in cm.causes]
+    return agg(values, **w)
 
 
 def calc_mean_ccc(actual, predicted):
@@ -247,7 +540,7 @@ def calc_mean_ccc(actual, predicted):
     Returns:
         float
     """
-    return agg_cause_specific_metrics(calc_ccc, np.mean, actual, predicted)
+    return ConfusionMatrix(actual, predicted).mean_ccc()
 
 
 def calc_median_ccc(actual, predicted):
@@ -260,7 +553,18 @@ def calc_median_ccc(actual, predicted):
     Returns:
         float
     """
-    return agg_cause_specific_metrics(calc_ccc, np.median, actual, predicted)
+    return ConfusionMatrix(actual, predicted).median_ccc()
+
+
+# Methods of ``ConfusionMatrix`` which compute each cause-specific metric
+CAUSE_SPECIFIC_METHODS = {
+    calc_sensitivity: 'sensitivity',
+    calc_specificity: 'specificity',
+    calc_positive_predictive_value: 'positive_predictive_value',
+    calc_negative_predictive_value: 'negative_predictive_value',
+    calc_specific_accuracy: 'specific_accuracy',
+    calc_ccc: 'ccc',
+}
 
 
 def calc_csmf_accuracy_from_csmf(actual, predicted):
@@ -294,12 +598,8 @@ def calc_csmf_accuracy(actual, predicted):
     Returns:
         float
     """
-    csmf_pred = pd.Series(predicted).value_counts(dropna=False) / len(actual)
-    csmf_true = pd.Series(actual).value_counts(dropna=False) / len(actual)
-
-    # Drop causes in the prediction which do not appear in the actual
-    csmf_pred = csmf_pred.loc[csmf_true.index].fillna(0)
-    return calc_csmf_accuracy_from_csmf(csmf_true, csmf_pred)
+    # Causes in the prediction which do not appear in the actual are dropped
+    return ConfusionMatrix(actual, predicted).csmf_accuracy()
 
 
 def correct_csmf_accuracy(uncorrected):
@@ -351,7 +651,7 @@ def calc_cccsmf_accuracy(actual, predicted):
     Returns:
         float
     """
-    return correct_csmf_accuracy(calc_csmf_accuracy(actual, predicted))
+    return ConfusionMatrix(actual, predicted).cccsmf_accuracy()
 
 
 def calc_cccsmf_accuracy_from_csmf(actual, predicted):
@@ -375,14 +675,44 @@ def calc_median_and_ui(arr, n=500, random_state=None):
     Args:
         arr: sequence of values to calculate statistics over
         n: number of bootstraps to perform
+        random_state (RandomState): random number generator
 
     Returns:
         tuple:
             * median (float)
             * uncertainty: tuple of floats, lower and upper bounds
     """
+    med, lb, ub = bootstrap_median_and_ui([arr], n, random_state)[0]
+    return med, (lb, ub)
+
+
+def bootstrap_median_and_ui(groups, n=500, random_state=None):
+    """Calculate medians and bootstrapped uncertainty for many groups.
+
+    For each group, all ``n`` resamples are drawn at once as an
+    ``(n, len(group))`` matrix of indices and the median of each resample is
+    found with a partition-based selection (``np.median``) along the rows.
+    Groups are resampled in order using the same random state, so the
+    results are identical to calling ``calc_median_and_ui`` on each group in
+    turn with a shared ``RandomState``.
+
+    Args:
+        groups (sequence): sequence of sequences of values
+        n (int): number of bootstraps to perform
+        random_state (RandomState): random number generator
+
+    Returns:
+        np.array: groups by 3 array of the median and the lower and upper
+            bounds of the 95% uncertainty interval
+    """
     if not random_state:
         random_state = np.random.RandomState()
-    sampled = [np.median(random_state.choice(arr, len(arr)))
-               for _ in range(500)]
-    return np.median(arr), tuple(np.percentile(sampled, (2.5, 97.5)))
+
+    out = np.empty((len(groups), 3))
+    for i, values in enumerate(groups):
+        values = np.asarray(values)
+        idx = random_state.randint(0, len(values), size=(n, len(values)))
+        sampled = np.median(values[idx], axis=1)
+        out[i, 0] = np.median(values)
+        out[i, 1:] = np.percentile(sampled, (2.5, 97.5))
+    return out
@@ -9,7 +9,7 @@ import jinja2.meta
 import yaml
 
 from map_insilico import INSILICO_CAUSE_MAP
-from download import load_ghdx_data
+from ghdx import load_ghdx_data
 from annex_tables import prep_icds
 
 
@@ -37,7 +37,8 @@ FIGURES = [s for s in SECTIONS if s.startswith('figure_')]
 
 
 def get_adult_cause34_mapping():
-    df = load_ghdx_data('adult')[['gs_text34', 'gs_text46']].drop_duplicates()
+    df = load_ghdx_data('adult', columns=['gs_text34', 'gs_text46'])
+    df = df.drop_duplicates()
     return dict(zip(df.gs_text46, df.gs_text34))
 
 
@@ -0,0 +1,387 @@
+"""Build graph of the stages which produce the data, results and paper.
+
+Each stage calls one of the existing entry points, such as
+``prep.clean_ghdx_files`` or ``results.main``. A stage is identified by a
+key which hashes:
+
+    * the source of the modules listed as its code
+    * the contents of its input files and directories
+    * the contents of the outputs of the stages it requires
+
+The key of every stage which finishes is saved. A stage is skipped if its
+key has not changed since it last ran and all of its outputs exist, so
+after a small change only the stages downstream of it are run again. A
+stage which runs again but writes the same outputs, for example after a
+change to a comment in its code, does not cause the stages after it to
+run.
+Stages whose requirements are done run at the same time in separate
+processes, for example mapping to the InSilicoVA and Tariff symptoms.
+
+Example:
+    $ python src/pipeline.py             # run every stage which is stale
+    $ python src/pipeline.py mapped      # run the mapping and its inputs
+    $ python src/pipeline.py --dry-run   # list the stages which would run
+"""
+from __future__ import print_function
+import argparse
+import concurrent.futures
+import fcntl
+import hashlib
+import importlib
+import json
+import multiprocessing
+import os
+
+from cache import atomic_write
+from download import REPO_DIR
+
+
+SRC_DIR = os.path.join(REPO_DIR, 'src')
+STATE_FILE = os.path.join(REPO_DIR, 'data', 'pipeline.json')
+
+
+def repo_path(*parts):
+    return os.path.join(REPO_DIR, *parts)
+
+
+class Stage(object):
+    """One step of the pipeline.
+
+    Args:
+        name (str): name of the stage
+        func (str): entry point as ``'module:function'``. It is imported by
+            the process which runs the stage.
+        args (tuple): JSON-serializable arguments of the function
+        code (list): modules in ``src`` whose source is part of the key. The
+            module of ``func`` is always included.
+        inputs (list): files and directories whose contents are part of the
+            key. Missing paths are allowed.
+        outputs (list): files and directories written by the stage
+        requires (list): names of stages which must run first
+    """
+
+    def __init__(self, name, func, args=(), code=(), inputs=(), outputs=(),
+                 requires=()):
+        self.name = name
+        self.func = func
+        self.args = tuple(args)
+        module = func.split(':')[0]
+        self.code = [module] + [m for m in code if m != module]
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.requires = list(requires)
+
+    def key(self, required):
+        """Return the hex digest which identifies the work of the stage
+
+        Args:
+            required (list of Stage): the stages this stage requires. They
+                must have finished, since their outputs are hashed.
+        """
+        h = hashlib.sha256()
+        h.update(repr((self.func, self.args)).encode())
+        for module in self.code:
+            h.update(module.encode())
+            hash_path(h, os.path.join(SRC_DIR, module + '.py'))
+        for path in self.inputs:
+            h.update(os.path.relpath(path, REPO_DIR).encode())
+            hash_path(h, path)
+        for stage in sorted(required, key=lambda stage: stage.name):
+            h.update(stage.name.encode())
+            for path in stage.outputs:
+                h.update(os.path.relpath(path, REPO_DIR).encode())
+                hash_path(h, path)
+        return h.hexdigest()
+
+    def outputs_exist(self):
+        return all(os.path.exists(path) for path in self.outputs)
+
+    def __repr__(self):
+        return 'Stage({!r})'.format(self.name)
+
+
+def hash_path(h, path):
+    """Update a hash with the contents of a file or of every file in a
+    directory, including their names relative to the directory"""
+    if os.path.isdir(path):
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for name in sorted(files):
+                filepath = os.path.join(root, name)
+                h.update(os.path.relpath(filepath, path).encode())
+                hash_path(h, filepath)
+    elif os.path.exists(path):
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(2 ** 20), b''):
+                h.update(block)
+    else:
+        h.update(b'\0missing')
+
+
+def run_stage(func, args):
+    """Import and call the entry point of a stage"""
+    module, function = func.split(':')
+    getattr(importlib.import_module(module), function)(*args)
+
+
+def default_stages():
+    """Return the stages of the analysis, from the GHDx data to the paper"""
+    from dataset import DATASET_DIR, EXTENDED_DATASET_DIR
+    from ghdx import LOADER, MANIFEST
+
+    modules = ['adult', 'child', 'neonate']
+    snapshots = os.path.join(LOADER.snapshot_dir, MANIFEST)
+    cleaned = [repo_path('data', 'cleaned', 'ghdx_{}.parquet'.format(m))
+               for m in modules]
+    cleaned.append(repo_path('data', 'cleaned', 'ghdx_codebook.csv'))
+    datasets = [DATASET_DIR, EXTENDED_DATASET_DIR]
+    csv_results = [repo_path('data', name) for name in [
+        'validate_phmrc_tariff', 'validate_insilico_insilico',
+        'default_insilico_insilico', 'extended_phmrc_tariff',
+        'extended_insilico_insilico', 'extended_default_insilico']]
+
+    stages = [
+        Stage('download', 'ghdx:save_snapshots', outputs=[snapshots]),
+        Stage('prep', 'prep:clean_ghdx_files', inputs=[snapshots],
+              outputs=cleaned, requires=['download']),
+    ]
+    for symptoms in ['insilico', 'tariff']:
+        stages.append(Stage(
+            'map_' + symptoms, 'mapping:map_dataset', args=[symptoms],
+            code=['rules', 'symptoms', 'map_' + symptoms],
+            inputs=cleaned,
+            outputs=[repo_path('data', 'mapped',
+                               'mapped_{}_{}.npy'.format(symptoms, m))
+                     for m in modules],
+            requires=['prep']))
+    stages += [
+        # The extended dataset only exists once there are extended runs
+        Stage('combine', 'combine_results:main', code=['dataset'],
+              inputs=csv_results, outputs=[DATASET_DIR]),
+        Stage('cause_specific', 'cause_specific_results:main',
+              code=['dataset', 'metrics'],
+              inputs=datasets + [
+                  repo_path('results', 'tariff_sensitivity_specificity.csv'),
+                  repo_path('results', 'tariff_ccc_by_cause.csv')],
+              outputs=[repo_path('data', 'table1.csv')],
+              requires=['combine']),
+        # The raw CSMF accuracy table also reads the InSilicoVA performance
+        # written by the results stage. It is not an input, because the
+        # results stage reads the CCC table written by this stage.
+        Stage('annex', 'annex_tables:main',
+              inputs=[repo_path('data', 'table1.csv'),
+                      repo_path('results', 'icd_codes.csv'),
+                      repo_path('results', 'tariff_performance.csv')],
+              outputs=[repo_path('results', 'ccc.xlsx')],
+              requires=['cause_specific']),
+        Stage('results', 'results:main',
+              code=['dataset', 'metrics', 'paper', 'ghdx'],
+              inputs=datasets + [repo_path('results', 'ccc.xlsx'),
+                                 repo_path('results',
+                                           'tariff_performance.csv'),
+                                 repo_path('paper', 'metadata.yml'),
+                                 snapshots],
+              outputs=[repo_path('paper', 'numbers')],
+              requires=['combine', 'annex']),
+        Stage('figures', 'figures:main',
+              code=['results', 'dataset', 'annex_tables'],
+              inputs=datasets + [repo_path('results', 'icd_codes.csv')],
+              outputs=[repo_path('paper', 'figures')],
+              requires=['combine']),
+        Stage('paper', 'paper:render',
+              code=['map_insilico', 'ghdx', 'annex_tables'],
+              inputs=[repo_path('paper', 'templates'),
+                      repo_path('paper', 'numbers'),
+                      repo_path('paper', 'metadata.yml')],
+              outputs=[repo_path('paper', 'paper.md')],
+              requires=['results', 'annex', 'figures']),
+    ]
+    return stages
+
+
+# Groups of stages which replace the targets of the Makefile
+TARGETS = {
+    'mapped': ['map_insilico', 'map_tariff'],
+}
+
+
+class Pipeline(object):
+    """Run stages in dependency order, skipping stages which are current.
+
+    Args:
+        stages (list of Stage): stages of the pipeline
+        state_file (str): JSON file of the keys of finished stages
+    """
+
+    def __init__(self, stages, state_file=STATE_FILE):
+        self.stages = {stage.name: stage for stage in stages}
+        self.state_file = state_file
+        for stage in stages:
+            unknown = set(stage.requires).difference(self.stages)
+            if unknown:
+                raise ValueError('Stage "{}" requires unknown stages: '
+                                 '{}'.format(stage.name, unknown))
+        self.order = self.sort()
+
+    def sort(self):
+        """Return the stage names in dependency order"""
+        order = []
+        visiting = set()
+
+        def visit(name):
+            if name in order:
+                return
+            if name in visiting:
+                raise ValueError('Cycle in the stages at "{}"'.format(name))
+            visiting.add(name)
+            for required in self.stages[name].requires:
+                visit(required)
+            visiting.discard(name)
+            order.append(name)
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+    def closure(self, targets):
+        """Return the targets and every stage they require"""
+        needed = set()
+        todo = list(targets)
+        while todo:
+            name = todo.pop()
+            if name not in self.stages:
+                raise ValueError('Unknown stage: "{}"'.format(name))
+            if name not in needed:
+                needed.add(name)
+                todo.extend(self.stages[name].requires)
+        return needed
+
+    def required(self, stage):
+        return [self.stages[name] for name in stage.requires]
+
+    def load_state(self):
+        try:
+            with open(self.state_file) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def save_key(self, name, key):
+        """Save the key of a finished stage
+
+        Other invocations of the pipeline may save keys at the same time, so
+        the state is reread and updated under a lock.
+        """
+        directory = os.path.dirname(self.state_file) or '.'
+        if not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        with open(self.state_file + '.lock', 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            state = self.load_state()
+            state[name] = key
+
+            def write(tmp):
+                with open(tmp, 'w') as f:
+                    json.dump(state, f, indent=2, sort_keys=True)
+
+            atomic_write(self.state_file, write)
+
+    def run(self, targets=None, n_jobs=None, force=False, dry_run=False):
+        """Run the stale stages needed for the targets
+
+        A stage is stale if it never finished, its key changed or any of its
+        outputs is missing. Keys are computed once the required stages have
+        finished, because their outputs are often the inputs of the stage.
+        A stage whose requirements ran again but wrote the same outputs is
+        still current.
+
+        Args:
+            targets (list): stage names. Defaults to every stage.
+            n_jobs (int or None): maximum number of stages run at once. If
+                None, one per CPU.
+            force (bool): run the stages even if they are current
+            dry_run (bool): only report the stages which would run. Stages
+                after a stale stage are reported as stale, since their
+                inputs can not be known without running it.
+
+        Returns:
+            list: names of the stages which were run, in order of completion
+        """
+        needed = self.closure(targets or self.stages)
+        state = self.load_state()
+        done = set()
+        ran = []
+        pending = [name for name in self.order if name in needed]
+
+        ctx = multiprocessing.get_context('spawn')
+        with concurrent.futures.ProcessPoolExecutor(
+                n_jobs, mp_context=ctx) as executor:
+            running = {}
+            while pending or running:
+                for name in list(pending):
+                    stage = self.stages[name]
+                    if not done.issuperset(stage.requires):
+                        continue
+                    pending.remove(name)
+                    if dry_run and any(r in ran for r in stage.requires):
+                        key = None
+                    else:
+                        key = stage.key(self.required(stage))
+                    if (not force and key is not None and
+                            state.get(name) == key and
+                            stage.outputs_exist()):
+                        print('{} is up to date'.format(name))
+                        done.add(name)
+                        continue
+                    if dry_run:
+                        print('{} would run'.format(name))
+                        ran.append(name)
+                        done.add(name)
+                        continue
+                    print('Running {}'.format(name))
+                    future = executor.submit(run_stage, stage.func,
+                                             stage.args)
+                    running[future] = name
+
+                if not running:
+                    continue
+                finished, _ = concurrent.futures.wait(
+                    running, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    # Stop at the first failure, after the other running
+                    # stages finish with the executor
+                    future.result()
+                    # Outputs of the stage may be inputs of its own key
+                    stage = self.stages[name]
+                    self.save_key(name, stage.key(self.required(stage)))
+                    ran.append(name)
+                    done.add(name)
+        return ran
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run the stages of the analysis which are out of date.')
+    parser.add_argument(
+        'targets', nargs='*',
+        help='Stages or groups of stages to run with the stages they '
+             'require. Defaults to all stages.')
+    parser.add_argument(
+        '-j', '--n-jobs', type=int, default=None,
+        help='Maximum number of stages run at once. Defaults to one per CPU')
+    parser.add_argument('--force', action='store_true',
+                        help='Run the stages even if they are up to date')
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help='List the stages which would run')
+    args = parser.parse_args()
+
+    targets = []
+    for target in args.targets:
+        targets.extend(TARGETS.get(target, [target]))
+    Pipeline(default_stages()).run(targets, n_jobs=args.n_jobs,
+                                   force=args.force, dry_run=args.dry_run)
+
+
+if __name__ == '__main__':
+    main()
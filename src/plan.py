@@ -0,0 +1,241 @@
+"""Precomputed train and test positions for every split of an experiment.
+
+The splits and the Dirichlet resamples of the test data depend only on the
+gold standard causes and the seeds, not on the symptoms or the classifier.
+A ``SplitPlan`` draws them once and saves them as compact integer arrays.
+Every run with the same module, cause list and split parameters loads the
+same plan, so runs with and without health care experience symptoms or with
+different symptom sets use identical splits without redrawing them.
+
+Plans are saved as ``.npz`` files. The positions of all splits are
+concatenated into one array per kind with an array of offsets::
+
+    train[train_offsets[i]:train_offsets[i + 1]]  # training split i
+
+Example:
+    >>> splits = out_of_sample_splits(X, y, 500, random_state=0)
+    >>> plan = SplitPlan.from_splits(y, splits, random_state=0)
+    >>> validate(X, y, clf, plan.splits(), resample_test=False)
+"""
+import fcntl
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from cache import atomic_write, hash_inputs
+from prep import REPO_DIR
+from validation import dirichlet_resample_indices, split_seed
+
+
+PLAN_DIR = os.path.join(REPO_DIR, 'data', 'plans')
+
+
+def label_digest(y):
+    """Return a digest of the causes a plan is drawn from"""
+    return hash_inputs(pd.Series(np.asarray(y)))
+
+
+def pack(arrays):
+    """Concatenate arrays of positions and return them with their offsets"""
+    offsets = np.zeros(len(arrays) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(a) for a in arrays])
+    if len(arrays):
+        values = np.concatenate(arrays)
+    else:
+        values = np.array([])
+    return values.astype(np.int32), offsets
+
+
+class SplitPlan(object):
+    """Train and resampled test positions for a sequence of splits.
+
+    Args:
+        split_ids (array): identifier of each split
+        train (list of arrays or None): positions of the training records of
+            each split. None for splits without training data.
+        test (list of arrays): positions of the test records of each split,
+            after resampling if the test data is resampled
+        labels (str): digest of the causes the plan was drawn from
+        params (dict): JSON-serializable parameters which produced the plan
+    """
+
+    def __init__(self, split_ids, train, test, labels=None, params=None):
+        if not len(split_ids) == len(train) == len(test):
+            raise ValueError('Expected train and test positions for every '
+                             'split')
+        self.split_ids = np.asarray(split_ids, dtype=np.int64)
+        self.train = train
+        self.test = test
+        self.labels = labels
+        # Round trip through JSON so tuples and lists compare equal
+        self.params = json.loads(json.dumps(params or {}, sort_keys=True))
+
+    @classmethod
+    def from_splits(cls, y, splits, resample_test=True, resample_size=1,
+                    random_state=None, params=None):
+        """Draw the plan from a split generator
+
+        The test data of each split is resampled exactly as ``validate``
+        would resample it with the same arguments.
+
+        Args:
+            y (series): gold standard causes
+            splits: iterator of ``(train_index, test_index, split_id)``
+            resample_test (bool): resample test data to a dirichlet
+                distribution
+            resample_size (float): scalar applied to n of test samples
+            random_state (int or None): base seed for resampling
+            params (dict): parameters saved with the plan
+
+        Returns:
+            SplitPlan
+        """
+        y = np.asarray(y)
+        split_ids, train, test = [], [], []
+        for train_index, test_index, split_id in splits:
+            test_index = np.asarray(test_index)
+            if resample_test:
+                n_samples = round(resample_size * len(test_index))
+                idx = dirichlet_resample_indices(
+                    y[test_index], n_samples,
+                    random_state=split_seed(random_state, split_id))
+                test_index = test_index[idx]
+            split_ids.append(split_id)
+            if train_index is not None:
+                train_index = np.asarray(train_index)
+            train.append(train_index)
+            test.append(test_index)
+        return cls(split_ids, train, test, labels=label_digest(y),
+                   params=params)
+
+    def __len__(self):
+        return len(self.split_ids)
+
+    def splits(self):
+        """Yield ``(train_index, test_index, split_id)`` for ``validate``
+
+        The test positions are already resampled, so pass
+        ``resample_test=False`` to ``validate``.
+        """
+        for split_id, train, test in zip(self.split_ids, self.train,
+                                         self.test):
+            yield train, test, int(split_id)
+
+    def digest(self):
+        """Return a hex digest of the split ids and positions"""
+        positions = [t if t is None else np.asarray(t, dtype=np.int64)
+                     for t in list(self.train) + list(self.test)]
+        return hash_inputs(self.split_ids, *positions)
+
+    def split_digests(self):
+        """Return a hex digest of the positions of each split by split id
+
+        Plans with more splits drawn with the same seeds share the digests
+        of their first splits, so runs which extend a plan reuse them.
+        """
+        digests = {}
+        for split_id, train, test in zip(self.split_ids, self.train,
+                                         self.test):
+            positions = [t if t is None else np.asarray(t, dtype=np.int64)
+                         for t in [train, test]]
+            digests[int(split_id)] = hash_inputs(*positions)
+        return digests
+
+    def matches(self, y, params=None):
+        """Whether the plan was drawn from these causes and parameters"""
+        if self.labels != label_digest(y):
+            return False
+        if params is None:
+            return True
+        return self.params == json.loads(json.dumps(params, sort_keys=True))
+
+    def save(self, filepath):
+        """Save the plan to an ``.npz`` file
+
+        Concurrent runs which build the same plan never read a partial file.
+        """
+        trained = np.array([t is not None for t in self.train])
+        train, train_offsets = pack([t if t is not None else np.array([])
+                                     for t in self.train])
+        test, test_offsets = pack(self.test)
+        meta = json.dumps({'labels': self.labels, 'params': self.params},
+                          sort_keys=True)
+
+        def write(tmp):
+            # A file object, so numpy does not add a suffix to the name
+            with open(tmp, 'wb') as f:
+                np.savez_compressed(
+                    f, split_ids=self.split_ids, trained=trained,
+                    train=train, train_offsets=train_offsets, test=test,
+                    test_offsets=test_offsets, meta=np.array(meta))
+
+        atomic_write(filepath, write)
+
+    @classmethod
+    def load(cls, filepath):
+        """Load a saved plan
+
+        Returns:
+            SplitPlan
+        """
+        with np.load(filepath) as data:
+            train = np.split(data['train'], data['train_offsets'][1:-1])
+            train = [t if trained else None
+                     for t, trained in zip(train, data['trained'])]
+            test = np.split(data['test'], data['test_offsets'][1:-1])
+            meta = json.loads(str(data['meta']))
+            return cls(data['split_ids'], train, test, **meta)
+
+
+def plan_filepath(analysis, module, cause_list, params, plan_dir=PLAN_DIR):
+    """Path of the plan for a module, cause list and split parameters
+
+    Args:
+        analysis (str): 'validate', 'in-sample', or 'no-train'
+        module (str): 'adult', 'child', or 'neonate'
+        cause_list (str): 'insilico', or 'phmrc'
+        params (dict): split and resampling parameters
+        plan_dir (str): directory of saved plans
+
+    Returns:
+        str
+    """
+    key = hash_inputs(sorted(params.items()))[:12]
+    name = '{}_{}_{}_{}.npz'.format(analysis.replace('-', '_'), module,
+                                    cause_list, key)
+    return os.path.join(plan_dir, name)
+
+
+def load_plan(filepath, y, splits, params, resample_test=True,
+              resample_size=1, random_state=None):
+    """Load a saved plan, or draw and save it if it is missing or stale
+
+    Args:
+        filepath (str): path of the plan, see ``plan_filepath``
+        y (series): gold standard causes
+        splits: iterator of ``(train_index, test_index, split_id)``. Only
+            consumed if the plan is drawn.
+        params (dict): parameters saved with and checked against the plan
+        resample_test (bool): resample test data to a dirichlet
+            distribution
+        resample_size (float): scalar applied to n of test samples
+        random_state (int or None): base seed for resampling
+
+    Returns:
+        SplitPlan
+    """
+    os.makedirs(os.path.dirname(filepath) or '.', exist_ok=True)
+    # Concurrent runs wait for the first one to draw the plan and load it
+    # instead of each saving a plan of their own
+    with open(filepath + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if os.path.exists(filepath):
+            plan = SplitPlan.load(filepath)
+            if plan.matches(y, params):
+                return plan
+        plan = SplitPlan.from_splits(y, splits, resample_test, resample_size,
+                                     random_state, params)
+        plan.save(filepath)
+        return plan
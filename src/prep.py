@@ -3,13 +3,24 @@ import os
 import re
 import sys
 
+import numpy as np
 import pandas as pd
 
-from download import REPO_DIR, load_ghdx_data, filter_DtypeWarnnings
+try:
+    import pyarrow  # noqa: F401
+except ImportError:
+    pyarrow = None
+
+from cache import atomic_write
+from download import REPO_DIR, filter_DtypeWarnnings
+from ghdx import load_ghdx_data
 
 
 SITES = ['AP', 'Bohol', 'Dar', 'Mexico', 'Pemba', 'UP']
 CLEANED_DATA_DIR = os.path.join(REPO_DIR, 'data', 'cleaned')
+# Columns with few distinct labels which are stored as categoricals
+CATEGORICAL_COLUMNS = ['site', 'module', 'gs_text34', 'gs_text46',
+                       'gs_text55']
 
 
 def clean_codebook(codebook):
@@ -66,6 +77,81 @@ def clean_codebook(codebook):
     return df[order]
 
 
+def parse_coding(coding_str):
+    """Parse a codebook coding string into a label -> value dict.
+
+    Codebook entries have the form: '# "text" # "text" ... # "text"'. Some
+    entries contain numbers in the values so only digits followed by a space
+    and a double quote are used as encoded values.
+
+    Args:
+        coding_str (str): coding column of the codebook
+
+    Returns:
+        (dict)
+    """
+    return dict(zip(re.findall('(?<= ").+?(?=")', coding_str),
+                    map(int, re.findall(r'\d+(?= ")', coding_str))))
+
+
+class Codebook(object):
+    """Codebook with the coding of every categorical column parsed once.
+
+    Many categorical columns share a coding, such as yes, no, and don't
+    know. Columns are grouped by coding and each coding is stored as an
+    index of the labels and an array of the encoded values. A group of
+    columns is recoded in one pass by looking up the position of every cell
+    in the labels.
+
+    Args:
+        codebook (dataframe): cleaned GHDx codebook
+    """
+
+    def __init__(self, codebook):
+        self.codebook = codebook
+        cat_cols = codebook[codebook.type == 'categorical'].index
+        self.groups = {}
+        for col, coding_str in codebook.loc[cat_cols, 'coding'].items():
+            self.groups.setdefault(coding_str, []).append(col)
+        self.codings = {}
+        for coding_str in self.groups:
+            coding = parse_coding(coding_str)
+            # The last value is used for a missing code
+            values = np.array(list(coding.values()) + [np.nan])
+            self.codings[coding_str] = (pd.Index(list(coding)), values)
+
+    def recode(self, df):
+        """Recode categorical columns from their labels to their values
+
+        Labels which are not in the coding, including missing values, are
+        recoded to ``float('nan')``.
+
+        Args:
+            df (dataframe): GHDx data
+
+        Returns:
+            (dataframe): recoded categorical columns of ``df``
+        """
+        recoded = []
+        for coding_str, cols in self.groups.items():
+            cols = df.columns.intersection(cols, sort=False)
+            if not len(cols):
+                continue
+            labels, values = self.codings[coding_str]
+            block = df[cols].values
+            codes = labels.get_indexer(block.ravel())
+            recoded.append(pd.DataFrame(values[codes].reshape(block.shape),
+                                        index=df.index, columns=cols))
+        if not recoded:
+            return df[[]]
+        recoded = pd.concat(recoded, axis=1)
+
+        # Match the dtype pd.to_numeric would give: int if nothing is missing
+        complete = recoded.columns[recoded.notnull().all().values]
+        recoded[complete] = recoded[complete].astype(int)
+        return recoded
+
+
 def recode_ghdx_data(df, codebook):
     """Recode the values of columns to match the codebook.
 
@@ -78,35 +164,32 @@ def recode_ghdx_data(df, codebook):
 
     Args:
         df (dataframe): a single module of raw GHDx data
-        codebook (dataframe): cleaned GHDx codebook
+        codebook (dataframe or Codebook): cleaned GHDx codebook. Pass a
+            ``Codebook`` to reuse the parsed codings for several modules.
 
     Returns:
         (dataframe)
     """
+    if not isinstance(codebook, Codebook):
+        codebook = Codebook(codebook)
+
     # Create an string identifier which is unique across all observations
     df['sid'] = df.module + df.newid.astype(str)
     df = df.set_index('sid')
 
-    cat_cols = codebook[codebook.type == 'categorical'].index
-    for col in cat_cols.intersection(df.columns):
-        # Codebook entries have the form: '# "text" # "text" ... # "text"'
-        # Some entries contain numbers in the values so only digits followed
-        # by a space and a double quote should be used as encoded values
-        coding_str = codebook.at[col, 'coding']
-        coding = dict(zip(re.findall('(?<= ").+?(?=")', coding_str),
-                          map(int, re.findall('\d+(?= ")', coding_str))))
-        df[col] = pd.to_numeric(df[col].map(coding))
+    recoded = codebook.recode(df)
+    df[recoded.columns] = recoded
 
     # Some numeric columns contain the string "Don't Know". These columns
     # were imported as object dtype instead of numeric. Force to numeric
     # replacing DK with missing
-    num_cols = codebook[codebook.type == 'numeric'].index
+    num_cols = codebook.codebook[codebook.codebook.type == 'numeric'].index
     num_cols = num_cols.intersection(df.columns)
     df[num_cols] = df[num_cols].apply(pd.to_numeric, errors='coerce')
 
     # Word columns contain frequencies. Change them to indicators.
     word_cols = df.filter(like="word_").columns
-    df[word_cols] = df[word_cols].applymap(lambda x: int(x > 0))
+    df[word_cols] = (df[word_cols].values > 0).astype(int)
 
     return df
 
@@ -174,7 +257,7 @@ def fix_ghdx_pox(df):
         (dataframe): the same dataframe is returned with inplace modifications.
     """
     if 'word_pox' in df:
-        df.word_rash = (df.word_rash + df.word_pox).map(lambda x: int(x > 0))
+        df.word_rash = ((df.word_rash + df.word_pox) > 0).astype(int)
         df.drop('word_pox', axis=1, inplace=True)
     return df
 
@@ -254,6 +337,7 @@ def clean_ghdx_files():
     print('Cleaning codebook...', end='')
     sys.stdout.flush()
     codebook = clean_codebook(load_ghdx_data('codebook'))
+    compiled = Codebook(codebook)
     codebook.to_csv(os.path.join(CLEANED_DATA_DIR, 'ghdx_codebook.csv'),
                     encoding='utf-8')
     print(' done')
@@ -261,31 +345,110 @@ def clean_ghdx_files():
     for module in ['adult', 'child', 'neonate']:
         print('Recoding the {} GHDx file...'.format(module), end='')
         sys.stdout.flush()
-        df = recode_ghdx_data(load_ghdx_data(module), codebook)
+        df = recode_ghdx_data(load_ghdx_data(module), compiled)
         df = fix_ghdx_ages(df)
         df = fix_ghdx_pox(df)
         df = fix_ghdx_injuries(df)
         df = fix_ghdx_birth_weights(df)
         df = set_missing_durations(df, codebook)
-        df.to_csv(os.path.join(CLEANED_DATA_DIR, 'ghdx_{}.csv'.format(module)),
-                  encoding='utf-8')
+        save_cleaned_file(df, module)
         print(' done')
 
     print('Files are saved in {}'.format(CLEANED_DATA_DIR))
 
 
-def load_cleaned_file(module):
+def cleaned_filepath(module, fmt='parquet'):
+    """Path of a cleaned file
+
+    Args:
+        module (str): 'adult', 'child', 'neonate' or 'codebook'
+        fmt (str): 'parquet' or 'csv'
+
+    Returns:
+        str
+    """
+    return os.path.join(CLEANED_DATA_DIR, 'ghdx_{}.{}'.format(module, fmt))
+
+
+def cleaned_dtypes(df):
+    """Convert a cleaned module to the dtypes of the cleaned store
+
+    Sites and causes are stored as categoricals. Other text columns are
+    stored as strings, so a column which mixes text and numbers has a single
+    type.
+
+    Args:
+        df (dataframe): cleaned GHDx data
+
+    Returns:
+        (dataframe)
+    """
+    df = df.copy()
+    for col in df.columns.intersection(CATEGORICAL_COLUMNS):
+        if col == 'site':
+            df[col] = pd.Categorical(df[col], categories=SITES)
+        else:
+            df[col] = df[col].astype('category')
+    for col in df.columns[df.dtypes == object]:
+        df[col] = df[col].where(df[col].isnull(), df[col].astype(str))
+    return df
+
+
+def save_cleaned_file(df, module):
+    """Save a cleaned module
+
+    Modules are saved as Parquet files with the dtypes from
+    ``cleaned_dtypes``, so columns are read without parsing text and a
+    subset of columns can be read without reading the rest of the file. If
+    pyarrow is not installed the module is saved as a CSV.
+
+    Args:
+        df (dataframe): cleaned GHDx data
+        module (str): 'adult', 'child', or 'neonate'
+
+    Returns:
+        str: path of the saved file
+    """
+    fmt = 'csv' if pyarrow is None else 'parquet'
+    filepath = cleaned_filepath(module, fmt)
+
+    def write(tmp):
+        if fmt == 'parquet':
+            cleaned_dtypes(df).to_parquet(tmp, engine='pyarrow',
+                                          compression='zstd')
+        else:
+            df.to_csv(tmp, encoding='utf-8')
+
+    atomic_write(filepath, write)
+    return filepath
+
+
+def load_cleaned_file(module, columns=None):
     """Load the cleaned GHDX files.
 
+    Modules are read from the Parquet store if it exists, and otherwise
+    from the CSV written by earlier versions.
+
     Args:
         module (str): 'adult', 'child', 'neonate' or 'codebook'
+        columns (list): columns to read in addition to the index. Defaults
+            to all columns.
 
     Returns:
         (dataframe)
     """
-    file_ = os.path.join(CLEANED_DATA_DIR, 'ghdx_{}.csv'.format(module))
+    file_ = cleaned_filepath(module)
+    if pyarrow is not None and os.path.exists(file_):
+        return pd.read_parquet(file_, engine='pyarrow', columns=columns)
+
+    file_ = cleaned_filepath(module, 'csv')
+    usecols = None
+    if columns is not None:
+        index_col = pd.read_csv(file_, nrows=0, encoding='utf-8').columns[0]
+        usecols = [index_col] + list(columns)
     with filter_DtypeWarnnings():
-        return pd.read_csv(file_, index_col=0, encoding='utf-8')
+        return pd.read_csv(file_, index_col=0, usecols=usecols,
+                           encoding='utf-8')
 
 
 if __name__ == '__main__':
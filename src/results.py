@@ -1,7 +1,6 @@
 from __future__ import print_function
 from collections import OrderedDict
 from itertools import product
-import glob
 import os
 import sys
 
@@ -9,10 +8,12 @@ import pandas as pd
 import numpy as np
 import yaml
 
-from download import REPO_DIR, load_ghdx_data
+from dataset import EXTENDED_DATASET_DIR, PARTITIONS, read_table
+from download import REPO_DIR
+from ghdx import load_ghdx_data
 from map_insilico import INSILICO_CAUSE_MAP, INSILICO_SYMPTOM_MAP
 from map_tariff import TARIFF_SYMPTOM_MAP
-from metrics import calc_median_and_ui
+from metrics import bootstrap_median_and_ui, calc_median_and_ui
 from paper import PAPER_DIR, TABLES
 
 
@@ -42,7 +43,8 @@ yaml.add_representer(OrderedDict, represent_ordereddict)
 def get_methods_numbers():
     num = OrderedDict()
 
-    ghdx = {module: load_ghdx_data(module) for module in MODULES}
+    ghdx = {module: load_ghdx_data(module, columns=['gs_text34'])
+            for module in MODULES}
     stillbirths = ghdx['neonate'].gs_text34 == 'Stillbirth'
 
     num['n_records'] = format(sum([len(df) for df in ghdx.values()]), ',')
@@ -70,31 +72,15 @@ def get_methods_numbers():
 
 
 def load_insilico_output_by_splits():
-    data_dir = os.path.join(REPO_DIR, 'data')
-    analyses = {
-        'results_default_insilico': ('default', ''),
-        'results_insilico_insilico': ('validate', 'insilico_insilico_'),
-        'results_phmrc_tariff': ('validate', 'phmrc_tariff_'),
-    }
-
-    results = []
-    for subdir, (analysis, file_tag) in analyses.items():
-        for module in MODULES:
-            for hce in ['w_hce', 'no_hce']:
-                filename = '{}_insilico_{}_{}_{}accuracy.csv'.format(
-                    analysis, module, hce, file_tag)
-                df = pd.read_csv(os.path.join(data_dir, subdir, filename))
-                df['hce'] = hce
-                df['analysis'] = subdir[len('results_'):]
-                df['module'] = module
-                results.append(df)
-    return pd.concat(results)
+    analyses = ['default_insilico', 'insilico_insilico', 'phmrc_tariff']
+    return read_table('accuracy', analysis=analyses, module=list(MODULES),
+                      hce=['w_hce', 'no_hce'])
 
 
 def get_extended_convergence_data():
-    pattern = os.path.join(REPO_DIR, 'data', 'results_*_ext',
-                           '*accuracy.csv')
-    return [pd.read_csv(f).converged.mean() for f in glob.glob(pattern)]
+    df = read_table('accuracy', columns=list(PARTITIONS) + ['converged'],
+                    root=EXTENDED_DATASET_DIR)
+    return df.groupby(list(PARTITIONS)).converged.mean().tolist()
 
 
 def get_point_estimate_with_ui(series, random_state=None):
@@ -113,10 +99,13 @@ def calc_summary_results(df):
     df.index.rename('measure', level=-1, inplace=True)
     df.name = 'value'
 
-    # Grouped across splits
-    return df.reset_index().groupby(['analysis', 'module', 'hce', 'measure']) \
-             .value.apply(get_point_estimate_with_ui, random_state=rs) \
-             .unstack()
+    # Grouped across splits. All groups are bootstrapped in one call in the
+    # same order as the groupby so the estimates do not change.
+    by = ['analysis', 'module', 'hce', 'measure']
+    keys, groups = zip(*df.reset_index().groupby(by).value)
+    stats = bootstrap_median_and_ui(groups, random_state=rs)
+    index = pd.MultiIndex.from_tuples(keys, names=by)
+    return pd.DataFrame(stats, index=index, columns=['value', 'lb', 'ub'])
 
 
 def format_median_and_ui(series):
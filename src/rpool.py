@@ -0,0 +1,108 @@
+"""Pool of long-lived processes with an embedded R session.
+
+The embedded R used by ``rpy2`` is single threaded and loading the InSilicoVA
+package (which also starts a JVM through rJava) takes several seconds. A
+``RWorkerPool`` starts a fixed number of worker processes which each load R
+and the package once when they start. Fitting and predicting with an
+``InsilicoClassifier`` is then sent to a worker, so several splits can run at
+once without reloading R.
+
+Example:
+    >>> with RWorkerPool(4) as pool:
+    ...     clf = InsilicoClassifier(r_pool=pool)
+    ...     pred, csmf = clf.fit(X_train, y_train).predict(X_test)
+"""
+import multiprocessing
+
+import numpy as np
+
+
+def init_worker():
+    """Load R and the InSilicoVA package when a worker starts"""
+    from insilico import InsilicoClassifier, get_r_package
+    InsilicoClassifier.get_r_insilico_package()
+    get_r_package('base')
+
+
+def encode(X):
+    """Compact the symptom data before sending it to a worker.
+
+    String encoded symptoms are object arrays which are slow to pickle.
+    These are replaced with int8 codes, which the classifier also accepts.
+
+    Args:
+        X (dataframe): symptoms encoded as 'Y', '', '.' or 1, 0, -1
+
+    Returns:
+        (dataframe)
+    """
+    if X is None:
+        return X
+    try:
+        X = X.replace({'Y': 1, '': 0, '.': -1})
+    except TypeError:  # if all columns are already numeric
+        pass
+    return X.astype(np.int8)
+
+
+def fit_worker(clf, X, y):
+    return clf.fit(X, y)
+
+
+def predict_worker(clf, X):
+    y_pred, csmf = clf.predict(X)
+    return y_pred, csmf, clf.converged_, clf.top_causes_
+
+
+def fit_predict_worker(clf, X_train, y_train, X_test):
+    clf.fit(X_train, y_train)
+    return predict_worker(clf, X_test)
+
+
+class RWorkerPool(object):
+    """Pool of processes with R and the InSilicoVA package already loaded.
+
+    Processes are started with the "spawn" method by default since the
+    embedded R does not reliably survive being forked.
+
+    Args:
+        processes (int): number of workers. Defaults to the number of CPUs.
+        context (str): multiprocessing start method
+    """
+
+    def __init__(self, processes=None, context='spawn'):
+        ctx = multiprocessing.get_context(context)
+        self.processes = processes or ctx.cpu_count()
+        self.pool = ctx.Pool(self.processes, initializer=init_worker)
+
+    def fit(self, clf, X, y):
+        """Fit a classifier in a worker and return the fitted copy"""
+        return self.pool.apply(fit_worker, (clf, encode(X), y))
+
+    def predict(self, clf, X):
+        """Predict in a worker.
+
+        Returns:
+            tuple: individual predictions, CSMF, convergence and top causes
+        """
+        return self.pool.apply(predict_worker, (clf, encode(X)))
+
+    def fit_predict_async(self, clf, X_train, y_train, X_test):
+        """Fit and predict in one round trip without waiting for the result.
+
+        Returns:
+            (multiprocessing.pool.AsyncResult): the result is a tuple of
+                individual predictions, CSMF, convergence and top causes
+        """
+        args = (clf, encode(X_train), y_train, encode(X_test))
+        return self.pool.apply_async(fit_predict_worker, args)
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
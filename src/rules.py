@@ -0,0 +1,212 @@
+"""Declarative rules for mapping PHMRC data to symptom indicators.
+
+A rule describes how a symptom is derived from the PHMRC columns using
+comparisons, ranges and any/all combinations of other rules. Because rules are
+data rather than functions, each rule knows which columns it reads, and two
+rules which describe the same operation compare equal. When rules are
+evaluated with a shared cache, sub-expressions which appear in several
+symptom maps are computed only once.
+
+Example:
+    >>> magegp1 = All(Equals('g5_02', 2), AtMost('g5_04a', 19))
+    >>> sorted(magegp1.columns)
+    ['g5_02', 'g5_04a']
+"""
+import functools
+import operator
+
+import pandas as pd
+
+
+class Duration(object):
+    """Duration in days from columns which record different units.
+
+    PHMRC records some durations split across columns, such as age in months
+    and days. Missing parts are treated as zero.
+
+    Args:
+        **units: column -> number of days in one unit of the column
+    """
+
+    def __init__(self, **units):
+        self.units = tuple(sorted(units.items()))
+
+    @property
+    def columns(self):
+        return frozenset(col for col, _ in self.units)
+
+    def values(self, data):
+        return sum(data[col].fillna(0) * days for col, days in self.units)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.units == other.units
+
+    def __hash__(self):
+        return hash((type(self).__name__, self.units))
+
+    def __repr__(self):
+        return 'Duration({})'.format(
+            ', '.join('{}={!r}'.format(col, days) for col, days in self.units))
+
+
+class Rule(object):
+    """Base class for rules.
+
+    Rules are immutable and compare equal if they are of the same type with
+    the same arguments. Subclasses implement ``evaluate``.
+    """
+
+    def __init__(self, *args):
+        self.args = args
+
+    @property
+    def columns(self):
+        """frozenset: PHMRC columns read by the rule"""
+        return frozenset()
+
+    def evaluate(self, data, cache=None):
+        raise NotImplementedError
+
+    def __call__(self, data, cache=None):
+        """Evaluate the rule on the cleaned data.
+
+        Args:
+            data (dataframe): cleaned PHMRC data
+            cache (dict): rule -> evaluated series. Results are read from and
+                added to the cache. It must only be shared between rules
+                evaluated on the same data.
+
+        Returns:
+            (series): boolean indicator, or float if the rule has no data
+        """
+        if cache is None:
+            return self.evaluate(data, cache)
+        if self not in cache:
+            cache[self] = self.evaluate(data, cache)
+        return cache[self]
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self.args == other.args
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((type(self).__name__, self.args))
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__,
+                               ', '.join(map(repr, self.args)))
+
+
+class NoData(Rule):
+    """Symptom which can not be derived from the PHMRC data"""
+
+    def evaluate(self, data, cache=None):
+        return pd.Series(float('nan'), index=data.index)
+
+
+class Comparison(Rule):
+    """Compare a column or duration to one or more values.
+
+    Comparisons with missing values are false.
+
+    Args:
+        operand (str or Duration): column name or duration
+        *values: values the operand is compared against
+    """
+
+    def __init__(self, operand, *values):
+        super(Comparison, self).__init__(operand, *values)
+        self.operand = operand
+        self.values = values
+
+    @property
+    def columns(self):
+        if isinstance(self.operand, Duration):
+            return self.operand.columns
+        return frozenset([self.operand])
+
+    def evaluate(self, data, cache=None):
+        if isinstance(self.operand, Duration):
+            x = self.operand.values(data)
+        else:
+            x = data[self.operand]
+        return self.compare(x, *self.values)
+
+
+class Equals(Comparison):
+    def compare(self, x, value):
+        return x == value
+
+
+class LessThan(Comparison):
+    def compare(self, x, value):
+        return x < value
+
+
+class GreaterThan(Comparison):
+    def compare(self, x, value):
+        return x > value
+
+
+class AtLeast(Comparison):
+    def compare(self, x, value):
+        return x >= value
+
+
+class AtMost(Comparison):
+    """Operand is no more than the value
+
+    Args:
+        operand (str or Duration): column name or duration
+        value (float): maximum value
+        missing (bool): result for missing values
+    """
+
+    def compare(self, x, value, missing=False):
+        if missing:
+            return (x <= value) | x.isnull()
+        return x <= value
+
+
+class Between(Comparison):
+    """Operand is within an inclusive range
+
+    Args:
+        operand (str or Duration): column name or duration
+        lower (float): minimum value
+        upper (float): maximum value
+    """
+
+    def compare(self, x, lower, upper):
+        return (x >= lower) & (x <= upper)
+
+
+class Combination(Rule):
+    """Combine the results of other rules.
+
+    Args:
+        *rules: rules to combine
+    """
+    op = None
+
+    def __init__(self, *rules):
+        super(Combination, self).__init__(*rules)
+        self.rules = rules
+
+    @property
+    def columns(self):
+        return frozenset().union(*(rule.columns for rule in self.rules))
+
+    def evaluate(self, data, cache=None):
+        return functools.reduce(self.op,
+                                [rule(data, cache) for rule in self.rules])
+
+
+class Any(Combination):
+    op = operator.or_
+
+
+class All(Combination):
+    op = operator.and_
@@ -0,0 +1,643 @@
+"""Native implementation of the InSilicoVA model.
+
+The InSilicoVA R package estimates conditional probabilities from training
+data in R (``extract.prob``) and then samples from the posterior of the
+hierarchical model with a Gibbs sampler written in Java (``insilico.fit``).
+This module ports both steps to vectorized NumPy so the classifier can run
+without R or a JVM. The port follows version 1.3.5 of the package, which is
+included in the root of this repository. Only the paths which are used with
+customized (non-InterVA) inputs are implemented: there is no sub-population,
+physician coding, external cause or impossible cause handling.
+"""
+from __future__ import division
+from collections import namedtuple
+from functools import partial
+import multiprocessing
+
+import numpy as np
+import pandas as pd
+from scipy.special import betainc, betaincinv
+
+from diagnostics import csmf_diag, effective_sample_size, gelman_rubin
+
+
+# Alphabetic levels of the InterVA conditional probabilities from high to low
+INTERVA_LEVELS = np.array(['I', 'A+', 'A', 'A-', 'B+', 'B', 'B-', 'C+', 'C',
+                           'C-', 'D+', 'D', 'D-', 'E', 'N'])
+
+# Numeric values of the InterVA levels
+INTERVA_TABLE = np.array([1, 0.8, 0.5, 0.2, 0.1, 0.05, 0.02, 0.01, 0.005,
+                          0.002, 0.001, 0.0005, 0.0001, 0.00001, 0])
+
+# Frequency of each level in the InterVA probbase (symptoms 2-246 by causes
+# 17-76 of ``data(probbase)``). Quantile learning matches this distribution.
+INTERVA_LEVEL_COUNTS = np.array([92, 197, 521, 287, 225, 1472, 199, 257, 2882,
+                                 449, 42, 4214, 101, 1262, 2500])
+
+InsilicoTrained = namedtuple('InsilicoTrained', [
+    'cond_prob',
+    'cond_prob_alpha',
+    'table_alpha',
+    'table_num',
+    'symps_train',
+])
+
+SamplerFit = namedtuple('SamplerFit', [
+    'indiv_prob',
+    'csmf',
+    'conditional_probs',
+    'n_sim',
+    'thin',
+    'burn_in',
+    'converged',
+    'rhat',
+    'ess',
+])
+
+
+def extract_prob(X, y, learning_type='quantile', missingness_threshold=0.95,
+                 random_state=None):
+    """Extract conditional probabilities from training data.
+
+    This is a port of ``extract.prob`` from the InSilicoVA R package using
+    numerically encoded data. Symptoms with a proportion of missingness above
+    the threshold are dropped. The probability of each symptom conditional on
+    each cause, P(S|C), is the proportion of non-missing observations which
+    endorse the symptom. Cause-symptom pairs with too few non-missing
+    observations are imputed with the overall prevalence of the symptom and
+    probabilities of exactly zero or one are jittered away from the bounds.
+
+    Args:
+        X (dataframe): training data with symptoms encoded as 1 for yes, 0 for
+            no and -1 for missing
+        y (series): true cause for each observation
+        learning_type (str): 'quantile', 'fixed' or 'empirical'
+        missingness_threshold (float): maximum proportion of missingness for
+            a symptom to be used
+        random_state (int or RandomState): seed for the jitter
+
+    Returns:
+        (namedTuple): InsilicoTrained:
+
+            * cond_prob (dataframe): symptoms by causes matrix of numbers
+            * cond_prob_alpha (dataframe): symptoms by causes matrix of levels
+            * table_alpha (np.array): levels from high to low
+            * table_num (np.array): numeric value of each level
+            * symps_train (dataframe): training data with only symptoms used
+    """
+    if learning_type not in ['quantile', 'fixed', 'empirical']:
+        raise ValueError('Unknown learning type: "{}"'.format(learning_type))
+    if not isinstance(random_state, np.random.RandomState):
+        random_state = np.random.RandomState(random_state)
+    thre = missingness_threshold
+
+    values = X.values
+    keep = (values == -1).mean(axis=0) <= thre
+    X = X.loc[:, keep]
+    values = values[:, keep]
+
+    yes = (values == 1).astype(float)
+    miss = (values == -1).astype(float)
+
+    causes, codes = np.unique(y.values, return_inverse=True)
+    onehot = np.eye(len(causes))[codes]
+    n_cause = onehot.sum(axis=0)[:, None]
+
+    denom = n_cause - onehot.T.dot(miss)
+    denom[denom < n_cause * (1 - thre)] = np.nan
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cond = (onehot.T.dot(yes) / denom).T
+
+    overall = yes.mean(axis=0)
+    nans = np.isnan(cond)
+    cond[nans] = np.broadcast_to(overall[:, None], cond.shape)[nans]
+
+    zeros = cond == 0
+    ones = cond == 1
+    cond[zeros] = random_state.uniform(1e-6, 2e-6, zeros.sum())
+    cond[ones] = 1 - random_state.uniform(1e-6, 2e-6, ones.sum())
+
+    if learning_type == 'quantile':
+        # ``toLevel`` assigns the reversed levels (N to I) using the cumulative
+        # frequencies of the levels in their original order (I to N)
+        cutoffs = np.cumsum(INTERVA_LEVEL_COUNTS / INTERVA_LEVEL_COUNTS.sum())
+        table = np.quantile(cond, cutoffs)
+        midpoints = (cutoffs + np.concatenate([[0], cutoffs[:-1]])) / 2
+        table_num = np.quantile(cond, midpoints)[::-1]
+        idx = np.minimum(np.searchsorted(table, cond, side='left'),
+                         len(table) - 1)
+        alpha = INTERVA_LEVELS[::-1][idx]
+        table_alpha = INTERVA_LEVELS.copy()
+    elif learning_type == 'fixed':
+        table_num = INTERVA_TABLE.copy()
+        cuts = np.concatenate([[1], table_num[:-1] + np.diff(table_num) / 2])
+        # Cutoffs are decreasing, the last (smallest) cutoff which is not
+        # below the value determines the level
+        below = cond[..., None] <= cuts
+        idx = len(cuts) - 1 - np.argmax(below[..., ::-1], axis=-1)
+        alpha = INTERVA_LEVELS[idx]
+        table_alpha = INTERVA_LEVELS.copy()
+    else:
+        alpha = None
+        table_alpha = None
+        table_num = None
+
+    cond_prob = pd.DataFrame(cond, index=X.columns, columns=causes)
+    if alpha is not None:
+        alpha = pd.DataFrame(alpha, index=X.columns, columns=causes)
+
+    return InsilicoTrained(cond_prob, alpha, table_alpha, table_num, X)
+
+
+def truncated_beta(a, b, lower, upper, random_state):
+    """Sample from beta distributions truncated to an interval.
+
+    Sampling uses the inverse cdf. If the interval has (almost) no mass the
+    midpoint is returned, matching ``MathUtil.truncbeta`` in the Java sampler.
+
+    Args:
+        a (array): first shape parameter
+        b (array): second shape parameter
+        lower (array): lower truncation bound
+        upper (array): upper truncation bound
+        random_state (RandomState)
+
+    Returns:
+        (array)
+    """
+    a, b, lower, upper = np.broadcast_arrays(a, b, lower, upper)
+    ymin = betainc(a, b, lower)
+    ymax = betainc(a, b, upper)
+    u = random_state.uniform(size=a.shape)
+    out = betaincinv(a, b, u * (ymax - ymin) + ymin)
+    flat = np.abs(ymax - ymin) < 1e-8
+    return np.where(flat, (lower + upper) / 2, out)
+
+
+class InsilicoSampler(object):
+    """Gibbs sampler for the InSilicoVA hierarchical model.
+
+    This is a vectorized port of ``InsilicoSampler2`` from the Java code in
+    the InSilicoVA package. The CSMF is modeled as the softmax of a normally
+    distributed vector ``theta``. Each iteration samples a cause for every
+    death from its naive Bayes posterior, updates the mean and variance of
+    ``theta``, takes a Metropolis step for ``theta`` and (optionally) updates
+    the conditional probabilities using truncated beta distributions which
+    preserve the ordering of the levels.
+
+    Args:
+        indic (array): deaths by symptoms matrix coded 1, 0, -1 (missing)
+        probbase (array): symptoms by causes matrix of initial conditional
+            probabilities
+        probbase_order (array): symptoms by causes matrix of level indices,
+            starting from zero for the highest level
+        level_values (array): numeric value of each level, high to low
+        prior_a (array): prior for the first beta parameter of each level
+        prior_b (float): prior for the second beta parameter
+        jump_scale (float): standard deviation of the Metropolis proposals
+        trunc_min (float): lower bound of the conditional probabilities
+        trunc_max (float): upper bound of the conditional probabilities
+        pool (int): 0 to update the table of level values, 1 to update the
+            values within each cause
+        update_cond_prob (bool): sample the conditional probabilities
+        random_state (int or RandomState)
+    """
+
+    def __init__(self, indic, probbase, probbase_order, level_values, prior_a,
+                 prior_b, jump_scale=0.1, trunc_min=0.0001, trunc_max=0.9999,
+                 pool=0, update_cond_prob=True, random_state=None):
+        if not isinstance(random_state, np.random.RandomState):
+            random_state = np.random.RandomState(random_state)
+        self.random_state = random_state
+
+        indic = np.asarray(indic)
+        self.yes = (indic == 1).astype(float)
+        self.no = (indic == 0).astype(float)
+        self.observed = self.yes + self.no
+        self.N, self.S = indic.shape
+
+        self.probbase = np.array(probbase, dtype=float)
+        self.C = self.probbase.shape[1]
+        self.order = np.asarray(probbase_order, dtype=int)
+        self.level_values = np.array(level_values, dtype=float)
+        self.n_level = len(self.level_values)
+        self.level_mask = self.order[None] == np.arange(self.n_level)[:, None,
+                                                                      None]
+        self.prior_a = np.asarray(prior_a, dtype=float)
+        self.prior_b = float(prior_b)
+        self.jump_scale = jump_scale
+        self.trunc_min = trunc_min
+        self.trunc_max = trunc_max
+        self.pool = pool
+        self.update_cond_prob = update_cond_prob
+
+        if pool == 1:
+            self._init_neighbor_levels()
+
+    def _init_neighbor_levels(self):
+        """Find the next higher and lower level present within each cause"""
+        present = self.level_mask.any(axis=1)   # levels by causes
+        L = self.n_level
+        self.prev_level = np.full((L, self.C), -1)
+        self.next_level = np.full((L, self.C), -1)
+        last = np.full(self.C, -1)
+        for l in range(L):
+            self.prev_level[l] = last
+            last = np.where(present[l], l, last)
+        last = np.full(self.C, -1)
+        for l in reversed(range(L)):
+            self.next_level[l] = last
+            last = np.where(present[l], l, last)
+
+    def init_state(self, mu=None, sigma2=1.):
+        """Randomly initialize the CSMF parameters.
+
+        Args:
+            mu (array): prior mean of theta, defaults to all ones
+            sigma2 (float): prior variance of theta
+
+        Returns:
+            (dict): state of the chain
+        """
+        theta = np.log(self.random_state.uniform(size=self.C) * 100)
+        theta[0] = 1
+        return {
+            'mu': np.ones(self.C) if mu is None else np.asarray(mu, float),
+            'sigma2': sigma2,
+            'theta': theta,
+        }
+
+    @staticmethod
+    def softmax(theta):
+        p = np.exp(theta - theta.max())
+        return p / p.sum()
+
+    def pnb(self, csmf):
+        """Naive Bayes probability of each cause for each death.
+
+        Products are computed on the log scale using matrix multiplication
+        over the non-missing symptoms.
+
+        Args:
+            csmf (array): current cause fractions
+
+        Returns:
+            (array): deaths by causes matrix with rows summing to one
+        """
+        with np.errstate(divide='ignore'):
+            log_p = (self.yes.dot(np.log(self.probbase)) +
+                     self.no.dot(np.log1p(-self.probbase)) +
+                     np.log(csmf))
+        log_p -= log_p.max(axis=1, keepdims=True)
+        p = np.exp(log_p)
+        return p / p.sum(axis=1, keepdims=True)
+
+    def sample_y(self, pnb):
+        """Draw a cause for each death from its categorical distribution."""
+        u = self.random_state.uniform(size=(len(pnb), 1))
+        y = (np.cumsum(pnb, axis=1) <= u).sum(axis=1)
+        return np.minimum(y, self.C - 1)
+
+    def update_theta(self, state, Y):
+        """Gibbs updates for mu and sigma2 and a Metropolis step for theta.
+
+        Args:
+            state (dict): current state, updated in place
+            Y (array): count of deaths assigned to each cause
+
+        Returns:
+            bool: the proposal was accepted
+        """
+        rs = self.random_state
+        theta = state['theta']
+        C = self.C
+
+        mu = rs.normal(theta.mean(), np.sqrt(state['sigma2'] / C))
+        state['mu'] = np.full(C, mu)
+        rate = ((theta - mu) ** 2).sum() / 2
+        state['sigma2'] = 1 / rs.gamma((C - 1) / 2, 1 / rate)
+
+        theta_new = rs.normal(theta, self.jump_scale)
+        theta_new[0] = 1
+        log_sum = np.log(np.exp(theta).sum())
+        log_sum_new = np.log(np.exp(theta_new).sum())
+        diffquad = (theta_new - mu) ** 2 - (theta - mu) ** 2
+        log_trans = (Y * (theta_new - theta - (log_sum_new - log_sum)) -
+                     diffquad / (2 * state['sigma2'])).sum()
+        if log_trans >= np.log(rs.uniform()):
+            state['theta'] = theta_new
+            return True
+        return False
+
+    def count_current(self, y):
+        """Count endorsed and non-missing symptoms by assigned cause."""
+        onehot = np.zeros((self.N, self.C))
+        onehot[np.arange(self.N), y] = 1
+        return self.yes.T.dot(onehot), self.observed.T.dot(onehot)
+
+    def trunc_beta_pool(self, count, count_all):
+        """Update the table of level values shared by all causes"""
+        L = self.n_level
+        count_l = (self.level_mask * count).sum(axis=(1, 2))
+        count_all_l = (self.level_mask * count_all).sum(axis=(1, 2))
+        new = np.zeros(L)
+        for l in range(L):
+            lower = self.trunc_min if l == L - 1 else \
+                max(self.level_values[l + 1], self.trunc_min)
+            upper = self.trunc_max if l == 0 else \
+                min(new[l - 1], self.trunc_max)
+            if lower >= upper:
+                new[l] = upper
+            else:
+                a = self.prior_a[l] + count_l[l]
+                b = self.prior_b + count_all_l[l] - a
+                new[l] = truncated_beta(a, b, lower, upper,
+                                        self.random_state)
+        self.level_values = new
+        self.probbase = new[self.order]
+
+    def trunc_beta(self, count, count_all):
+        """Update every conditional probability within the level ordering of
+        its cause"""
+        old = self.probbase
+        new = old.copy()
+        mask = self.level_mask
+        max_old = np.where(mask, old[None], -np.inf).max(axis=1)
+        min_new = np.full((self.n_level, self.C), np.inf)
+        causes = np.arange(self.C)
+        for l in range(self.n_level):
+            if not mask[l].any():
+                continue
+            nxt = self.next_level[l]
+            prv = self.prev_level[l]
+            lower = np.where(nxt >= 0, max_old[nxt, causes], -np.inf)
+            lower = np.maximum(lower, self.trunc_min)
+            upper = np.where(prv >= 0, min_new[prv, causes], np.inf)
+            upper = np.minimum(upper, self.trunc_max)
+
+            s, c = np.nonzero(mask[l])
+            lo, up = lower[c], upper[c]
+            a = self.prior_a[l] + count[s, c]
+            b = self.prior_b + count_all[s, c] - a
+            valid = lo < up
+            draws = up.copy()
+            draws[valid] = truncated_beta(a[valid], b[valid], lo[valid],
+                                          up[valid], self.random_state)
+            new[s, c] = draws
+            min_new[l] = np.where(mask[l], new, np.inf).min(axis=0)
+        self.probbase = new
+
+    def run(self, n_gibbs, burn=0, thin=1, state=None):
+        """Run the chain.
+
+        Args:
+            n_gibbs (int): total number of iterations
+            burn (int): number of iterations discarded before saving
+            thin (int): save every ``thin`` iteration after the burn in
+            state (dict): state to continue from. A new random state is
+                initialized if not provided.
+
+        Returns:
+            tuple:
+                * csmf (array): saved iterations by causes
+                * indiv_prob (array): deaths by causes mean of the naive
+                  Bayes probabilities over the saved iterations
+                * probs (array): saved level values (pool 0) or conditional
+                  probabilities (pool 1). None if not updated.
+                * state (dict): state of the last iteration
+        """
+        if state is None:
+            state = self.init_state()
+        n_thin = int((n_gibbs - burn) / thin)
+
+        csmf_gibbs = np.zeros((n_thin, self.C))
+        pnb_sum = np.zeros((self.N, self.C))
+        if not self.update_cond_prob:
+            probs_gibbs = None
+        elif self.pool == 0:
+            probs_gibbs = np.zeros((n_thin, self.n_level))
+        else:
+            probs_gibbs = np.zeros((n_thin, self.S, self.C))
+
+        p_now = self.softmax(state['theta'])
+        pnb = self.pnb(p_now)
+        for k in range(n_gibbs):
+            y = self.sample_y(pnb)
+            self.update_theta(state, np.bincount(y, minlength=self.C))
+            p_now = self.softmax(state['theta'])
+
+            if self.update_cond_prob:
+                count, count_all = self.count_current(y)
+                if self.pool == 0:
+                    self.trunc_beta_pool(count, count_all)
+                else:
+                    self.trunc_beta(count, count_all)
+
+            pnb = self.pnb(p_now)
+
+            if k >= burn and (k - burn + 1) % thin == 0:
+                save = (k - burn + 1) // thin - 1
+                if save >= n_thin:
+                    continue
+                pnb_sum += pnb
+                csmf_gibbs[save] = p_now
+                if probs_gibbs is not None:
+                    probs_gibbs[save] = (self.level_values if self.pool == 0
+                                         else self.probbase)
+
+        return csmf_gibbs, pnb_sum / max(n_thin, 1), probs_gibbs, state
+
+
+def insilico_fit(X, cond_prob, cond_prob_alpha=None, table_alpha=None,
+                 table_num=None, update_cond_prob=True,
+                 keep_prob_base_level=True, n_sim=4000, thin=10, burn_in=2000,
+                 auto_length=True, conv_csmf=0.02, jump_scale=0.1,
+                 levels_prior=None, levels_strength=1, trunc_min=0.0001,
+                 trunc_max=0.9999, seed=1, n_chains=1, n_jobs=None,
+                 rhat_threshold=1.1):
+    """Predict cause of death using the native InSilicoVA sampler.
+
+    This mirrors ``insilico.fit`` in the R package when called with
+    customized conditional probabilities (``customization.dev=TRUE``), which
+    is how ``insilico.train`` uses training data. Keyword arguments have the
+    same defaults as the R function.
+
+    Args:
+        X (dataframe): test data with symptoms encoded as 1, 0, -1. Symptoms
+            which do not appear in ``X`` are treated as missing.
+        cond_prob (dataframe): symptoms by causes numeric P(S|C)
+        cond_prob_alpha (dataframe): symptoms by causes P(S|C) levels. The
+            conditional probabilities are only updated if this is provided.
+        table_alpha (sequence): level labels from high to low
+        table_num (sequence): numeric values for each level
+        n_chains (int): number of independent chains. Draws from all chains
+            are pooled.
+        n_jobs (int): number of processes used to run the chains. Defaults
+            to one process per chain, up to the number of CPUs.
+        rhat_threshold (float): maximum Gelman-Rubin statistic for the chains
+            to be considered converged when running multiple chains
+
+    Returns:
+        (namedTuple): SamplerFit:
+
+            * indiv_prob (dataframe): deaths by causes probabilities
+            * csmf (dataframe): iterations by causes CSMF draws
+            * conditional_probs: draws of the level values or conditional
+              probabilities, None if these are not updated
+            * n_sim, thin, burn_in (int): final length of the longest chain
+            * converged (bool): result of the Heidelberger-Welch test for a
+              single chain, or all causes tested with ``conv_csmf`` have a
+              Gelman-Rubin statistic below ``rhat_threshold`` for multiple
+              chains
+            * rhat (series): Gelman-Rubin statistic for each cause, None for
+              a single chain
+            * ess (series): effective sample size of the CSMF of each cause
+
+    See Also:
+        extract_prob
+    """
+    symptoms = cond_prob.index
+    causes = cond_prob.columns
+    indic = X.reindex(columns=symptoms, fill_value=-1).values
+    N = len(indic)
+
+    update_cond_prob = update_cond_prob and cond_prob_alpha is not None
+    if update_cond_prob:
+        # ``InterVA.table`` replaces a zero level value with a tenth of the
+        # next smallest level
+        values = np.sort(np.asarray(table_num, dtype=float))[::-1]
+        if values.min() == 0:
+            values[-1] = values[-2] / 10
+        alpha_value = dict(zip(table_alpha, values))
+        cond_num = np.vectorize(alpha_value.get)(cond_prob_alpha.values)
+        order = np.searchsorted(-values, -cond_num)
+
+        # Random starting values are proportional to the InterVA table
+        start = INTERVA_TABLE * (trunc_max - trunc_min) + trunc_min
+        probbase = start[order]
+
+        # Drop levels which are not used and renumber the order matrix
+        exist = np.isin(np.arange(len(values)), order)
+        order = np.cumsum(exist)[order] - 1
+        level_values = values[exist]
+
+        prior_b = int(1.5 * N)
+        if keep_prob_base_level:
+            levelcount = np.unique(cond_num, return_counts=True)[1]
+            prior_b = int(prior_b * np.median(levelcount) * levels_strength)
+        else:
+            prior_b = int(prior_b * levels_strength)
+        if levels_prior is None:
+            dist = INTERVA_TABLE.copy()
+            dist[-1] = 1e-6
+            levels_prior = dist * prior_b * 0.99 / dist.max()
+        prior_a = np.asarray(levels_prior, dtype=float)[exist]
+    else:
+        probbase = cond_prob.values
+        order = np.zeros(probbase.shape, dtype=int)
+        level_values = np.ones(1)
+        prior_a = np.ones(1)
+        prior_b = 1
+
+    sampler_params = {
+        'indic': indic,
+        'probbase': probbase,
+        'probbase_order': order,
+        'level_values': level_values,
+        'prior_a': prior_a,
+        'prior_b': prior_b,
+        'jump_scale': jump_scale,
+        'trunc_min': trunc_min,
+        'trunc_max': trunc_max,
+        'pool': int(not keep_prob_base_level),
+        'update_cond_prob': update_cond_prob,
+    }
+    run = partial(run_chain, sampler_params, n_sim=n_sim, burn_in=burn_in,
+                  thin=thin, auto_length=auto_length, conv_csmf=conv_csmf)
+
+    # A single chain uses the seed directly so results match older versions.
+    # Additional chains draw their seeds from a generator seeded by ``seed``.
+    if n_chains == 1:
+        chains = [run(seed)]
+    else:
+        seeds = np.random.RandomState(seed).randint(2 ** 31 - 1,
+                                                    size=n_chains)
+        n_jobs = n_jobs or min(n_chains, multiprocessing.cpu_count())
+        if n_jobs == 1:
+            chains = [run(chain_seed) for chain_seed in seeds]
+        else:
+            # The calling process may have embedded R, which is not safe to
+            # fork
+            ctx = multiprocessing.get_context('spawn')
+            with ctx.Pool(n_jobs) as pool:
+                chains = pool.map(run, seeds)
+
+    csmf_chains, indiv_chains, prob_chains, n_sims, burn_ins, convs = \
+        zip(*chains)
+
+    # Pool the draws, weighting each chain by the number of saved draws
+    n_draws = np.array([len(draws) for draws in csmf_chains])
+    indiv = np.tensordot(n_draws / n_draws.sum(), np.array(indiv_chains), 1)
+    csmf_draws = np.concatenate(csmf_chains)
+    probs = None if prob_chains[0] is None else np.concatenate(prob_chains)
+
+    # Chains may have been extended by different amounts. Compare the final
+    # draws of equal length from each chain.
+    n_min = n_draws.min()
+    stacked = np.array([draws[-n_min:] for draws in csmf_chains])
+    ess = pd.Series(effective_sample_size(stacked), index=causes)
+    if n_chains == 1:
+        rhat = None
+        converged = convs[0]
+    else:
+        rhat = pd.Series(gelman_rubin(stacked), index=causes)
+        tested = csmf_draws.mean(axis=0) > conv_csmf
+        converged = bool((rhat[tested] < rhat_threshold).all())
+
+    indiv_prob = pd.DataFrame(indiv, index=X.index, columns=causes)
+    csmf = pd.DataFrame(csmf_draws, columns=causes)
+    if probs is not None and probs.ndim == 2:
+        labels = np.asarray(table_alpha)[exist] if update_cond_prob else None
+        probs = pd.DataFrame(probs, columns=labels)
+
+    return SamplerFit(indiv_prob, csmf, probs, max(n_sims), thin,
+                      max(burn_ins), converged, rhat, ess)
+
+
+def run_chain(sampler_params, seed, n_sim=4000, burn_in=2000, thin=10,
+              auto_length=True, conv_csmf=0.02):
+    """Run a single chain of the sampler.
+
+    This is a module level function so it can be sent to worker processes.
+
+    Args:
+        sampler_params (dict): keyword arguments for ``InsilicoSampler``
+        seed (int): seed for the chain
+
+    Returns:
+        tuple:
+            * csmf (array): saved iterations by causes
+            * indiv_prob (array): deaths by causes probabilities
+            * probs (array): saved draws of the conditional probabilities
+            * n_sim, burn_in (int): final length of the chain
+            * converged (bool): result of the Heidelberger-Welch test
+    """
+    sampler = InsilicoSampler(random_state=seed, **sampler_params)
+
+    csmf, indiv, probs, state = sampler.run(n_sim, burn_in, thin)
+    converged = csmf_diag(csmf, conv_csmf)
+
+    # If the chain has not converged, continue it (without burn in) up to
+    # two more times, doubling the length the second time
+    if auto_length:
+        add = 1
+        n_gibbs = n_sim
+        while not converged and add < 3:
+            n_gibbs = int(n_gibbs * 2 ** (add - 1))
+            n_sim = n_sim * 2
+            burn_in = n_sim // 2
+            csmf, indiv, probs, state = sampler.run(n_gibbs, 0, thin, state)
+            converged = csmf_diag(csmf, conv_csmf)
+            add += 1
+
+    return csmf, indiv, probs, n_sim, burn_in, converged
@@ -0,0 +1,427 @@
+"""Run the grid of validation jobs on one machine or on an SGE cluster.
+
+Each job is one run of ``analysis.py`` for a module, with or without health
+care experience symptoms, over a range of splits. Jobs are kept in a SQLite
+table with their state, so the scheduler can be stopped and started again
+and only runs the jobs which have not finished. Jobs which fail, for
+example when the embedded R session crashes, are retried a limited number
+of times. Splits completed by a failed attempt are checkpointed by
+``analysis.py`` and are not run again by the retry.
+
+The local backend runs jobs as subprocesses in a bounded pool. A job is
+only started if its memory estimate fits in the memory budget left by the
+jobs already running. The SGE backend submits jobs with ``qsub`` and polls
+the queue for their exit status.
+
+Example:
+    $ python src/scheduler.py add validate -n 500 -s tariff -c phmrc
+    $ python src/scheduler.py run --max-jobs 8
+    $ python src/scheduler.py status
+"""
+from __future__ import print_function
+import argparse
+import json
+import multiprocessing
+import os
+import sqlite3
+import subprocess
+import sys
+import time
+
+from prep import REPO_DIR
+
+
+JOBS_DB = os.path.join(REPO_DIR, 'data', 'jobs.sqlite')
+LOG_DIR = os.path.join(REPO_DIR, 'data', 'logs')
+MODULES = ['adult', 'child', 'neonate']
+STATES = ['pending', 'running', 'done', 'failed']
+
+
+def experiment_grid(analysis, n_splits, symptoms='insilico',
+                    cause_list='insilico', clf='insilico', step=1,
+                    extended=False, mem=10, n_jobs=1):
+    """Return the jobs of one analysis over every module, hce and split
+
+    The split plan of each module is drawn by a job in stage 0, which must
+    finish before the split jobs in stage 1 start.
+
+    Args:
+        analysis (str): 'validate' or 'default'
+        n_splits (int): total number of splits
+        symptoms (str): 'insilico', or 'tariff'
+        cause_list (str): 'insilico', or 'phmrc'
+        clf (str): name of the classifier
+        step (int): number of splits run by each job
+        extended (bool): run the classifier with longer chains and save to
+            the extended dataset
+        mem (float): memory estimate of each split job in GB
+        n_jobs (int): number of splits each job runs in parallel
+
+    Returns:
+        list of dicts: with keys name, args, stage and mem
+    """
+    analysis_arg = 'no-train' if analysis == 'default' else 'validate'
+    if extended:
+        symptoms_tag = symptoms + '_ext'
+    else:
+        symptoms_tag = symptoms
+    common = ['-a', analysis_arg, '--clf', clf, '-c', cause_list,
+              '-s', symptoms, '--n-splits', str(n_splits)]
+    if extended:
+        common += ['-p', 'n_sim', '12000', '-o', 'data/dataset_ext']
+
+    jobs = []
+    for module in MODULES:
+        name = [analysis, clf, module, cause_list, symptoms_tag, 'plan']
+        jobs.append({
+            'name': '_'.join(name),
+            'args': common + ['-m', module, '--plan-only'],
+            'stage': 0,
+            'mem': 2,
+        })
+        for hce in ['w_hce', 'no_hce']:
+            for start in range(0, n_splits, step):
+                stop = min(start + step, n_splits) - 1
+                name = [analysis, clf, module, hce, cause_list, symptoms_tag,
+                        'splits', '{}-{}'.format(start, stop)]
+                args = common + ['-m', module, '--subset', str(start),
+                                 str(stop), '-j', str(n_jobs)]
+                if hce == 'no_hce':
+                    args.append('--no-hce')
+                jobs.append({
+                    'name': '_'.join(name),
+                    'args': args,
+                    'stage': 1,
+                    'mem': mem,
+                })
+    return jobs
+
+
+class JobTable(object):
+    """SQLite table of jobs and their state.
+
+    Args:
+        path (str): database file. It is created if it does not exist.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            name TEXT PRIMARY KEY,
+            args TEXT NOT NULL,
+            stage INTEGER NOT NULL DEFAULT 0,
+            mem REAL NOT NULL DEFAULT 0,
+            state TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            handle TEXT,
+            returncode INTEGER,
+            started REAL,
+            finished REAL
+        )
+    """
+
+    def __init__(self, path=JOBS_DB):
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        with self.conn:
+            self.conn.execute(self.SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def add(self, jobs):
+        """Add jobs which are not already in the table
+
+        Returns:
+            int: number of jobs added
+        """
+        with self.conn:
+            cursor = self.conn.executemany(
+                'INSERT OR IGNORE INTO jobs (name, args, stage, mem) '
+                'VALUES (?, ?, ?, ?)',
+                [(job['name'], json.dumps(job['args']), job.get('stage', 0),
+                  job.get('mem', 0)) for job in jobs])
+        return cursor.rowcount
+
+    def jobs(self, state=None):
+        """Return jobs as dicts in the order they should run"""
+        query = 'SELECT * FROM jobs'
+        params = ()
+        if state is not None:
+            query += ' WHERE state = ?'
+            params = (state,)
+        query += ' ORDER BY stage, rowid'
+        rows = self.conn.execute(query, params).fetchall()
+        jobs = [dict(row) for row in rows]
+        for job in jobs:
+            job['args'] = json.loads(job['args'])
+        return jobs
+
+    def update(self, name, **values):
+        columns = ', '.join('{} = ?'.format(col) for col in values)
+        with self.conn:
+            self.conn.execute(
+                'UPDATE jobs SET {} WHERE name = ?'.format(columns),
+                list(values.values()) + [name])
+
+    def reset(self, states=('failed',)):
+        """Mark jobs in the given states as pending with no attempts"""
+        with self.conn:
+            self.conn.execute(
+                "UPDATE jobs SET state = 'pending', attempts = 0, "
+                "handle = NULL WHERE state IN ({})".format(
+                    ', '.join('?' * len(states))), list(states))
+
+    def counts(self):
+        """Return the number of jobs in each state"""
+        rows = self.conn.execute(
+            'SELECT state, COUNT(*) FROM jobs GROUP BY state').fetchall()
+        counts = dict.fromkeys(STATES, 0)
+        counts.update(dict(rows))
+        return counts
+
+
+def available_memory():
+    """Return the memory available for new processes in GB"""
+    with open('/proc/meminfo') as f:
+        for line in f:
+            if line.startswith('MemAvailable:'):
+                return int(line.split()[1]) / 2 ** 20
+    raise ValueError('MemAvailable not found in /proc/meminfo')
+
+
+def analysis_command(args):
+    return [sys.executable, '-u', os.path.join(REPO_DIR, 'src',
+                                               'analysis.py')] + args
+
+
+class LocalBackend(object):
+    """Run jobs as subprocesses of the scheduler.
+
+    Args:
+        max_jobs (int): maximum number of jobs running at once. Defaults to
+            the number of CPUs.
+        max_mem (float): memory budget in GB shared by the running jobs.
+            Defaults to 90% of the memory available when it is created.
+        command (callable): job args -> command line
+        log_dir (str): directory of the job logs
+    """
+    reattach = False
+
+    def __init__(self, max_jobs=None, max_mem=None, command=analysis_command,
+                 log_dir=LOG_DIR):
+        self.max_jobs = max_jobs or multiprocessing.cpu_count()
+        if max_mem is None:
+            max_mem = 0.9 * available_memory()
+        self.max_mem = max_mem
+        self.command = command
+        self.log_dir = log_dir
+        self.processes = {}
+
+    def admit(self, job, running):
+        """Whether a job fits beside the running jobs
+
+        A job which needs more than the whole budget is still run if nothing
+        else is running, so it is not starved.
+        """
+        if len(running) >= self.max_jobs:
+            return False
+        if not running:
+            return True
+        return sum(j['mem'] for j in running) + job['mem'] <= self.max_mem
+
+    def start(self, job):
+        if not os.path.exists(self.log_dir):
+            os.makedirs(self.log_dir)
+        with open(os.path.join(self.log_dir, job['name']), 'ab') as log:
+            proc = subprocess.Popen(self.command(job['args']), cwd=REPO_DIR,
+                                    stdout=log, stderr=subprocess.STDOUT)
+        self.processes[job['name']] = proc
+        return str(proc.pid)
+
+    def poll(self, job):
+        """Return the exit status of a job or None if it is running"""
+        returncode = self.processes[job['name']].poll()
+        if returncode is not None:
+            del self.processes[job['name']]
+        return returncode
+
+
+class SGEBackend(object):
+    """Submit jobs to a Sun Grid Engine cluster with ``qsub``.
+
+    Jobs run ``analysis.py`` in the singularity image of the repo. The
+    cluster does its own admission, so every pending job is submitted.
+
+    Args:
+        project (str): cluster project of the jobs
+        slots (int): number of slots requested by each job
+        log_dir (str): directory of the job logs
+    """
+    reattach = True
+
+    def __init__(self, project='proj_va', slots=5, log_dir=LOG_DIR):
+        self.project = project
+        self.slots = slots
+        self.log_dir = log_dir
+
+    def admit(self, job, running):
+        return True
+
+    def start(self, job):
+        log = os.path.join(self.log_dir, job['name'])
+        cmd = ['qsub', '-terse', '-N', job['name'], '-P', self.project,
+               '-o', log, '-e', log, '-pe', 'multi_slot', str(self.slots),
+               '-l', 'mem_free={:g}g'.format(job['mem']),
+               os.path.join(REPO_DIR, 'scripts', 'python_w_singularity.sh'),
+               REPO_DIR, '/home/src/analysis.py'] + job['args']
+        output = subprocess.check_output(cmd, universal_newlines=True)
+        return output.strip().split('.')[0]
+
+    def poll(self, job):
+        queued = subprocess.call(['qstat', '-j', job['handle']],
+                                 stdout=subprocess.DEVNULL,
+                                 stderr=subprocess.DEVNULL)
+        if queued == 0:
+            return None
+        try:
+            output = subprocess.check_output(['qacct', '-j', job['handle']],
+                                             universal_newlines=True,
+                                             stderr=subprocess.DEVNULL)
+        except subprocess.CalledProcessError:
+            # Accounting lags behind the queue for a short time
+            return None
+        for line in output.splitlines():
+            if line.startswith('exit_status'):
+                return int(line.split()[1])
+        return None
+
+
+def run(table, backend, retries=2, interval=5):
+    """Run the pending jobs of a table until every job has finished
+
+    Jobs are started in stage order. A job is only started once every job
+    of an earlier stage is done. Jobs which exit with an error are run
+    again up to ``retries`` more times.
+
+    Args:
+        table (JobTable): jobs to run
+        backend: ``LocalBackend`` or ``SGEBackend``
+        retries (int): number of times a failed job is run again
+        interval (float): seconds between polls of the running jobs
+
+    Returns:
+        dict: number of jobs in each state
+    """
+    running = table.jobs('running')
+    if not backend.reattach:
+        # Local jobs died with the scheduler which started them
+        for job in running:
+            table.update(job['name'], state='pending', handle=None)
+        running = []
+
+    while True:
+        for job in list(running):
+            returncode = backend.poll(job)
+            if returncode is None:
+                continue
+            running.remove(job)
+            if returncode == 0:
+                state = 'done'
+            elif job['attempts'] <= retries:
+                state = 'pending'
+            else:
+                state = 'failed'
+            table.update(job['name'], state=state, returncode=returncode,
+                         finished=time.time())
+            print('{} {} (exit status {})'.format(job['name'], state,
+                                                  returncode))
+
+        pending = table.jobs('pending')
+        if not running and not pending:
+            break
+        stage = min(job['stage'] for job in running + pending)
+        failed = [job['stage'] for job in table.jobs('failed')]
+        if failed and min(failed) < stage:
+            # Later stages need every job of the earlier stages
+            break
+
+        for job in pending:
+            if job['stage'] > stage or not backend.admit(job, running):
+                break
+            job['attempts'] += 1
+            job['handle'] = backend.start(job)
+            table.update(job['name'], state='running',
+                         attempts=job['attempts'], handle=job['handle'],
+                         started=time.time())
+            running.append(job)
+
+        time.sleep(interval)
+    return table.counts()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Schedule the grid of validation jobs.')
+    parser.add_argument('--db', default=JOBS_DB, help='Job table')
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    add = subparsers.add_parser('add', help='Add the jobs of an analysis')
+    add.add_argument('analysis', choices=['validate', 'default'])
+    add.add_argument('-n', '--n-splits', type=int, default=500)
+    add.add_argument('-s', '--symptoms', default='insilico',
+                     choices=['tariff', 'insilico'])
+    add.add_argument('-c', '--cause-list', default='insilico',
+                     choices=['insilico', 'phmrc'])
+    add.add_argument('--step', type=int, default=1,
+                     help='Number of splits in each job')
+    add.add_argument('--extended', action='store_true',
+                     help='Run longer chains and save to the extended '
+                          'dataset')
+    add.add_argument('--mem', type=float, default=10,
+                     help='Memory estimate of each job in GB')
+    add.add_argument('-j', '--n-jobs', type=int, default=1,
+                     help='Number of splits each job runs in parallel')
+
+    run_parser = subparsers.add_parser('run', help='Run the pending jobs')
+    run_parser.add_argument('--backend', default='local',
+                            choices=['local', 'sge'])
+    run_parser.add_argument('--max-jobs', type=int, default=None,
+                            help='Maximum number of local jobs at once')
+    run_parser.add_argument('--max-mem', type=float, default=None,
+                            help='Memory budget of the local jobs in GB')
+    run_parser.add_argument('--retries', type=int, default=2,
+                            help='Number of times a failed job is rerun')
+    run_parser.add_argument('--retry-failed', action='store_true',
+                            help='Run jobs which failed in earlier runs')
+
+    subparsers.add_parser('status', help='Count the jobs in each state')
+    args = parser.parse_args()
+
+    table = JobTable(args.db)
+    if args.command == 'add':
+        jobs = experiment_grid(args.analysis, args.n_splits, args.symptoms,
+                               args.cause_list, step=args.step,
+                               extended=args.extended, mem=args.mem,
+                               n_jobs=args.n_jobs)
+        print('Added {} of {} jobs'.format(table.add(jobs), len(jobs)))
+    elif args.command == 'run':
+        if args.retry_failed:
+            table.reset()
+        if args.backend == 'local':
+            backend = LocalBackend(args.max_jobs, args.max_mem)
+            counts = run(table, backend, args.retries, interval=5)
+        else:
+            backend = SGEBackend()
+            counts = run(table, backend, args.retries, interval=60)
+        print(counts)
+    else:
+        print(table.counts())
+    table.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+"""Append-only store of per-split validation results.
+
+Each split is written to its own file as soon as it finishes, so a long run
+which is interrupted only loses the splits in progress. The completed splits
+are the files in the store directory. A restarted run skips them, and a run
+can be extended to more splits by running it again with a larger subset.
+
+The parameters of the run are saved with the store. Results from runs with
+different parameters can not be mixed in a single store. A digest of the
+train and test positions may be saved with each split, so a split is only
+reused by runs which split the data the same way.
+"""
+import json
+import os
+import pickle
+
+import pandas as pd
+
+from cache import atomic_pickle, atomic_write
+
+
+class SplitStore(object):
+    """Directory of pickled ``prediction_accuracy`` results keyed by split.
+
+    Args:
+        path (str): directory for the store. It is created on first write.
+        params (dict): JSON-serializable parameters which produced the
+            results. If the store already has results from different
+            parameters a ValueError is raised.
+        digests (dict): digest of the train and test positions by split id,
+            see ``SplitPlan.split_digests``. If a completed split has a
+            different or no digest a ValueError is raised.
+    """
+    TABLES = ['predictions', 'csmf', 'ccc', 'accuracy']
+    PREFIX = 'split_'
+    SUFFIX = '.pkl'
+    DIGEST_SUFFIX = '.digest'
+    PARAMS_FILE = 'params.json'
+
+    def __init__(self, path, params=None, digests=None):
+        self.path = path
+        self.params = params
+        self.digests = digests
+        if params is not None:
+            self.check_params(params)
+        if digests is not None:
+            self.check_digests(digests)
+
+    def check_params(self, params):
+        filepath = os.path.join(self.path, self.PARAMS_FILE)
+        # Round trip through JSON so tuples and lists compare equal
+        params = json.loads(json.dumps(params, sort_keys=True))
+        if os.path.exists(filepath):
+            with open(filepath) as f:
+                saved = json.load(f)
+            if saved != params and self.completed():
+                raise ValueError('Store "{}" has results for different '
+                                 'parameters: {}'.format(self.path, saved))
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        with open(filepath, 'w') as f:
+            json.dump(params, f, sort_keys=True, indent=2)
+
+    def check_digests(self, digests):
+        for split_id in sorted(self.completed() & set(digests)):
+            if self.digest(split_id) != digests[split_id]:
+                raise ValueError('Store "{}" has results for split {} with '
+                                 'different train and test positions'
+                                 .format(self.path, split_id))
+
+    def filepath(self, split_id, suffix=None):
+        return os.path.join(self.path, '{}{}{}'.format(
+            self.PREFIX, split_id, suffix or self.SUFFIX))
+
+    def digest(self, split_id):
+        """Return the digest saved with a split, or None"""
+        filepath = self.filepath(split_id, self.DIGEST_SUFFIX)
+        if not os.path.exists(filepath):
+            return None
+        with open(filepath) as f:
+            return f.read()
+
+    def completed(self):
+        """Return the set of split ids with stored results"""
+        if not os.path.exists(self.path):
+            return set()
+        start, stop = len(self.PREFIX), -len(self.SUFFIX)
+        return {int(name[start:stop]) for name in os.listdir(self.path)
+                if name.startswith(self.PREFIX) and
+                name.endswith(self.SUFFIX)}
+
+    def __contains__(self, split_id):
+        return os.path.exists(self.filepath(split_id))
+
+    def write(self, split_id, results):
+        """Store the tuple of result dataframes for one split"""
+        if self.digests is not None and split_id in self.digests:
+            # Written first, so a completed split always has its digest
+            def write_digest(tmp):
+                with open(tmp, 'w') as f:
+                    f.write(self.digests[split_id])
+
+            atomic_write(self.filepath(split_id, self.DIGEST_SUFFIX),
+                         write_digest)
+        atomic_pickle(tuple(results), self.filepath(split_id))
+
+    def read(self, split_id):
+        """Return the tuple of result dataframes for one split"""
+        with open(self.filepath(split_id), 'rb') as f:
+            return pickle.load(f)
+
+    def load(self, split_ids=None):
+        """Concatenate the stored results
+
+        Args:
+            split_ids (list): splits to load in order. Defaults to all
+                completed splits in ascending order.
+
+        Returns:
+            (tuple of dataframes): same as ``validate``
+        """
+        if split_ids is None:
+            split_ids = sorted(self.completed())
+        results = [self.read(split_id) for split_id in split_ids]
+        return [pd.concat(output) for output in zip(*results)]
+
+    def clear(self):
+        for split_id in self.completed():
+            os.remove(self.filepath(split_id))
+            if os.path.exists(self.filepath(split_id, self.DIGEST_SUFFIX)):
+                os.remove(self.filepath(split_id, self.DIGEST_SUFFIX))
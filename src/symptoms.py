@@ -0,0 +1,133 @@
+"""Compact storage of symptom data.
+
+Mapped symptoms only take the values 1 (yes), 0 (no) and -1 (missing), so
+they are stored as int8, an eighth of the memory of the int64 frames read
+from CSV. ``SymptomMatrix`` holds the codes with the row and column labels
+and saves them as a ``.npy`` file, which can be memory-mapped, with the
+labels in a JSON file beside it.
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from cache import atomic_write
+
+
+CODES = (1, 0, -1)
+STRING_CODES = ('Y', '', '.')
+
+
+def symptom_encoding(X, strings=STRING_CODES):
+    """Determine how symptoms are encoded.
+
+    Integer data are checked with a single range comparison over the values
+    instead of testing membership of every cell.
+
+    Args:
+        X (dataframe): symptom data
+        strings (tuple): accepted string codes
+
+    Returns:
+        str: 'numeric' if encoded as 1, 0, -1, 'string' if encoded with
+            ``strings`` or None if neither
+    """
+    if len(X.columns) and all(np.issubdtype(dtype, np.integer)
+                              for dtype in X.dtypes):
+        values = X.values
+        if ((values >= -1) & (values <= 1)).all():
+            return 'numeric'
+        return None
+    if X.isin(CODES).all().all():
+        return 'numeric'
+    if X.isin(strings).all().all():
+        return 'string'
+    return None
+
+
+class SymptomMatrix(object):
+    """Symptoms coded as int8 with row and column labels.
+
+    Args:
+        values (array): samples by symptoms array of 1, 0 and -1
+        index (list): row labels
+        columns (list): symptom names
+    """
+    SUFFIX = '.npy'
+    LABELS_SUFFIX = '.json'
+
+    def __init__(self, values, index, columns):
+        values = np.asanyarray(values)
+        if values.ndim != 2 or values.shape != (len(index), len(columns)):
+            raise ValueError('Values must be a matrix matching the labels')
+        self.values = values.astype(np.int8, copy=False)
+        self.index = pd.Index(index, name='ID')
+        self.columns = pd.Index(columns)
+
+    @classmethod
+    def from_frame(cls, df):
+        """Convert a numerically encoded dataframe"""
+        if symptom_encoding(df) != 'numeric':
+            raise ValueError('Symptoms must be encoded as 1, 0 or -1')
+        return cls(df.values.astype(np.int8), df.index, df.columns)
+
+    def to_frame(self):
+        """Return a dataframe which shares memory with the matrix"""
+        df = pd.DataFrame(self.values, index=self.index,
+                          columns=self.columns, copy=False)
+        df.index.name = self.index.name
+        return df
+
+    @property
+    def shape(self):
+        return self.values.shape
+
+    def __len__(self):
+        return len(self.values)
+
+    @classmethod
+    def labels_filepath(cls, filepath):
+        return os.path.splitext(filepath)[0] + cls.LABELS_SUFFIX
+
+    def save(self, filepath):
+        """Save the codes to ``filepath`` and the labels beside it
+
+        Processes which have memory-mapped a previous version keep a
+        consistent view of it.
+        """
+        def write_labels(tmp):
+            with open(tmp, 'w') as f:
+                json.dump({'index': self.index.tolist(),
+                           'columns': self.columns.tolist()}, f)
+
+        def write_codes(tmp):
+            with open(tmp, 'wb') as f:
+                np.save(f, np.ascontiguousarray(self.values))
+
+        atomic_write(self.labels_filepath(filepath), write_labels)
+        atomic_write(filepath, write_codes)
+
+    @classmethod
+    def load(cls, filepath, mmap_mode='r'):
+        """Load a saved matrix
+
+        Args:
+            filepath (str): path of the ``.npy`` file
+            mmap_mode (str): passed to ``np.load``. By default the file is
+                memory-mapped read only. Use None to read it into memory.
+
+        Returns:
+            SymptomMatrix
+        """
+        with open(cls.labels_filepath(filepath)) as f:
+            labels = json.load(f)
+        values = np.load(filepath, mmap_mode=mmap_mode)
+        return cls(values, labels['index'], labels['columns'])
+
+
+def as_frame(X):
+    """Return symptoms as a dataframe if they are a ``SymptomMatrix``"""
+    if isinstance(X, SymptomMatrix):
+        return X.to_frame()
+    return X
@@ -1,15 +1,17 @@
 from __future__ import division
+import multiprocessing
 
 import numpy as np
 import pandas as pd
 from sklearn.dummy import DummyClassifier
 from sklearn.model_selection import StratifiedShuffleSplit, LeavePGroupsOut
-from sklearn.utils import resample, check_X_y
+from sklearn.utils import check_X_y
 from sklearn.utils.validation import check_is_fitted
 
 from prep import SITES
+from symptoms import as_frame
 from metrics import (
-    calc_ccc,
+    ConfusionMatrix,
     calc_csmf_accuracy_from_csmf,
     correct_csmf_accuracy
 )
@@ -100,8 +102,7 @@ def prediction_accuracy(clf, X_train, y_train, X_test, y_test,
     # which are not in the set of true causes. This primarily occurs when
     # the classifier is run using default settings and no training or when it
     # isn't properly learning impossible causes.
-    ccc = pd.DataFrame([{cause: calc_ccc(cause, y_test, y_pred)
-                         for cause in y_test.unique()}])
+    ccc = ConfusionMatrix(y_test, y_pred).ccc().to_frame().T
 
     # It's possible for some classes predictions not to occur
     # These would result in missingness when aligning the csmf series
@@ -128,6 +129,50 @@ def prediction_accuracy(clf, X_train, y_train, X_test, y_test,
     return preds, csmf, ccc, accuracy
 
 
+def dirichlet_resample_indices(y, n_samples=None, random_state=None):
+    """Draw positions of samples whose causes follow a dirichlet distribution.
+
+    Positions are grouped by cause once, and the draws for every cause are
+    made together, so the cost does not grow with the number of causes.
+    Causes which are not drawn are skipped, so a cause may have no samples.
+
+    Args:
+        y (series or array): target values
+        n_samples (int): number of positions to draw. If none this defaults
+            to the length of the input
+        random_state (int, Generator or None): seed for a
+            ``numpy.random.Generator``. If None, fresh entropy is used.
+
+    Returns:
+        (array): positions in ``y``, grouped by cause in sorted order
+    """
+    y = np.asarray(y)
+    if not n_samples:
+        n_samples = len(y)
+
+    rng = np.random.default_rng(random_state)
+    causes, codes = np.unique(y, return_inverse=True)
+    n_causes = len(causes)
+    sizes = np.bincount(codes, minlength=n_causes)
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    positions = np.argsort(codes, kind='stable')
+
+    # Draw samples from a dirichlet distribution where the alpha value for
+    # each cause is the same
+    csmf = rng.dirichlet(np.ones(n_causes))
+
+    # To calculate counts for each cause we multiply fractions through by the
+    # desired sampled size and round down. We then add counts for the total
+    # number of missing observations to achieve exactly the desired size.
+    counts = np.floor(csmf * n_samples).astype(int)
+    counts += rng.multinomial(n_samples - counts.sum(), csmf)
+
+    # Each draw picks a random sample of its cause with replacement
+    drawn = np.repeat(np.arange(n_causes), counts)
+    offsets = rng.integers(0, sizes[drawn])
+    return positions[starts[drawn] + offsets]
+
+
 def dirichlet_resample(X, y, n_samples=None, random_state=None):
     """Resample so that the predicted classes follow a dirichlet distribution.
 
@@ -148,66 +193,150 @@ def dirichlet_resample(X, y, n_samples=None, random_state=None):
     conjugate prior of the multinomial distribution and always sums to one, so
     it is suitable for resampling categorical data.
 
+    See ``dirichlet_resample_indices`` for the draws. Use it directly to
+    avoid copying the data when only the positions are needed.
+
     Args:
-        X (dataframe): samples by features matrix
+        X (dataframe or SymptomMatrix): samples by features matrix
         y (series): target values
         n_samples (int): number of samples in output. If none this defaults
             to the length of the input
+        random_state (int, Generator or None): seed for the draws
 
     Return:
         tuple:
             * X_new (dataframe): resampled data
             * y_new (series): resampled predictions
     """
+    X = as_frame(X)
     if len(X.index.symmetric_difference(y.index)):
         raise ValueError('X and y do not have matching indices')
-    check_X_y(X, y)
+    if len(X) != len(y):
+        raise ValueError('X and y have inconsistent numbers of samples')
 
-    if not n_samples:
-        n_samples = len(X)
+    idx = dirichlet_resample_indices(y, n_samples, random_state)
+    X_new = X.iloc[idx]
+    y_new = pd.Series(y.values[idx], index=X_new.index)
+    return X_new, y_new
 
-    causes = np.unique(y)
-    n_causes = len(causes)
 
-    # Draw samples from a dirichlet distribution where the alpha value for
-    # each cause is the same
-    csmf = np.random.dirichlet(np.ones(n_causes))
+def split_seed(random_state, split_id):
+    """Derive the seed used to resample the test data of one split.
 
-    # To calculate counts for each cause we multiply fractions through by the
-    # desired sampled size and round down. We then add counts for the total
-    # number of missing observations to achieve exactly the desired size.
-    counts = np.vectorize(int)(csmf * n_samples)
-    counts = counts + np.random.multinomial(n_samples - counts.sum(), csmf)
+    The seed depends only on the base seed and the split id, so results for
+    a split are the same whether it is run alone, as part of a subset, or by
+    any worker of a pool.
 
-    X_new = pd.concat([resample(X.loc[y == cause], n_samples=counts[i])
-                       for i, cause in enumerate(causes)])
-    y_new = pd.Series(np.repeat(causes, counts), index=X_new.index)
+    Args:
+        random_state (int or None): base seed of the analysis
+        split_id (int): identifier of the split
+
+    Returns:
+        int or None: None if ``random_state`` is None
+    """
+    if random_state is None:
+        return None
+    seq = np.random.SeedSequence([random_state, split_id])
+    return int(seq.generate_state(1)[0])
+
+
+def run_split(X, y, clf, train_index, test_index, split_id,
+              resample_test=True, resample_size=1, random_state=None):
+    """Measure the accuracy of a classifier on one split.
+
+    Args:
+        X (dataframe): rows are records, columns are features
+        y (series): predictions for each record
+        clf: sklearn-like classifier object
+        train_index (array or None): positions of the training records
+        test_index (array): positions of the test records
+        split_id (int): identifier added to each result
+        resample_test (bool): resample test data to a dirichlet distribution
+        resample_size (float): scalar applied to n of test samples
+        random_state (int or None): base seed for resampling
+
+    Returns:
+        (tuple of dataframes): sames as ``prediction_accuracy`` with a
+            ``split`` column added
+    """
+    if train_index is None:
+        X_train = None
+        y_train = None
+    else:
+        X_train = X.iloc[train_index]
+        y_train = y.iloc[train_index]
+
+    if resample_test:
+        n_samples = round(resample_size * len(test_index))
+        idx = dirichlet_resample_indices(
+            y.values[test_index], n_samples,
+            random_state=split_seed(random_state, split_id))
+        test_index = np.asarray(test_index)[idx]
+
+    X_test = X.iloc[test_index]
+    y_test = y.iloc[test_index]
+
+    results = prediction_accuracy(clf, X_train, y_train, X_test, y_test)
+    for result in results:
+        result['split'] = split_id
+    return results
 
-    assert len(X_new) == len(y_new) == n_samples
-    return X_new, y_new
+
+# Data shared by every split run in a worker process. It is set once by the
+# pool initializer so the data is not sent with every task.
+WORKER_DATA = {}
+
+
+def init_split_worker(X, y, clf, params):
+    # Pool workers are daemonic and can not start their own processes, so
+    # a classifier which runs in parallel is run in the worker instead
+    if hasattr(clf, 'n_jobs'):
+        clf.n_jobs = 1
+    WORKER_DATA.update(X=X, y=y, clf=clf, params=params)
+
+
+def split_worker(task):
+    results = run_split(WORKER_DATA['X'], WORKER_DATA['y'],
+                        WORKER_DATA['clf'], *task, **WORKER_DATA['params'])
+    return task[2], results
 
 
 def validate(X, y, clf, splits, subset=None, resample_test=True,
-             resample_size=1, random_state=None):
+             resample_size=1, random_state=None, n_jobs=1, store=None):
     """Mesaure out of sample accuracy of a classifier.
 
+    Splits are independent, so they may be run in parallel by a pool of
+    worker processes. Each worker receives its own copy of the data and the
+    classifier. Workers are started with the "spawn" method because forking
+    a process with an embedded R session is not safe. Results are returned
+    in split order regardless of the number of workers.
+
+    If a ``store`` is given, splits which it already contains are not run
+    again and each new split is written to it as soon as it finishes.
+
     Args:
-        X: (dataframe) rows are records, columns are features
+        X: (dataframe or SymptomMatrix) rows are records, columns are
+            features
         y: (series) predictions for each record
         clf: sklearn-like classifier object. It must implement a fit method
             with the signature ``(X, y) --> self`` and a predict method with
             a signature ``(X) --> (y, csmf)``
-        model_selector: (sklearn model_selection) iterator to produce
-            test-train splits with optional split_id method added
-        groups: (series) encoded group labels for each sample
-        ids: (dict) column -> constant, added to the returned dataframe
+        splits: iterator of ``(train_index, test_index, split_id)``
         subset: (tuple of int) splits to perform
+        resample_test (bool): resample test data to a dirichlet distribution
+        resample_size (float): scalar applied to n of test samples
+        random_state (int or None): base seed for resampling the test data.
+            The seed of each split is derived from this and the split id.
+        n_jobs (int or None): number of worker processes. If None, one per
+            CPU. Splits are run in this process if ``n_jobs`` is 1.
+        store (store.SplitStore): checkpoint of completed splits
 
     Returns:
         (tuple of dataframes): sames as ``prediction_accuracy`` for every split
             in ``subset`` with results concatenated.
     """
-    output = [[], [], [], []]
+    X = as_frame(X)
+    tasks = []
     for i, (train_index, test_index, split_id) in enumerate(splits):
         if subset:
             start, stop = subset
@@ -215,31 +344,56 @@ def validate(X, y, clf, splits, subset=None, resample_test=True,
                 continue
             if i > stop:
                 break
-
-        if train_index is None:
-            X_train = None
-            y_train = None
-        else:
-            X_train = X.iloc[train_index]
-            y_train = y.iloc[train_index]
-
-        X_test = X.iloc[test_index]
-        y_test = y.iloc[test_index]
-
-        if resample_test:
-            n_samples = round(resample_size * len(X_test))
-            X_test, y_test = dirichlet_resample(X_test, y_test, n_samples)
-
-        results = prediction_accuracy(clf, X_train, y_train, X_test, y_test)
-
-        for i, result in enumerate(results):
-            result['split'] = split_id
-            output[i].append(result)
-
-    return list(map(pd.concat, output))
+        tasks.append((train_index, test_index, split_id))
+
+    results = {}
+    if store is not None:
+        completed = store.completed()
+        for task in tasks:
+            if task[2] in completed:
+                results[task[2]] = store.read(task[2])
+    pending = [task for task in tasks if task[2] not in results]
+
+    params = {
+        'resample_test': resample_test,
+        'resample_size': resample_size,
+        'random_state': random_state,
+    }
+    if n_jobs is None:
+        n_jobs = multiprocessing.cpu_count()
+    n_jobs = min(n_jobs, len(pending))
+
+    if n_jobs > 1:
+        ctx = multiprocessing.get_context('spawn')
+        pool = ctx.Pool(n_jobs, initializer=init_split_worker,
+                        initargs=(X, y, clf, params))
+        finished = pool.imap_unordered(split_worker, pending, chunksize=1)
+    else:
+        pool = None
+        finished = ((task[2], run_split(X, y, clf, *task, **params))
+                    for task in pending)
+
+    try:
+        for split_id, result in finished:
+            if store is not None:
+                store.write(split_id, result)
+            results[split_id] = result
+    except BaseException:
+        # Splits still running would be lost anyway, so don't wait for them
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    ordered = [results[task[2]] for task in tasks]
+    return [pd.concat(output) for output in zip(*ordered)]
 
 
 def out_of_sample_splits(X, y, n_splits, test_size=.25, random_state=None):
+    X = as_frame(X)
     splits = StratifiedShuffleSplit(n_splits=n_splits, test_size=test_size,
                                     random_state=random_state).split(X, y)
     for i, (train, test) in enumerate(splits):
@@ -247,14 +401,14 @@ def out_of_sample_splits(X, y, n_splits, test_size=.25, random_state=None):
 
 
 def in_sample_splits(X, y, n_splits):
-    X, y = check_X_y(X, y)
+    X, y = check_X_y(as_frame(X), y)
     idx = np.arange(len(y))
     for i in range(n_splits):
         yield idx, idx, i
 
 
 def no_training_splits(X, y, n_splits):
-    X, y = check_X_y(X, y)
+    X, y = check_X_y(as_frame(X), y)
     idx = np.arange(len(y))
     for i in range(n_splits):
         yield None, idx, i
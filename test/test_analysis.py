@@ -1,6 +1,11 @@
+import numpy as np
+import pandas as pd
 import pytest
 
+import analysis
 from analysis import main
+from plan import SplitPlan
+from store import SplitStore
 
 
 skip = pytest.mark.skip(reason='Data is not mapped')
@@ -31,3 +36,38 @@ def test_analysis_main(tmpdir, analysis, module, symptoms, hce, cause_list,
         'outdir': tmpdir.strpath
     }
     main(**kwargs)
+
+
+def test_extend_run(tmpdir, monkeypatch):
+    rs = np.random.RandomState(8675309)
+    symptoms = pd.DataFrame(rs.choice([1, 0], size=(200, 5)))
+    causes = pd.Series(np.tile(['a', 'b', 'c', 'd'], 50))
+    monkeypatch.setattr(analysis, 'load_mapped',
+                        lambda *args, **kwargs: symptoms)
+    monkeypatch.setattr(analysis, 'get_sites_and_causes',
+                        lambda *args: (None, causes))
+    kwargs = {
+        'clf': 'random',
+        'analysis': 'validate',
+        'module': 'adult',
+        'symptoms': 'tariff',
+        'cause_list': 'insilico',
+        'resample_size': 1,
+        'split_seed': 8675309,
+        'test_size': 0.25,
+        'outdir': tmpdir.strpath,
+        'format': 'csv',
+    }
+    main(n_splits=4, **kwargs)
+    accuracy = main(n_splits=6, subset=[4, 5], **kwargs)[3]
+    assert accuracy.split.tolist() == [4, 5]
+    store, = tmpdir.join('splits').listdir()
+    assert SplitStore(store.strpath).completed() == set(range(6))
+
+    # A redrawn plan has other splits under the same ids
+    for filepath in tmpdir.join('plans').listdir('*.npz'):
+        plan = SplitPlan.load(filepath.strpath)
+        SplitPlan(plan.split_ids, plan.train[::-1], plan.test[::-1],
+                  plan.labels, plan.params).save(filepath.strpath)
+    with pytest.raises(ValueError):
+        main(n_splits=4, **kwargs)
@@ -0,0 +1,87 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import sampler
+from cache import DiskCache, atomic_write, hash_inputs
+from insilico import InsilicoClassifier
+
+
+class TestHashInputs(object):
+    def test_ignores_index(self):
+        df = pd.DataFrame({'a': [1, 0, -1]})
+        assert hash_inputs(df) == hash_inputs(df.set_index(df.index + 10))
+
+    @pytest.mark.parametrize('other', [
+        pd.DataFrame({'a': [1, 0, 0]}),
+        pd.DataFrame({'b': [1, 0, -1]}),
+        pd.DataFrame({'a': [1, 0, -1]}, dtype=float),
+    ])
+    def test_detects_changes(self, other):
+        df = pd.DataFrame({'a': [1, 0, -1]})
+        assert hash_inputs(df) != hash_inputs(other)
+
+    def test_params(self):
+        assert hash_inputs('quantile', 0.95) != hash_inputs('fixed', 0.95)
+        assert hash_inputs(np.arange(3)) == hash_inputs(np.arange(3))
+
+
+def test_atomic_write(tmpdir):
+    filepath = tmpdir.join('sub', 'file.txt').strpath
+    atomic_write(filepath, lambda tmp: open(tmp, 'w').write('new'))
+    assert open(filepath).read() == 'new'
+
+    def fail(tmp):
+        open(tmp, 'w').write('partial')
+        raise RuntimeError
+
+    with pytest.raises(RuntimeError):
+        atomic_write(filepath, fail)
+    assert open(filepath).read() == 'new'
+    assert os.listdir(tmpdir.join('sub').strpath) == ['file.txt']
+
+
+class TestDiskCache(object):
+    def test_roundtrip(self, tmpdir):
+        cache = DiskCache(str(tmpdir))
+        assert cache.get('key') is None
+        cache.set('key', {'a': pd.Series([1, 2])})
+        assert 'key' in cache
+        assert cache.get('key')['a'].tolist() == [1, 2]
+
+    def test_evicts_least_recently_used(self, tmpdir):
+        cache = DiskCache(str(tmpdir))
+        for i, key in enumerate(['a', 'b', 'c']):
+            cache.set(key, np.zeros(1000))
+            os.utime(cache.filepath(key), (i, i))
+        size = os.path.getsize(cache.filepath('a'))
+        cache.get('a')  # a is now the most recently used
+        cache.max_size = 2 * size
+        cache.evict()
+        assert 'a' in cache
+        assert 'b' not in cache
+        assert 'c' in cache
+
+
+class TestClassifierCache(object):
+    def test_refit_reads_cache(self, tmpdir, monkeypatch):
+        rs = np.random.RandomState(8675309)
+        X = pd.DataFrame(rs.choice([1, 0, -1], size=(50, 5), p=[.3, .6, .1]),
+                         columns=list('abcde'))
+        y = pd.Series(rs.choice(['x', 'y'], 50))
+        clf = InsilicoClassifier(engine='numpy', prob_cache=str(tmpdir))
+        first = clf.fit(X, y).cond_prob_
+
+        def fail(*args, **kwargs):
+            raise AssertionError('Conditional probabilities recomputed')
+
+        monkeypatch.setattr(sampler, 'extract_prob', fail)
+        second = clf.fit(X, y).cond_prob_
+        pd.testing.assert_frame_equal(first, second)
+        assert clf.symptoms_touse_ == list('abcde')
+
+        clf.learning_type = 'fixed'
+        with pytest.raises(AssertionError):
+            clf.fit(X, y)
@@ -0,0 +1,80 @@
+import os
+
+import pandas as pd
+import pytest
+
+from dataset import analysis_label, read_table, write_results, write_table
+
+
+def results(split):
+    preds = pd.DataFrame({'ID': [0, 1], 'actual': ['a', 'b'],
+                          'prediction': ['b', 'b'], 'split': split})
+    csmf = pd.DataFrame({'cause': ['a', 'b'], 'actual': [.5, .5],
+                         'prediction': [0, 1.], 'split': split})
+    ccc = pd.DataFrame({'a': [-1.], 'b': [0.], 'split': split})
+    accuracy = pd.DataFrame({'mean_ccc': [-.5], 'converged': [1],
+                             'split': split})
+    return preds, csmf, ccc, accuracy
+
+
+@pytest.fixture
+def root(tmpdir):
+    for i, (module, hce) in enumerate([('adult', 'w_hce'),
+                                       ('adult', 'no_hce'),
+                                       ('child', 'no_hce')]):
+        write_results(results(i), 'phmrc_tariff', module, hce, 'run',
+                      root=tmpdir.strpath)
+    return tmpdir.strpath
+
+
+class TestDataset(object):
+    def test_roundtrip(self, root):
+        preds = read_table('predictions', root=root, module='child')
+        assert preds.prediction.dtype == 'category'
+        assert preds.split.tolist() == [2, 2]
+        assert (preds.analysis == 'phmrc_tariff').all()
+        assert (preds.hce == 'no_hce').all()
+
+    def test_filters_partitions(self, root):
+        accuracy = read_table('accuracy', root=root, module=['adult'],
+                              hce='no_hce', columns=['split', 'module'])
+        assert accuracy.columns.tolist() == ['split', 'module']
+        assert accuracy.split.tolist() == [1]
+
+    def test_only_partitions_are_filtered(self, root):
+        with pytest.raises(ValueError):
+            read_table('accuracy', root=root, split=0)
+
+    def test_splits_are_read_once(self, tmpdir):
+        root = tmpdir.strpath
+        ages = []
+        for i, (name, splits) in enumerate([('combined', [0, 1, 2]),
+                                             ('validate_0-3', [0, 1, 2, 3]),
+                                             ('validate_0-1', [0, 1])]):
+            accuracy = pd.DataFrame({'mean_ccc': [float(i)] * len(splits),
+                                     'split': splits})
+            ages.append(write_table(accuracy, 'accuracy', 'phmrc_tariff',
+                                    'adult', 'w_hce', name, root=root))
+        for i, filepath in enumerate(ages):
+            os.utime(filepath, (i, i))
+
+        accuracy = read_table('accuracy', root=root).sort_values('split')
+        assert accuracy.split.tolist() == [0, 1, 2, 3]
+        # Each split comes from the newest file which has it
+        assert accuracy.mean_ccc.tolist() == [2, 2, 1, 1]
+
+    def test_file_without_splits(self, tmpdir):
+        root = tmpdir.strpath
+        old = write_table(pd.DataFrame({'mean_ccc': [0.]}), 'accuracy',
+                          'phmrc_tariff', 'adult', 'w_hce', 'old', root=root)
+        os.utime(old, (0, 0))
+        write_table(pd.DataFrame({'mean_ccc': [1.], 'split': [0]}),
+                    'accuracy', 'phmrc_tariff', 'adult', 'w_hce', 'new',
+                    root=root)
+        assert read_table('accuracy', root=root).mean_ccc.tolist() == [1.]
+
+    def test_analysis_label(self):
+        assert analysis_label('validate', 'insilico', 'phmrc',
+                              'tariff') == 'phmrc_tariff'
+        assert analysis_label('no-train', 'insilico', 'insilico',
+                              'insilico') == 'default_insilico'
@@ -0,0 +1,97 @@
+import os
+
+import pandas as pd
+import pytest
+
+from ghdx import TABLES, GHDxLoader, source_key
+
+
+@pytest.fixture
+def adult():
+    return pd.DataFrame({
+        'site': ['AP', 'Bohol', 'Dar'],
+        'gs_text34': ['Stroke', 'AIDS', 'Stroke'],
+        'g5_04a': [45.0, None, 70.0],
+    })
+
+
+@pytest.fixture
+def loader(tmpdir, adult):
+    url = 'sqlite:///{}'.format(tmpdir.join('phmrc.sqlite').strpath)
+    loader = GHDxLoader(url, snapshot_dir=tmpdir.join('snapshots').strpath)
+    adult.to_sql(TABLES['adult'], loader.engine, index=False)
+    yield loader
+    loader.close()
+
+
+class TestGHDxLoader(object):
+
+    def test_snapshot(self, loader, adult, monkeypatch):
+        pd.testing.assert_frame_equal(loader.load('adult'), adult)
+        filepath = loader.snapshot('adult')
+        assert os.path.exists(filepath)
+
+        def fail(module):
+            raise AssertionError('Read from the database')
+
+        monkeypatch.setattr(loader, 'read_sql', fail)
+        pd.testing.assert_frame_equal(loader.load('ADULT'), adult)
+
+    def test_refresh(self, loader, adult):
+        loader.load('adult')
+        first = loader.snapshot('adult')
+        changed = adult.assign(g5_04a=1.0)
+        changed.to_sql(TABLES['adult'], loader.engine, index=False,
+                       if_exists='replace')
+        pd.testing.assert_frame_equal(loader.load('adult'), adult)
+        pd.testing.assert_frame_equal(loader.load('adult', refresh=True),
+                                      changed)
+        assert loader.snapshot('adult') != first
+        # Earlier snapshots are left for readers which still use them
+        assert os.path.exists(first)
+
+    @pytest.mark.parametrize('snapshot', [False, True])
+    def test_columns(self, loader, adult, snapshot):
+        if snapshot:
+            loader.load('adult')
+        df = loader.load('adult', columns=['gs_text34'])
+        pd.testing.assert_frame_equal(df, adult[['gs_text34']])
+
+    @pytest.mark.parametrize('snapshot', [False, True])
+    def test_chunks(self, loader, adult, snapshot):
+        if snapshot:
+            loader.load('adult')
+        chunks = list(loader.load('adult', columns=['site', 'g5_04a'],
+                                  chunksize=2))
+        assert [len(chunk) for chunk in chunks] == [2, 1]
+        pd.testing.assert_frame_equal(
+            pd.concat(chunks, ignore_index=True), adult[['site', 'g5_04a']])
+
+    def test_projection_is_not_snapshot(self, loader):
+        loader.load('adult', columns=['site'])
+        assert loader.snapshot('adult') is None
+
+    def test_snapshots_are_kept_by_source(self, loader, tmpdir,
+                                          monkeypatch):
+        loader.load('adult')
+        assert loader.snapshot('adult') is not None
+        monkeypatch.delenv('GHDX_DB_URL', raising=False)
+        snapshot_dir = tmpdir.join('snapshots').strpath
+        assert GHDxLoader(snapshot_dir=snapshot_dir).snapshot('adult') \
+            is None
+        other = GHDxLoader('sqlite:///other.sqlite',
+                           snapshot_dir=snapshot_dir)
+        assert other.snapshot('adult') is None
+
+    def test_source_key_ignores_password(self):
+        assert source_key('postgresql://user:a@host/db') == \
+            source_key('postgresql://user:b@host/db')
+        assert source_key('postgresql://user:a@host/db') != \
+            source_key('postgresql://user:a@host/other')
+
+    def test_engine_is_reused(self, loader):
+        assert loader.engine is loader.engine
+
+    def test_unknown_module(self, loader):
+        with pytest.raises(ValueError):
+            loader.load('elderly')
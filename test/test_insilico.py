@@ -1,10 +1,17 @@
+import pickle
+
 import numpy as np
 import pandas as pd
 import pytest
 import rpy2.robjects
 import rpy2.robjects.packages
 
-from insilico import InsilicoClassifier
+from insilico import (
+    InsilicoClassifier,
+    encode_symptoms,
+    r_matrix_to_frame,
+    symptoms_to_r,
+)
 
 
 class TestGettters(object):
@@ -19,6 +26,15 @@ class TestGettters(object):
         assert isinstance(pkg.extract_prob,
                           rpy2.robjects.functions.DocumentedSTFunction)
 
+    def test_package_is_loaded_once(self):
+        assert InsilicoClassifier().r_insilico is \
+            InsilicoClassifier().r_insilico
+
+    def test_pickles_without_package(self):
+        clf = pickle.loads(pickle.dumps(InsilicoClassifier(n_sim=100)))
+        assert clf.n_sim == 100
+        assert clf.r_insilico is InsilicoClassifier.get_r_insilico_package()
+
     # def test_get_sample_data(self):
     #     clf = InsilicoClassifier()
     #     df = clf.get_sample_data()
@@ -267,3 +283,58 @@ class TestGettters(object):
 #         s = pd.Series(values, index=['a', 'b', 'c'])
 #         b = clf.indiv_most_probable(s)
 #         assert b == 'Undetermined'
+
+
+class TestTransfer(object):
+    def test_encode_symptoms(self):
+        df = pd.DataFrame({'a': ['Y', '', '.'], 'b': ['y', '.', '']})
+        encoded = encode_symptoms(df)
+        assert (encoded.dtypes == np.int8).all()
+        assert encoded.values.tolist() == [[1, 1], [0, -1], [-1, 0]]
+
+    @pytest.mark.parametrize('numeric,values', [
+        (True, [[1, 1], [0, -1], [-1, 0]]),
+        (False, [['Y', 'Y'], ['', '.'], ['.', '']]),
+    ])
+    def test_symptoms_to_r(self, numeric, values):
+        df = pd.DataFrame([[1, 1], [0, -1], [-1, 0]], columns=['a', 'b'],
+                          index=['I0', 'I1', 'I2'])
+        rdf = symptoms_to_r(df, numeric=numeric, id_col='ID',
+                            extra={'gs': ['x', 'y', 'x']})
+        assert list(rdf.names) == ['ID', 'a', 'b', 'gs']
+        assert list(rdf.rownames) == ['I0', 'I1', 'I2']
+        assert [list(rdf.rx2(c)) for c in ['a', 'b']] == \
+            [list(col) for col in zip(*values)]
+        assert list(rdf.rx2('gs')) == ['x', 'y', 'x']
+
+    def test_r_matrix_to_frame(self):
+        matrix = rpy2.robjects.r(
+            'matrix(c(1, 2, 3, 4, 5, 6), nrow=2, '
+            'dimnames=list(c("r1", "r2"), c("a", "b", "c")))')
+        df = r_matrix_to_frame(matrix)
+        assert df.index.tolist() == ['r1', 'r2']
+        assert df.columns.tolist() == ['a', 'b', 'c']
+        assert df.values.tolist() == [[1, 3, 5], [2, 4, 6]]
+
+
+class TestMostProbable(object):
+    @pytest.mark.parametrize('values,expected', [
+        ([0.1, 0.5, 0.4], 'b'),
+        ([1, 1, 1], 'Undetermined'),
+        ([np.nan, np.nan, np.nan], 'Undetermined'),
+        ([np.nan, 0.2, 0.3], 'c'),
+        ([0.5, 0.5, np.nan], 'a'),
+    ])
+    def test_most_probable(self, values, expected):
+        df = pd.DataFrame([values], columns=['a', 'b', 'c'])
+        assert InsilicoClassifier.most_probable(df).tolist() == [expected]
+
+    def test_top_causes(self):
+        df = pd.DataFrame([[0.1, 0.5, 0.4], [0.6, np.nan, 0.4]],
+                          columns=['a', 'b', 'c'], index=['x', 'y'])
+        top = InsilicoClassifier.top_causes(df, 2)
+        assert top.columns.tolist() == ['cause1', 'prob1', 'cause2', 'prob2']
+        assert top.index.tolist() == ['x', 'y']
+        assert top.cause1.tolist() == ['b', 'a']
+        assert top.cause2.tolist() == ['c', 'c']
+        assert top.prob2.tolist() == [0.4, 0.4]
@@ -0,0 +1,178 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from mapping import (
+    compile_symptom,
+    has_any,
+    map_symptoms,
+    one,
+    required_columns,
+)
+import map_insilico
+from map_insilico import INSILICO_SYMPTOM_MAP
+from map_tariff import TARIFF_SYMPTOM_MAP
+from rules import All, AtMost, Equals, GreaterThan, Rule
+from symptoms import SymptomMatrix
+
+
+def simulate(columns, n=300, random_state=None):
+    # Mix codes, durations and missing values so every branch is exercised
+    values = np.array([0, 1, 2, 3, 4, 8, 9, 0.5, 6.5, 19, 28, 49, 65, 400,
+                       np.nan])
+    data = random_state.choice(values, size=(n, len(columns)))
+    return pd.DataFrame(data, columns=columns)
+
+
+@pytest.mark.parametrize('maps', [INSILICO_SYMPTOM_MAP, TARIFF_SYMPTOM_MAP])
+@pytest.mark.parametrize('module', ['adult', 'child', 'neonate'])
+def test_compiled_matches_row_functions(maps, module):
+    mapping = maps[module]
+    data = simulate(required_columns(mapping),
+                    random_state=np.random.RandomState(8675309))
+    expected = map_symptoms(data, mapping, compiled=False)
+    actual = map_symptoms(data, mapping)
+    pd.testing.assert_frame_equal(actual, expected)
+
+
+def test_custom_functions_are_not_compiled():
+    assert compile_symptom(['a'], lambda row, mapping: 1) is None
+    assert compile_symptom('a', one) is not None
+    assert compile_symptom([('a', 1)], has_any) is not None
+
+
+# Row functions which were replaced by rules
+def infant(row, mapping=None):
+    row = row[['g5_04b', 'g5_04c']].fillna(0)
+    agedays = row.g5_04b * 30 + row.g5_04c
+    return int(agedays > 28 and agedays < 365)
+
+
+def magegp2(row, mapping=None):
+    return int(row.g5_02 == 2 and row.g5_04a >= 20 and row.g5_04a <= 34)
+
+
+def coma(row, mapping=None):
+    return int(row.a2_74 == 1 and row.a2_76 > 1)
+
+
+def diff_sw(row, mapping=None):
+    diff_w_liquids = row.a2_59 == 2 or row.a2_59 == 3
+    return int(row.a2_57 == 1 and diff_w_liquids)
+
+
+def pend_6w(row, mapping=None):
+    return int((row.a3_17 == 1 or row.a3_18 == 1) and row.a3_11 < 6 * 30)
+
+
+@pytest.mark.parametrize('fn', [infant, magegp2, coma, diff_sw, pend_6w])
+def test_rules_match_row_functions(fn):
+    rule = getattr(map_insilico, fn.__name__)
+    columns = sorted(rule.columns)
+    data = simulate(columns, random_state=np.random.RandomState(8675309))
+    expected = data.apply(fn, axis=1, args=(columns,))
+    pd.testing.assert_series_equal(rule(data).astype(int), expected)
+
+
+@pytest.mark.parametrize('maps', [INSILICO_SYMPTOM_MAP, TARIFF_SYMPTOM_MAP])
+def test_rule_sources_are_documented(maps):
+    for mapping in maps.values():
+        for target, source, fn in mapping:
+            if isinstance(fn, Rule) and source is not None:
+                assert set(source) == fn.columns, target
+
+
+def test_shared_rules_are_evaluated_once():
+    data = simulate(['g5_02', 'g5_04a'],
+                    random_state=np.random.RandomState(8675309))
+    female = Equals('g5_02', 2)
+    young = AtMost('g5_04a', 19)
+    young_female = All(female, young)
+    old = GreaterThan('g5_04a', 65)
+    first = [('magegp1', ['g5_02', 'g5_04a'], young_female),
+             ('female', 'g5_02', female)]
+    second = [('young_female', ['g5_02', 'g5_04a'], young_female),
+              ('old', 'g5_04a', old)]
+
+    cache = {}
+    map_symptoms(data, first, cache=cache)
+    assert set(cache) == {female, young, young_female}
+    evaluated = dict(cache)
+    map_symptoms(data, second, cache=cache)
+    assert set(cache) == {female, young, young_female, old}
+    # The shared rule was read from the cache rather than evaluated again
+    assert all(cache[rule] is evaluated[rule] for rule in evaluated)
+
+
+class TestIncrementalMapping(object):
+
+    @pytest.fixture
+    def env(self, tmpdir, monkeypatch):
+        import mapping
+        rs = np.random.RandomState(8675309)
+        modules = {module: simulate(['a', 'b', 'c'], n=50, random_state=rs)
+                   for module in ['adult', 'child', 'neonate']}
+        monkeypatch.setattr(mapping, 'MAPPED_DIR', tmpdir.strpath)
+        monkeypatch.setattr(mapping, 'load_cleaned_file',
+                            lambda module, columns: modules[module][columns])
+        calls = []
+        map_symptoms = mapping.map_symptoms
+
+        def spy(data, entries, **kwargs):
+            calls.append([target for target, _, _ in entries])
+            return map_symptoms(data, entries, **kwargs)
+
+        monkeypatch.setattr(mapping, 'map_symptoms', spy)
+        return mapping, calls
+
+    def feature_sets(self, mapping, rule):
+        symptoms = [('x', 'a', one), ('y', [('a', 1), ('b', 2)], has_any),
+                    ('z', ['b', 'c'], rule)]
+        maps = {module: symptoms for module in ['adult', 'child', 'neonate']}
+        return {'insilico': maps}
+
+    def test_remaps_changed_columns(self, env):
+        mapping, calls = env
+        rule = mapping.All(mapping.Equals('b', 1), mapping.Equals('c', 1))
+        mapping.map_feature_sets(self.feature_sets(mapping, rule))
+        assert calls == [['x', 'y', 'z']] * 3
+
+        del calls[:]
+        mapping.map_feature_sets(self.feature_sets(mapping, rule))
+        assert calls == []
+
+        changed = mapping.Any(mapping.Equals('b', 1), mapping.Equals('c', 1))
+        mapping.map_feature_sets(self.feature_sets(mapping, changed))
+        assert calls == [['z']] * 3
+        patched = SymptomMatrix.load(mapping.mapped_filepath(
+            'insilico', 'adult'), mmap_mode=None).to_frame()
+
+        mapping.map_feature_sets(self.feature_sets(mapping, changed),
+                                 incremental=False)
+        full = SymptomMatrix.load(mapping.mapped_filepath(
+            'insilico', 'adult')).to_frame()
+        pd.testing.assert_frame_equal(patched, full)
+
+
+class TestLoadMapped(object):
+
+    def test_no_hce_view(self, tmpdir, monkeypatch):
+        import mapping
+        monkeypatch.setattr(mapping, 'MAPPED_DIR', tmpdir.strpath)
+        monkeypatch.setattr(mapping, 'LOADED', {})
+        columns = ['sudden', 'heart_dis', 'fever']
+        df = pd.DataFrame([[1, 0, 1], [0, 1, -1]], columns=columns,
+                          index=pd.Index([3, 7], name='ID'), dtype=np.int8)
+        SymptomMatrix.from_frame(df).save(
+            mapping.mapped_filepath('insilico', 'adult'))
+
+        hce = mapping.load_mapped('insilico', 'adult')
+        no_hce = mapping.load_mapped('insilico', 'adult', hce=False)
+        pd.testing.assert_frame_equal(hce, df)
+        assert no_hce.columns.tolist() == columns
+        assert (no_hce.dtypes == np.int8).all()
+        assert (no_hce[['sudden', 'heart_dis']] == -1).all().all()
+        assert no_hce.fever.tolist() == [1, -1]
+        assert np.shares_memory(no_hce.fever.values, hce.fever.values)
+        assert mapping.load_mapped('insilico', 'adult').sudden.tolist() == \
+            [1, 0]
@@ -1,3 +1,4 @@
+import numpy as np
 import pandas as pd
 import pytest
 
@@ -38,3 +39,137 @@ class TestCCCSMFAccuracy(object):
         p = pd.Series([.5, .2, .2, .1], index=i)
         csmf_acc = calc_csmf_accuracy_from_csmf(a, p)
         assert csmf_acc == 1
+
+
+class TestConfusionMatrix(object):
+    def test_counts(self):
+        a = pd.Series(['a', 'a', 'b', 'b', 'c'])
+        p = pd.Series(['a', 'b', 'b', 'b', 'd'])
+        cm = ConfusionMatrix(a, p)
+        assert cm.labels.tolist() == ['a', 'b', 'c', 'd']
+        assert cm.causes.tolist() == ['a', 'b', 'c']
+        assert cm.matrix.sum() == 5
+        assert cm.counts('b') == (2, 0, 1, 2)
+        assert cm.counts('z') == (0, 0, 0, 5)
+
+    def test_matches_single_cause_metrics(self):
+        rs = np.random.RandomState(8675309)
+        a = pd.Series(rs.choice(list('abcd'), 200))
+        p = pd.Series(rs.choice(list('abcde'), 200))
+        cm = ConfusionMatrix(a, p)
+        for cause in 'abcd':
+            tp = ((a == cause) & (p == cause)).sum()
+            assert cm.sensitivity(cause) == tp / (a == cause).sum()
+            assert cm.positive_predictive_value(cause) == \
+                tp / (p == cause).sum()
+            assert cm.ccc()[cause] == (cm.sensitivity(cause) - 0.25) / 0.75
+        assert cm.overall_correctness() == (a == p).mean()
+
+    def test_missing_cause_is_nan(self):
+        cm = ConfusionMatrix(['a', 'b'], ['a', 'c'])
+        assert np.isnan(cm.sensitivity('c'))
+        assert np.isnan(cm.positive_predictive_value('b'))
+
+    def test_csmf_accuracy_drops_unknown_predictions(self):
+        a = pd.Series(['a', 'a', 'b', 'b'])
+        p = pd.Series(['a', 'a', 'b', 'c'])
+        assert calc_csmf_accuracy(a, p) == 1 - 0.25 / (2 * 0.5)
+
+    def test_mean_and_median_ccc(self):
+        a = pd.Series(['a', 'a', 'b', 'b', 'c', 'c'])
+        p = pd.Series(['a', 'a', 'b', 'a', 'a', 'a'])
+        ccc = [(s - 1 / 3) / (1 - 1 / 3) for s in (1, 0.5, 0)]
+        assert calc_mean_ccc(a, p) == pytest.approx(np.mean(ccc))
+        assert calc_median_ccc(a, p) == pytest.approx(np.median(ccc))
+        assert agg_cause_specific_metrics(np.mean, calc_ccc, a, p) == \
+            pytest.approx(np.mean(ccc))
+
+
+class TestBatchConfusionMatrix(object):
+    @pytest.fixture
+    def predictions(self):
+        rs = np.random.RandomState(8675309)
+        n = 20 * 30
+        df = pd.DataFrame({
+            'split': np.repeat(np.arange(20), 30),
+            'actual': rs.choice(list('abcd'), n),
+            'prediction': rs.choice(list('abcde'), n),
+        })
+        # Remove a cause from one split
+        df.loc[(df.split == 3) & (df.actual == 'd'), 'actual'] = 'a'
+        return df
+
+    def test_matches_confusion_matrix(self, predictions):
+        values, splits, causes = batch_cause_specific_metrics(predictions)
+        assert values.shape == (20, 4, 3)
+        for i, split in enumerate(splits):
+            df = predictions.loc[predictions.split == split]
+            cm = ConfusionMatrix(df.actual, df.prediction)
+            for j, cause in enumerate(causes):
+                if cause not in cm.causes:
+                    assert np.isnan(values[i, j]).all()
+                    continue
+                expected = [cm.sensitivity(cause), cm.specificity(cause),
+                            cm.ccc(cause)]
+                assert np.allclose(values[i, j], expected)
+
+    def test_to_frame_skips_absent_causes(self, predictions):
+        cm = BatchConfusionMatrix(predictions.split, predictions.actual,
+                                  predictions.prediction)
+        df = cm.to_frame()
+        assert df.index.names == ['split', 'cause']
+        assert len(df) == 20 * 4 - 1
+        assert (3, 'd') not in df.index
+
+    def test_unknown_metric(self, predictions):
+        with pytest.raises(ValueError):
+            batch_cause_specific_metrics(predictions, ['bogus'])
+
+
+class TestBootstrap(object):
+    def test_honours_n(self, monkeypatch):
+        calls = []
+        percentile = np.percentile
+
+        def spy(a, q):
+            calls.append(len(a))
+            return percentile(a, q)
+
+        monkeypatch.setattr(np, 'percentile', spy)
+        calc_median_and_ui(np.arange(10), n=37,
+                           random_state=np.random.RandomState(0))
+        assert calls == [37]
+
+    def test_seeded(self):
+        arr = np.random.RandomState(8675309).normal(size=50)
+        a = calc_median_and_ui(arr, random_state=np.random.RandomState(1))
+        b = calc_median_and_ui(arr, random_state=np.random.RandomState(1))
+        assert a == b
+        assert a[1][0] <= a[0] <= a[1][1]
+
+    def test_groups_match_sequential_calls(self):
+        rs = np.random.RandomState(8675309)
+        groups = [rs.normal(size=20), rs.normal(size=35), rs.normal(size=5)]
+        batched = bootstrap_median_and_ui(
+            groups, n=100, random_state=np.random.RandomState(2))
+        rs = np.random.RandomState(2)
+        for group, row in zip(groups, batched):
+            med, (lb, ub) = calc_median_and_ui(group, n=100, random_state=rs)
+            assert np.allclose(row, [med, lb, ub])
+
+
+@pytest.mark.parametrize('values', [
+    ['b', 'a', 'b'],
+    ['b', np.nan, 'a', 'b', None],
+    [np.nan, 'a', np.nan],
+    ['a', 'b', np.nan],
+])
+def test_factorize_keeps_missing(values):
+    from metrics import _factorize
+    values = np.array(values, dtype=object)
+    codes, labels = _factorize(values)
+    expected_codes, expected_labels = pd.factorize(values,
+                                                   use_na_sentinel=False)
+    assert codes.tolist() == expected_codes.tolist()
+    pd.testing.assert_index_equal(pd.Index(labels),
+                                  pd.Index(expected_labels))
@@ -0,0 +1,189 @@
+import json
+import os
+import textwrap
+
+import pytest
+
+from dataset import DATASET_DIR
+import pipeline
+from pipeline import Pipeline, Stage
+
+
+# Stage functions append their name to a log and write their output files.
+# They are imported by the worker processes from the test directory.
+STAGES_MODULE = textwrap.dedent('''
+    import os
+    import time
+
+    def step(log, name, inputs, output, sleep=0):
+        with open(log, 'a') as f:
+            f.write('start {}\\n'.format(name))
+        time.sleep(sleep)
+        text = name
+        for path in inputs:
+            with open(path) as f:
+                text += f.read()
+        with open(output, 'w') as f:
+            f.write(text)
+        with open(log, 'a') as f:
+            f.write('end {}\\n'.format(name))
+
+    def meet(log, name, other, output):
+        # Only finishes if the other stage starts while this one runs
+        with open(log, 'a') as f:
+            f.write('start {}\\n'.format(name))
+        for _ in range(200):
+            with open(log) as f:
+                if 'start {}\\n'.format(other) in f.read():
+                    break
+            time.sleep(0.05)
+        else:
+            raise RuntimeError('{} did not start'.format(other))
+        with open(output, 'w') as f:
+            f.write(name)
+
+    def fail():
+        raise RuntimeError('Stage failed')
+''')
+
+
+@pytest.fixture
+def workdir(tmpdir, monkeypatch):
+    tmpdir.join('pipeline_stages.py').write(STAGES_MODULE)
+    monkeypatch.syspath_prepend(tmpdir.strpath)
+    monkeypatch.setattr(pipeline, 'SRC_DIR', tmpdir.strpath)
+    tmpdir.join('raw.txt').write('raw')
+    return tmpdir
+
+
+def make_stage(workdir, name, inputs, requires=(), sleep=0, code=()):
+    output = workdir.join(name + '.txt').strpath
+    inputs = [workdir.join(path).strpath for path in inputs]
+    return Stage(name, 'pipeline_stages:step',
+                 args=[workdir.join('log').strpath, name, inputs, output,
+                       sleep],
+                 code=code, inputs=inputs, outputs=[output],
+                 requires=requires)
+
+
+def make_pipeline(workdir, sleep=0):
+    # raw.txt -> a -> b, c -> d
+    return Pipeline([
+        make_stage(workdir, 'a', ['raw.txt']),
+        make_stage(workdir, 'b', ['a.txt'], ['a'], sleep),
+        make_stage(workdir, 'c', ['a.txt'], ['a'], sleep),
+        make_stage(workdir, 'd', ['b.txt', 'c.txt'], ['b', 'c']),
+    ], state_file=workdir.join('state.json').strpath)
+
+
+def read_log(workdir):
+    return workdir.join('log').read().splitlines()
+
+
+class TestPipeline(object):
+
+    def test_skips_current_stages(self, workdir):
+        assert make_pipeline(workdir).run(n_jobs=2)[::3] == ['a', 'd']
+        assert workdir.join('d.txt').read() == 'dbarawcaraw'
+        assert make_pipeline(workdir).run(n_jobs=2) == []
+        with open(workdir.join('state.json').strpath) as f:
+            assert sorted(json.load(f)) == ['a', 'b', 'c', 'd']
+
+    def test_input_change(self, workdir):
+        make_pipeline(workdir).run(n_jobs=2)
+        workdir.join('raw.txt').write('new')
+        assert sorted(make_pipeline(workdir).run(n_jobs=2)) == \
+            ['a', 'b', 'c', 'd']
+
+    def test_unchanged_output_stops_reruns(self, workdir):
+        make_pipeline(workdir).run(n_jobs=2)
+        # b runs again, but writes the same output, so its key is unchanged
+        # and d is still current
+        workdir.join('b.txt').remove()
+        assert make_pipeline(workdir).run(n_jobs=2) == ['b']
+
+    def test_upstream_code_change(self, workdir):
+        workdir.join('a_helpers.py').write('# helpers of a')
+
+        def stages():
+            return Pipeline([
+                make_stage(workdir, 'a', ['raw.txt'], code=['a_helpers']),
+                make_stage(workdir, 'b', ['raw.txt'], ['a']),
+            ], state_file=workdir.join('state.json').strpath)
+
+        stages().run()
+        # a runs again but writes the same output, so b is still current
+        workdir.join('a_helpers.py').write('\n# edit', mode='a')
+        assert stages().run() == ['a']
+
+    def test_code_change(self, workdir):
+        make_pipeline(workdir).run(n_jobs=2)
+        workdir.join('pipeline_stages.py').write('\n# edit', mode='a')
+        assert len(make_pipeline(workdir).run(n_jobs=2)) == 4
+
+    def test_args_change(self, workdir):
+        make_pipeline(workdir).run(n_jobs=2)
+        assert make_pipeline(workdir, sleep=0.01).run(['b']) == ['b']
+
+    def test_targets(self, workdir):
+        assert make_pipeline(workdir).run(['b']) == ['a', 'b']
+        assert not workdir.join('c.txt').exists()
+
+    def test_force(self, workdir):
+        make_pipeline(workdir).run(['a'])
+        assert make_pipeline(workdir).run(['a'], force=True) == ['a']
+
+    def test_dry_run(self, workdir):
+        make_pipeline(workdir).run(['b'])
+        assert make_pipeline(workdir).run(dry_run=True) == ['c', 'd']
+        assert not workdir.join('c.txt').exists()
+
+    def test_parallel_stages(self, workdir):
+        log = workdir.join('log').strpath
+        stages = [
+            Stage(name, 'pipeline_stages:meet',
+                  args=[log, name, other, workdir.join(name).strpath],
+                  outputs=[workdir.join(name).strpath])
+            for name, other in [('b', 'c'), ('c', 'b')]]
+        stages.append(make_stage(workdir, 'd', ['b', 'c'], ['b', 'c']))
+        Pipeline(stages, workdir.join('state.json').strpath).run(n_jobs=2)
+        assert read_log(workdir)[-2:] == ['start d', 'end d']
+
+    def test_failure(self, workdir):
+        stages = [make_stage(workdir, 'a', ['raw.txt']),
+                  Stage('broken', 'pipeline_stages:fail', requires=['a'])]
+        state_file = workdir.join('state.json').strpath
+        with pytest.raises(RuntimeError):
+            Pipeline(stages, state_file).run()
+        with open(state_file) as f:
+            assert list(json.load(f)) == ['a']
+
+    def test_keys_of_other_runs_are_kept(self, workdir):
+        # Another invocation finished c while this one ran a
+        first, second = make_pipeline(workdir), make_pipeline(workdir)
+        second.save_key('c', 'key')
+        first.run(['a'])
+        with open(workdir.join('state.json').strpath) as f:
+            assert sorted(json.load(f)) == ['a', 'c']
+        assert not [path for path in workdir.listdir()
+                    if path.ext == '.tmp']
+
+    def test_cycle(self, workdir):
+        with pytest.raises(ValueError):
+            Pipeline([Stage('a', 'm:f', requires=['b']),
+                      Stage('b', 'm:f', requires=['a'])])
+
+    def test_unknown_stage(self, workdir):
+        with pytest.raises(ValueError):
+            Pipeline([Stage('a', 'm:f', requires=['b'])])
+        with pytest.raises(ValueError):
+            make_pipeline(workdir).run(['e'])
+
+
+def test_default_stages():
+    stages = Pipeline(pipeline.default_stages(), state_file=os.devnull)
+    assert stages.order.index('annex') < stages.order.index('results')
+    # Only outputs which every run writes, so the stage can be current
+    assert stages.stages['combine'].outputs == [DATASET_DIR]
+    assert stages.closure(pipeline.TARGETS['mapped']) == \
+        {'download', 'prep', 'map_insilico', 'map_tariff'}
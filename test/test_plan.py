@@ -0,0 +1,128 @@
+import fcntl
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from plan import SplitPlan, load_plan, plan_filepath
+from validation import (
+    RandomClassifier,
+    no_training_splits,
+    out_of_sample_splits,
+    validate,
+)
+
+
+@pytest.fixture
+def xy():
+    rs = np.random.RandomState(8675309)
+    X = pd.DataFrame(rs.choice([1, 0, -1], size=(100, 4)))
+    y = pd.Series(np.tile(['a', 'b', 'c', 'd', 'e'], 20))
+    return X, y
+
+
+class TestSplitPlan(object):
+
+    def test_matches_validate(self, xy):
+        X, y = xy
+        plan = SplitPlan.from_splits(
+            y, out_of_sample_splits(X, y, 4, random_state=0), random_state=5)
+        expected = validate(X, y, RandomClassifier(random_state=1),
+                            out_of_sample_splits(X, y, 4, random_state=0),
+                            random_state=5)
+        results = validate(X, y, RandomClassifier(random_state=1),
+                           plan.splits(), resample_test=False)
+        for output, other in zip(results, expected):
+            pd.testing.assert_frame_equal(output, other)
+
+    def test_roundtrip(self, xy, tmpdir):
+        X, y = xy
+        filepath = tmpdir.join('plan.npz').strpath
+        for splits in [out_of_sample_splits(X, y, 3, random_state=0),
+                       no_training_splits(X, y, 3)]:
+            plan = SplitPlan.from_splits(y, splits, random_state=2,
+                                         params={'n_splits': 3})
+            plan.save(filepath)
+            loaded = SplitPlan.load(filepath)
+            assert len(loaded) == 3
+            assert loaded.params == {'n_splits': 3}
+            assert loaded.matches(y, {'n_splits': 3})
+            assert loaded.digest() == plan.digest()
+            for split, other in zip(plan.splits(), loaded.splits()):
+                if split[0] is None:
+                    assert other[0] is None
+                else:
+                    assert (split[0] == other[0]).all()
+                assert (split[1] == other[1]).all()
+                assert split[2] == other[2]
+
+    def test_digest(self, xy):
+        X, y = xy
+        plans = [SplitPlan.from_splits(
+            y, out_of_sample_splits(X, y, 2, random_state=seed),
+            random_state=5) for seed in [0, 0, 1]]
+        assert plans[0].digest() == plans[1].digest()
+        assert plans[0].digest() != plans[2].digest()
+
+    def test_split_digests(self, xy):
+        X, y = xy
+        four, six = [SplitPlan.from_splits(
+            y, out_of_sample_splits(X, y, n, random_state=0),
+            random_state=5).split_digests() for n in [4, 6]]
+        assert sorted(six) == list(range(6))
+        assert {k: six[k] for k in four} == four
+        assert len(set(six.values())) == 6
+
+    def test_matches(self, xy):
+        X, y = xy
+        plan = SplitPlan.from_splits(y, no_training_splits(X, y, 1),
+                                     params={'n_splits': 1})
+        assert plan.matches(y)
+        assert not plan.matches(y.replace({'a': 'b'}))
+        assert not plan.matches(y, {'n_splits': 2})
+
+
+def test_load_plan_is_shared(xy, tmpdir):
+    X, y = xy
+    params = {'n_splits': 3, 'random_state': None}
+    filepath = plan_filepath('validate', 'adult', 'insilico', params,
+                             plan_dir=tmpdir.strpath)
+    first = load_plan(filepath, y, out_of_sample_splits(X, y, 3), params)
+
+    def fail():
+        raise AssertionError('Splits redrawn')
+        yield
+
+    second = load_plan(filepath, y, fail(), params)
+    for split, other in zip(first.splits(), second.splits()):
+        assert (split[1] == other[1]).all()
+
+    other = plan_filepath('validate', 'adult', 'insilico',
+                          dict(params, n_splits=4), plan_dir=tmpdir.strpath)
+    assert other != filepath
+
+
+def test_load_plan_waits_for_draw(xy, tmpdir):
+    X, y = xy
+    params = {'n_splits': 3, 'random_state': 0}
+    filepath = tmpdir.join('plan.npz').strpath
+    plan = SplitPlan.from_splits(
+        y, out_of_sample_splits(X, y, 3, random_state=0), params=params)
+
+    def fail():
+        raise AssertionError('Splits redrawn')
+        yield
+
+    loaded = []
+    with open(filepath + '.lock', 'w') as lock:
+        # Another run is drawing the plan
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        thread = threading.Thread(target=lambda: loaded.append(
+            load_plan(filepath, y, fail(), params)))
+        thread.start()
+        thread.join(0.2)
+        assert thread.is_alive()
+        plan.save(filepath)
+    thread.join()
+    assert loaded[0].digest() == plan.digest()
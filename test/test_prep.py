@@ -0,0 +1,119 @@
+import re
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from prep import Codebook, parse_coding, recode_ghdx_data
+
+
+YES_NO = '1 "Yes" 0 "No" 9 "Don\'t Know"'
+
+
+@pytest.fixture
+def codebook():
+    return pd.DataFrame({
+        'type': ['categorical', 'categorical', 'categorical', 'numeric',
+                 'word', 'word', 'info'],
+        'coding': [YES_NO, YES_NO, '1 "Grams" 2 "Kilograms"', None, None,
+                   None, None],
+    }, index=pd.Index(['a1', 'a2', 'unit', 'age', 'word_fever',
+                       'word_rash', 'site'], name='variable'))
+
+
+@pytest.fixture
+def raw():
+    return pd.DataFrame({
+        'module': ['Adult'] * 4,
+        'newid': [1, 2, 3, 4],
+        'site': ['AP', 'UP', 'Dar', 'AP'],
+        'a1': ['Yes', 'No', "Don't Know", float('nan')],
+        'a2': ['No', 'No', 'Yes', 'Yes'],
+        'unit': ['Grams', 'Kilograms', 'Stones', 'Grams'],
+        'age': ['45', "Don't Know", '3', '90'],
+        'word_fever': [0, 2, 1, 0],
+        'word_rash': [3, 0, 0, 0],
+    })
+
+
+def recode_by_column(df, codebook):
+    """Recode one column at a time with the parsed coding"""
+    df = df.copy()
+    for col in codebook[codebook.type == 'categorical'].index:
+        coding_str = codebook.at[col, 'coding']
+        coding = dict(zip(re.findall('(?<= ").+?(?=")', coding_str),
+                          map(int, re.findall(r'\d+(?= ")', coding_str))))
+        df[col] = pd.to_numeric(df[col].map(coding))
+    return df
+
+
+def test_parse_coding():
+    assert parse_coding('1 "Grams" 8 "Refused to Answer" 9 "Don\'t Know"') \
+        == {'Grams': 1, 'Refused to Answer': 8, "Don't Know": 9}
+    # Numbers within labels are not values
+    assert parse_coding('1 "1 to 5 days" 2 "More"') == \
+        {'1 to 5 days': 1, 'More': 2}
+
+
+class TestCodebook(object):
+
+    def test_groups_shared_codings(self, codebook):
+        compiled = Codebook(codebook)
+        assert compiled.groups[YES_NO] == ['a1', 'a2']
+
+    def test_matches_column_recode(self, codebook, raw):
+        expected = recode_by_column(raw, codebook)
+        recoded = Codebook(codebook).recode(raw)
+        for col in ['a1', 'a2', 'unit']:
+            pd.testing.assert_series_equal(recoded[col], expected[col])
+
+    def test_recode_ghdx_data(self, codebook, raw):
+        df = recode_ghdx_data(raw, Codebook(codebook))
+        assert df.index.tolist() == ['Adult1', 'Adult2', 'Adult3', 'Adult4']
+        assert df.a1.tolist()[:3] == [1, 0, 9]
+        assert np.isnan(df.a1.iloc[3])
+        assert df.a2.tolist() == [0, 0, 1, 1]
+        assert df.age.tolist()[2:] == [3, 90]
+        assert df.word_fever.tolist() == [0, 1, 1, 0]
+        assert df.word_rash.tolist() == [1, 0, 0, 0]
+        assert df.site.tolist() == raw.site.tolist()
+
+
+class TestCleanedStore(object):
+
+    @pytest.fixture
+    def cleaned(self, monkeypatch, tmpdir):
+        import prep
+        monkeypatch.setattr(prep, 'CLEANED_DATA_DIR', tmpdir.strpath)
+        return pd.DataFrame({
+            'site': ['AP', 'UP', 'Dar'],
+            'gs_text34': ['Stroke', 'AIDS', 'Stroke'],
+            'g5_04a': [45.0, np.nan, 70.0],
+            'a1': [1, 0, 9],
+            'g1_05': ['text', np.nan, 3],
+        }, index=pd.Index(['Adult1', 'Adult2', 'Adult3'], name='sid'))
+
+    def test_roundtrip(self, cleaned):
+        import prep
+        assert prep.save_cleaned_file(cleaned, 'adult').endswith('.parquet')
+        df = prep.load_cleaned_file('adult')
+        assert df.index.equals(cleaned.index)
+        assert df.site.cat.categories.tolist() == prep.SITES
+        assert isinstance(df.gs_text34.dtype, pd.CategoricalDtype)
+        assert df.a1.dtype == np.int64
+        assert df.g1_05.tolist()[::2] == ['text', '3']
+        assert df.g1_05.isnull().iloc[1]
+
+    def test_columns(self, cleaned):
+        import prep
+        prep.save_cleaned_file(cleaned, 'adult')
+        df = prep.load_cleaned_file('adult', columns=['g5_04a'])
+        assert df.columns.tolist() == ['g5_04a']
+        pd.testing.assert_series_equal(df.g5_04a, cleaned.g5_04a)
+
+    def test_reads_csv(self, cleaned):
+        import prep
+        cleaned.to_csv(prep.cleaned_filepath('child', 'csv'))
+        df = prep.load_cleaned_file('child', columns=['a1'])
+        assert df.index.tolist() == cleaned.index.tolist()
+        assert df.a1.tolist() == [1, 0, 9]
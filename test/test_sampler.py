@@ -0,0 +1,216 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from diagnostics import (
+    csmf_diag,
+    effective_sample_size,
+    gelman_rubin,
+    heidel_diag,
+)
+from insilico import InsilicoClassifier
+from sampler import INTERVA_LEVELS, extract_prob, insilico_fit
+from validation import out_of_sample_splits, validate
+
+
+def simulate(n, csmf, cond_prob, random_state):
+    causes = np.arange(len(csmf))
+    y = random_state.choice(causes, n, p=csmf)
+    X = (random_state.uniform(size=(n, len(cond_prob))) <
+         cond_prob[:, y].T).astype(int)
+    X[random_state.uniform(size=X.shape) < 0.05] = -1
+    X = pd.DataFrame(X, columns=['s{}'.format(i) for i in range(X.shape[1])])
+    y = pd.Series(['c{}'.format(c) for c in y])
+    return X, y
+
+
+@pytest.fixture(scope='module')
+def data():
+    rs = np.random.RandomState(8675309)
+    cond_prob = rs.beta(0.5, 2, size=(30, 4))
+    train = simulate(600, [0.25] * 4, cond_prob, rs)
+    test = simulate(400, [0.5, 0.3, 0.15, 0.05], cond_prob, rs)
+    return train, test
+
+
+class TestExtractProb(object):
+    def test_proportions(self):
+        X = pd.DataFrame({'a': [1, 1, 0, 0, 1, -1],
+                          'b': [0, 0, 0, 1, 1, 1]})
+        y = pd.Series(['x', 'x', 'x', 'y', 'y', 'y'])
+        probs = extract_prob(X, y, learning_type='empirical')
+        assert probs.cond_prob.loc['a', 'x'] == pytest.approx(2 / 3)
+        assert probs.cond_prob.loc['a', 'y'] == pytest.approx(1 / 2)
+        assert probs.cond_prob.loc['b', 'x'] == pytest.approx(0, abs=1e-5)
+        assert probs.cond_prob_alpha is None
+
+    def test_drops_missing_symptoms(self):
+        X = pd.DataFrame({'a': [1, 0, 1, 0], 'b': [-1, -1, -1, 1]})
+        y = pd.Series(['x', 'x', 'y', 'y'])
+        probs = extract_prob(X, y, missingness_threshold=0.5)
+        assert probs.cond_prob.index.tolist() == ['a']
+        assert probs.symps_train.columns.tolist() == ['a']
+
+    @pytest.mark.parametrize('learning_type', ['quantile', 'fixed'])
+    def test_levels_are_monotonic(self, data, learning_type):
+        (X, y), _ = data
+        probs = extract_prob(X, y, learning_type=learning_type,
+                             random_state=0)
+        assert probs.cond_prob_alpha.isin(INTERVA_LEVELS).all().all()
+        assert (np.diff(probs.table_num) <= 0).all()
+        rank = {level: i for i, level in enumerate(probs.table_alpha)}
+        ranks = probs.cond_prob_alpha.stack().map(rank)
+        values = probs.cond_prob.stack()
+        order = values.sort_values().index
+        assert (np.diff(ranks.loc[order].values) <= 0).all()
+
+    def test_unknown_learning_type(self, data):
+        (X, y), _ = data
+        with pytest.raises(ValueError):
+            extract_prob(X, y, learning_type='bogus')
+
+
+class TestInsilicoFit(object):
+    @pytest.mark.parametrize('params', [
+        {},
+        {'keep_prob_base_level': False},
+        {'update_cond_prob': False},
+    ])
+    def test_recovers_csmf(self, data, params):
+        (X, y), (X_test, y_test) = data
+        probs = extract_prob(X, y, random_state=0)
+        fit = insilico_fit(X_test, probs.cond_prob, probs.cond_prob_alpha,
+                           probs.table_alpha, probs.table_num, n_sim=1000,
+                           burn_in=500, thin=5, **params)
+        csmf = fit.csmf.mean()
+        true = y_test.value_counts(normalize=True).loc[csmf.index]
+        assert np.abs(csmf - true).max() < 0.05
+        assert np.allclose(fit.indiv_prob.sum(axis=1), 1)
+        assert fit.indiv_prob.index.equals(X_test.index)
+
+    def test_seeded(self, data):
+        (X, y), (X_test, _) = data
+        probs = extract_prob(X, y, random_state=0)
+        fits = [insilico_fit(X_test, *probs[:4], n_sim=200, burn_in=100,
+                             thin=5, auto_length=False, seed=3)
+                for _ in range(2)]
+        pd.testing.assert_frame_equal(fits[0].csmf, fits[1].csmf)
+
+    def test_multiple_chains(self, data):
+        (X, y), (X_test, _) = data
+        probs = extract_prob(X, y, random_state=0)
+        fit = insilico_fit(X_test, *probs[:4], n_sim=1000, burn_in=500,
+                           thin=5, auto_length=False, n_chains=2)
+        assert len(fit.csmf) == 2 * 100
+        assert np.allclose(fit.indiv_prob.sum(axis=1), 1)
+        assert fit.rhat.index.equals(fit.csmf.columns)
+        assert (fit.rhat < 1.1).all()
+        assert fit.converged
+        assert (fit.ess > 0).all()
+
+    def test_chains_are_spawned(self, data, monkeypatch):
+        import multiprocessing
+        import sampler
+        methods = []
+        original = multiprocessing.get_context
+
+        def get_context(method=None):
+            methods.append(method)
+            return original(method)
+
+        monkeypatch.setattr(sampler.multiprocessing, 'get_context',
+                            get_context)
+        (X, y), (X_test, _) = data
+        probs = extract_prob(X, y, random_state=0)
+        insilico_fit(X_test, *probs[:4], n_sim=200, burn_in=100, thin=5,
+                     auto_length=False, n_chains=2, n_jobs=2)
+        assert methods == ['spawn']
+
+
+class TestDiagnostics(object):
+    def test_iid_chain_passes(self):
+        chain = np.random.RandomState(8675309).normal(10, 1, 1000)
+        assert heidel_diag(chain) == (True, True)
+
+    def test_trending_chain_fails(self):
+        rs = np.random.RandomState(8675309)
+        chain = np.linspace(0, 10, 1000) + rs.normal(0, 0.1, 1000)
+        assert not all(heidel_diag(chain))
+
+    def test_ignores_small_causes(self):
+        rs = np.random.RandomState(8675309)
+        csmf = np.column_stack([rs.normal(0.5, 0.01, 500),
+                                np.linspace(0, 0.01, 500)])
+        assert csmf_diag(csmf, conv_csmf=0.02)
+
+    def test_gelman_rubin(self):
+        rs = np.random.RandomState(8675309)
+        chains = rs.normal(size=(4, 500, 2))
+        assert np.allclose(gelman_rubin(chains), 1, atol=0.01)
+        chains[0] += 3
+        assert (gelman_rubin(chains) > 1.5).all()
+
+    def test_effective_sample_size(self):
+        rs = np.random.RandomState(8675309)
+        iid = rs.normal(size=(2, 500))
+        assert effective_sample_size(iid) == pytest.approx(1000, rel=0.2)
+        correlated = np.cumsum(iid, axis=1)
+        assert effective_sample_size(correlated) < 100
+
+
+class TestNumpyEngine(object):
+    def test_predict(self, data):
+        (X, y), (X_test, y_test) = data
+        clf = InsilicoClassifier(engine='numpy', n_sim=1000, burn_in=500,
+                                 thin=5, seed=1, top_k=2)
+        clf.fit(X, y)
+        pred, csmf = clf.predict(X_test.replace({1: 'Y', 0: '', -1: '.'}))
+        assert pred.index.equals(X_test.index)
+        assert set(pred.unique()).issubset(clf.causes_)
+        assert (pred == y_test).mean() > 0.8
+        assert csmf.index.tolist() == clf.causes_
+        assert csmf.sum() == pytest.approx(1)
+        assert clf.converged_ in [True, False]
+        assert (clf.top_causes_.cause1 == pred).all()
+        assert (clf.top_causes_.prob1 >= clf.top_causes_.prob2).all()
+
+    def test_chains_in_split_workers(self, data):
+        # Split workers are daemonic, so they must run the chains serially
+        (X, y), _ = data
+        clf = InsilicoClassifier(engine='numpy', n_sim=200, burn_in=100,
+                                 thin=5, auto_length=False, seed=1,
+                                 n_chains=2, n_jobs=2)
+        splits = out_of_sample_splits(X, y, 2, random_state=0)
+        accuracy = validate(X, y, clf, splits, random_state=0, n_jobs=2)[3]
+        assert accuracy.split.tolist() == [0, 1]
+        assert clf.n_jobs == 2
+
+    def test_agrees_with_r(self, data):
+        # The engines draw from different random streams, so they agree
+        # only up to Monte Carlo error: CSMFs within 0.05 of each other and
+        # the same top cause for at least 90% of the test records
+        pytest.importorskip('rpy2')
+        (X, y), _ = data
+        (train, test, _), = out_of_sample_splits(X, y, 1, random_state=0)
+        X_test = X.iloc[test].replace({1: 'Y', 0: '', -1: '.'})
+        results = []
+        for engine in ['r', 'numpy']:
+            clf = InsilicoClassifier(engine=engine, n_sim=2000, burn_in=1000,
+                                     thin=10, auto_length=False, seed=1)
+            clf.fit(X.iloc[train], y.iloc[train])
+            results.append(clf.predict(X_test))
+        (r_pred, r_csmf), (np_pred, np_csmf) = results
+        assert (r_csmf - np_csmf.reindex(r_csmf.index)).abs().max() < 0.05
+        assert (r_pred == np_pred).mean() >= 0.9
+
+    def test_requires_training_data(self):
+        with pytest.raises(ValueError):
+            InsilicoClassifier(engine='numpy').fit(None)
+
+    def test_multiple_chains_require_numpy(self):
+        with pytest.raises(ValueError):
+            InsilicoClassifier(n_chains=2)
+
+    def test_unknown_engine(self):
+        with pytest.raises(ValueError):
+            InsilicoClassifier(engine='julia')
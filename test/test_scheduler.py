@@ -0,0 +1,101 @@
+import sys
+
+import pytest
+
+from scheduler import JobTable, LocalBackend, experiment_grid, run
+
+
+def python_command(args):
+    """Run the job args as a python snippet instead of ``analysis.py``"""
+    return [sys.executable, '-c'] + args
+
+
+@pytest.fixture
+def table(tmpdir):
+    table = JobTable(tmpdir.join('jobs.sqlite').strpath)
+    yield table
+    table.close()
+
+
+@pytest.fixture
+def backend(tmpdir):
+    return LocalBackend(max_jobs=4, max_mem=10, command=python_command,
+                        log_dir=tmpdir.join('logs').strpath)
+
+
+def test_experiment_grid():
+    jobs = experiment_grid('validate', 4, step=2)
+    assert len(jobs) == 3 * (1 + 2 * 2)
+    assert [job['stage'] for job in jobs[:5]] == [0, 1, 1, 1, 1]
+    assert jobs[0]['name'] == 'validate_insilico_adult_insilico_insilico_plan'
+    assert '--plan-only' in jobs[0]['args']
+    assert jobs[3]['name'] == \
+        'validate_insilico_adult_no_hce_insilico_insilico_splits_0-1'
+    assert jobs[3]['args'][-1] == '--no-hce'
+    assert len({job['name'] for job in jobs}) == len(jobs)
+
+
+class TestJobTable(object):
+
+    def test_add_is_idempotent(self, table):
+        jobs = experiment_grid('default', 2)
+        assert table.add(jobs) == len(jobs)
+        assert table.add(jobs) == 0
+        assert table.counts()['pending'] == len(jobs)
+        assert table.jobs()[0]['args'] == jobs[0]['args']
+
+    def test_reset(self, table):
+        table.add([{'name': 'a', 'args': []}])
+        table.update('a', state='failed', attempts=3)
+        table.reset()
+        job, = table.jobs('pending')
+        assert job['attempts'] == 0
+
+
+class TestRun(object):
+
+    def test_runs_stages_in_order(self, table, backend, tmpdir):
+        marker = tmpdir.join('marker').strpath
+        table.add([
+            {'name': 'second', 'stage': 1,
+             'args': ['import os; assert os.path.exists({!r})'.format(
+                 marker)]},
+            {'name': 'first', 'stage': 0,
+             'args': ['import time; time.sleep(0.2); '
+                      'open({!r}, "w").close()'.format(marker)]},
+        ])
+        counts = run(table, backend, retries=0, interval=0.05)
+        assert counts['done'] == 2
+
+    def test_retries_failed_jobs(self, table, backend, tmpdir):
+        count = tmpdir.join('count').strpath
+        script = ('import os; n = os.path.getsize({0!r}) '
+                  'if os.path.exists({0!r}) else 0; '
+                  'open({0!r}, "a").write("x"); '
+                  'assert n >= 2'.format(count))
+        table.add([{'name': 'flaky', 'args': [script]},
+                   {'name': 'broken', 'args': ['raise SystemExit(3)']},
+                   {'name': 'later', 'stage': 1, 'args': ['pass']}])
+        counts = run(table, backend, retries=2, interval=0.05)
+        assert counts == {'pending': 1, 'running': 0, 'done': 1,
+                          'failed': 1}
+        jobs = {job['name']: job for job in table.jobs()}
+        assert jobs['flaky']['attempts'] == 3
+        assert jobs['broken']['returncode'] == 3
+        assert jobs['later']['state'] == 'pending'
+
+    def test_memory_admission(self, table, backend, tmpdir):
+        log = tmpdir.join('log').strpath
+        script = ('import time; open({!r}, "a").write("s"); time.sleep(0.3); '
+                  'open({!r}, "a").write("e")').format(log, log)
+        table.add([{'name': str(i), 'args': [script], 'mem': 6}
+                   for i in range(3)])
+        assert run(table, backend, interval=0.05)['done'] == 3
+        # Two jobs do not fit in the budget, so they never overlap
+        with open(log) as f:
+            assert f.read() == 'se' * 3
+
+    def test_restarts_interrupted_local_jobs(self, table, backend):
+        table.add([{'name': 'a', 'args': ['pass']}])
+        table.update('a', state='running', handle='123')
+        assert run(table, backend, interval=0.05)['done'] == 1
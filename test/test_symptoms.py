@@ -0,0 +1,89 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from symptoms import SymptomMatrix, as_frame, symptom_encoding
+from validation import (
+    RandomClassifier,
+    dirichlet_resample,
+    out_of_sample_splits,
+    validate,
+)
+
+
+@pytest.fixture
+def df():
+    rs = np.random.RandomState(8675309)
+    return pd.DataFrame(rs.choice([1, 0, -1], size=(40, 3)),
+                        columns=['a', 'b', 'c'],
+                        index=pd.Index(np.arange(100, 140), name='ID'))
+
+
+class TestSymptomEncoding(object):
+
+    def test_numeric(self, df):
+        assert symptom_encoding(df) == 'numeric'
+        assert symptom_encoding(df.astype(np.int8)) == 'numeric'
+        assert symptom_encoding(df.astype(float)) == 'numeric'
+
+    def test_string(self, df):
+        assert symptom_encoding(df.replace({1: 'Y', 0: '', -1: '.'})) == \
+            'string'
+
+    def test_unknown(self, df):
+        assert symptom_encoding(df + 1) is None
+        assert symptom_encoding(df.replace({1: 'yes'})) is None
+
+
+class TestSymptomMatrix(object):
+
+    def test_roundtrip(self, df, tmpdir):
+        filepath = tmpdir.join('symptoms.npy').strpath
+        SymptomMatrix.from_frame(df).save(filepath)
+        matrix = SymptomMatrix.load(filepath)
+        assert isinstance(matrix.values, np.memmap)
+        assert matrix.shape == df.shape
+        loaded = matrix.to_frame()
+        pd.testing.assert_frame_equal(loaded, df.astype(np.int8))
+        assert np.shares_memory(loaded.values, matrix.values)
+
+    def test_overwrite_keeps_mapped_view(self, df, tmpdir):
+        filepath = tmpdir.join('symptoms.npy').strpath
+        SymptomMatrix.from_frame(df).save(filepath)
+        old = SymptomMatrix.load(filepath)
+        SymptomMatrix.from_frame(-df).save(filepath)
+        assert (old.to_frame() == df).all().all()
+        assert (SymptomMatrix.load(filepath).to_frame() == -df).all().all()
+
+    def test_rejects_other_codes(self, df):
+        with pytest.raises(ValueError):
+            SymptomMatrix.from_frame(df + 1)
+        with pytest.raises(ValueError):
+            SymptomMatrix(df.values, df.index[:-1], df.columns)
+
+    def test_as_frame(self, df):
+        assert as_frame(df) is df
+        pd.testing.assert_frame_equal(
+            as_frame(SymptomMatrix.from_frame(df)), df.astype(np.int8))
+
+
+class TestAcceptedByValidation(object):
+
+    def test_dirichlet_resample(self, df):
+        y = pd.Series(np.tile(['x', 'y'], 20), index=df.index)
+        X_new, y_new = dirichlet_resample(SymptomMatrix.from_frame(df), y,
+                                          random_state=3)
+        assert len(X_new) == len(y_new) == len(df)
+        assert (X_new.dtypes == np.int8).all()
+
+    def test_validate(self, df):
+        y = pd.Series(np.tile(['x', 'y'], 20), index=df.index)
+        matrix = SymptomMatrix.from_frame(df)
+        splits = out_of_sample_splits(matrix, y, 3, random_state=13)
+        expected = validate(df, y, RandomClassifier(random_state=1),
+                            out_of_sample_splits(df, y, 3, random_state=13),
+                            random_state=13)
+        results = validate(matrix, y, RandomClassifier(random_state=1),
+                           splits, random_state=13)
+        for output, other in zip(results, expected):
+            pd.testing.assert_frame_equal(output, other)
@@ -6,6 +6,7 @@ import pandas as pd
 import math
 
 from validation import *
+from store import SplitStore
 
 
 @pytest.fixture
@@ -49,3 +50,110 @@ class TestStratifiedShuffleSplit(object):
         assert all([(splits1[i][0] == splits2[i][0]).all() and
                     (splits1[i][1] == splits2[i][1]).all()
                     for i in range(len(splits1))])
+
+
+class TestDirichletResample(object):
+
+    def test_indices(self):
+        y = np.repeat(['a', 'b', 'c'], [5, 30, 65])
+        idx = dirichlet_resample_indices(y, 200, random_state=1)
+        assert len(idx) == 200
+        assert idx.min() >= 0 and idx.max() < len(y)
+        # positions are grouped by cause
+        assert (np.diff(np.unique(y[idx], return_inverse=True)[1]) >= 0).all()
+
+    def test_seeded(self):
+        y = np.tile(np.arange(10), 10)
+        draws = [dirichlet_resample_indices(y, random_state=seed)
+                 for seed in [7, 7, 8]]
+        assert (draws[0] == draws[1]).all()
+        assert not np.array_equal(draws[0], draws[2])
+
+    def test_causes_may_have_no_samples(self):
+        y = np.arange(50)
+        idx = dirichlet_resample_indices(y, 10, random_state=0)
+        assert len(idx) == 10
+        assert len(np.unique(y[idx])) < 50
+
+    def test_frames(self, xyg):
+        x, y, g = xyg
+        x = x.set_index(x.index + 1000)
+        y.index = x.index
+        X_new, y_new = dirichlet_resample(x, y, 40, random_state=2)
+        assert X_new.index.equals(y_new.index)
+        assert (y.loc[y_new.index].values == y_new.values).all()
+
+    def test_mismatched_index(self, xyg):
+        x, y, g = xyg
+        with pytest.raises(ValueError):
+            dirichlet_resample(x, y.set_axis(y.index + 1), random_state=0)
+
+
+class TestParallelValidate(object):
+
+    def test_matches_serial(self, xyg):
+        x, y, g = xyg
+        clf = RandomClassifier(random_state=0)
+        results = [validate(x, y, clf,
+                            out_of_sample_splits(x, y, 3, random_state=0),
+                            random_state=13, n_jobs=n_jobs)
+                   for n_jobs in [1, 2]]
+        for serial, parallel in zip(*results):
+            pd.testing.assert_frame_equal(serial, parallel)
+        assert results[1][3].split.tolist() == [0, 1, 2]
+
+    def test_subset_uses_split_seed(self, xyg):
+        x, y, g = xyg
+        clf = RandomClassifier(random_state=0)
+        full = validate(x, y, clf, in_sample_splits(x, y, 3),
+                        random_state=8675309)[0]
+        part = validate(x, y, clf, in_sample_splits(x, y, 3), subset=(2, 2),
+                        random_state=8675309)[0]
+        pd.testing.assert_frame_equal(full[full.split == 2], part)
+
+
+class TestSplitStore(object):
+
+    def test_resumes(self, xyg, tmpdir, monkeypatch):
+        x, y, g = xyg
+        clf = RandomClassifier(random_state=0)
+        store = SplitStore(tmpdir.strpath, {'seed': 8675309})
+        first = validate(x, y, clf, in_sample_splits(x, y, 2), store=store,
+                         random_state=8675309)
+        assert store.completed() == {0, 1}
+
+        def fail(*args, **kwargs):
+            raise AssertionError('Completed split was run again')
+
+        monkeypatch.setattr(clf, 'fit', fail)
+        second = validate(x, y, clf, in_sample_splits(x, y, 2), store=store,
+                          random_state=8675309)
+        for a, b in zip(first, second):
+            pd.testing.assert_frame_equal(a, b)
+
+    def test_extends(self, xyg, tmpdir):
+        x, y, g = xyg
+        clf = RandomClassifier(random_state=0)
+        store = SplitStore(tmpdir.strpath)
+        validate(x, y, clf, in_sample_splits(x, y, 3), subset=(0, 0),
+                 store=store)
+        accuracy = validate(x, y, clf, in_sample_splits(x, y, 3),
+                            store=store)[3]
+        assert accuracy.split.tolist() == [0, 1, 2]
+        assert store.completed() == {0, 1, 2}
+        assert store.load()[3].split.tolist() == [0, 1, 2]
+
+    def test_rejects_other_positions(self, tmpdir):
+        store = SplitStore(tmpdir.strpath, digests={0: 'a', 1: 'b'})
+        store.write(0, [pd.DataFrame()])
+        assert SplitStore(tmpdir.strpath, digests={0: 'a', 1: 'c'})
+        with pytest.raises(ValueError):
+            SplitStore(tmpdir.strpath, digests={0: 'c'})
+        store.clear()
+        assert SplitStore(tmpdir.strpath, digests={0: 'c'})
+
+    def test_rejects_other_params(self, tmpdir):
+        store = SplitStore(tmpdir.strpath, {'seed': 1})
+        store.write(0, [pd.DataFrame()])
+        with pytest.raises(ValueError):
+            SplitStore(tmpdir.strpath, {'seed': 2})